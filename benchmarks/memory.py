@@ -0,0 +1,101 @@
+"""
+Memory benchmark for holding a large module tree in memory.
+
+Builds N module versions with 10 paths each, as Module.from_file would, once
+with plain classes carrying an instance dictionary and uninterned strings (the
+previous representation) and once with moduledev's Module and Path classes,
+and reports the memory allocated by each.
+
+    python benchmarks/memory.py [N]
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from moduledev import Module, Path  # noqa: E402
+
+PATHS = [
+    ("prepend-path", "PATH", "bin"),
+    ("prepend-path", "LD_LIBRARY_PATH", "lib"),
+    ("prepend-path", "LIBRARY_PATH", "lib"),
+    ("prepend-path", "CPATH", "include"),
+    ("prepend-path", "MANPATH", "man"),
+    ("prepend-path", "PKG_CONFIG_PATH", "pkgconfig"),
+    ("append-path", "PYTHONPATH", "site-packages"),
+    ("append-path", "INFOPATH", "info"),
+    ("setenv", "CMAKE_PREFIX_PATH", "cmake"),
+    ("append-path", "XDG_DATA_DIRS", "share"),
+]
+
+
+class DictPath:
+    def __init__(self, path, operation, name):
+        self.operation, self.name, self.path = operation, name, path
+
+
+class DictModule:
+    def __init__(self, name, version, maintainer, helptext, description):
+        self.root = None
+        self.name = name
+        self.version = version
+        self.maintainer = maintainer
+        self.helptext = helptext
+        self.description = description
+        self.category = None
+        self.shared = True
+        self.extra_vars = {}
+        self.extra_commands = []
+        self.paths = []
+
+
+def parsed_fields(line):
+    """Return freshly allocated strings, as shlex.split does for every line"""
+    return "".join(line).split(" ")
+
+
+def build(n, module_cls, path_cls):
+    modules = []
+    for i in range(n):
+        name = parsed_fields(f"package{i % (n // 25 or 1)}")[0]
+        maintainer = " ".join(parsed_fields("Jane Doe <jane@example.com>"))
+        description = parsed_fields("A package description")[0]
+        module = module_cls(name, str(i % 25), maintainer, "", description)
+        for operation, var, path in PATHS:
+            op, var_name, path_str = parsed_fields(f"{operation} {var} $basedir/{path}")
+            module.paths.append(path_cls(path_str, op, var_name))
+        modules.append(module)
+    return modules
+
+
+def measure(n, module_cls, path_cls):
+    tracemalloc.start()
+    modules = build(n, module_cls, path_cls)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del modules
+    return size
+
+
+def compact_module(name, version, maintainer, helptext, description):
+    return Module(None, name, version, maintainer, helptext, description)
+
+
+def compact_path(path, operation, name):
+    return Path(path, operation, name)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    before = measure(n, DictModule, DictPath)
+    after = measure(n, compact_module, compact_path)
+    print(f"{n} module versions with {len(PATHS)} paths each")
+    print(f"dict-based, uninterned: {before / 2 ** 20:8.1f} MiB")
+    print(f"moduledev:              {after / 2 ** 20:8.1f} MiB")
+    print(f"reduction:              {100 * (1 - after / before):8.1f} %")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,24 @@
+from .bulk import BulkUpdate
 from .config import Config
-from .module import Module, ModuleBuilder, ModuleLoader, ModuleTree, Path
+from .depgraph import Dependency, DependencyGraph
+from .federation import FederatedTree
+from .garbage import Garbage, GarbageCollector
+from .install import BuildRecipe, Installer
+from .journal import Intent, Journal
+from .lint import Diagnostic, ModuleLinter
+from .module import (
+    Module,
+    ModuleBuilder,
+    ModuleDescriptor,
+    ModuleLoader,
+    ModuleTree,
+    Path,
+)
+from .prune import Pruner, RetentionPolicy
+from .relocate import TreeRelocation
+from .render import TreeRenderer
+from .sync import TreeSync
+from .trash import Trash, TrashEntry
 from .util import valid_package_name, valid_version, version_key, writeable_dir
 
 __version__ = '0.2'
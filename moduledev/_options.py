@@ -6,7 +6,23 @@ def force_option(f):
 
 
 def version_option(f):
-    return option("--version", help="Specify the module version (default to latest)")(f)
+    return option(
+        "--version",
+        help="Specify the module version or a version constraint such as "
+        "'>=2.1,<3', '2.10.*' or '~=1.4' (default to latest)",
+    )(f)
+
+
+def jobs_option(f):
+    return option(
+        "--jobs", "-j", type=int, help="Number of concurrent workers (default: auto)"
+    )(f)
+
+
+def dry_run_option(f):
+    return option(
+        "--dry-run", is_flag=True, help="Show what would be done without doing it"
+    )(f)
 
 
 def copy_option(f):
@@ -17,12 +33,38 @@ def copy_option(f):
     )(f)
 
 
+def hardlink_option(f):
+    return option(
+        "--hardlink",
+        is_flag=True,
+        help="Recreate the directories and hardlink the files contained in the "
+        "path, copying them if they are on another device",
+    )(f)
+
+
 def overwrite_option(f):
     return option(
         "--overwrite", is_flag=True, help="Overwrite an old path if it exists."
     )(f)
 
 
+def category_option(f):
+    return option(
+        "--category", help="Set a category for the module (defaults to the repo name)"
+    )(f)
+
+
+def shared_option(f):
+    return option(
+        "--shared/--detached",
+        "shared",
+        default=True,
+        help="Use a shared module file (default) that has the same "
+        "relative paths and description as all versions of the package, "
+        "or a detached version-specific module file.",
+    )(f)
+
+
 def module_arg(f):
     return argument("MODULE_NAME")(f)
 
@@ -38,5 +80,7 @@ def path_add_options(f):
     f = module_arg(f)
     f = version_option(f)
     f = copy_option(f)
+    f = hardlink_option(f)
+    f = jobs_option(f)
     f = overwrite_option(f)
     return f
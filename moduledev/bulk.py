@@ -0,0 +1,212 @@
+import difflib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+
+from . import journal, render, util
+from .module import Module
+
+FIELDS = {
+    "MAINTAINER": "maintainer",
+    "HELPTEXT": "helptext",
+    "DESCRIPTION": "description",
+}
+
+
+def parse_assignment(assignment):
+    """Split a VAR=VALUE assignment"""
+    var, sep, value = assignment.partition("=")
+    if not sep or not len(var) or not valid_variable_name(var):
+        raise ValueError(f"Invalid assignment {assignment}, expected VAR=VALUE")
+    if '"' in value:
+        raise ValueError(f"Values may not contain double quotes: {assignment}")
+    return var, value
+
+
+def valid_variable_name(var):
+    return util.valid_package_name(var) and not var[0].isdigit()
+
+
+class BulkChange:
+    """The change of a single .modulefile"""
+
+    def __init__(self, dotfile, old_text, new_text, name=None, version=None):
+        """
+        :param dotfile: the path of the .modulefile
+        :param old_text: the current contents
+        :param new_text: the changed contents
+        :param name: the name of the module
+        :param version: the version of a detached .modulefile, or None for a
+            shared one
+        """
+        self.dotfile = dotfile
+        self.old_text = old_text
+        self.new_text = new_text
+        self.name = name
+        self.version = version
+
+    def diff(self):
+        """Return the change as a unified diff"""
+        return "".join(
+            difflib.unified_diff(
+                self.old_text.splitlines(True),
+                self.new_text.splitlines(True),
+                fromfile=self.dotfile,
+                tofile=self.dotfile,
+            )
+        )
+
+    def apply(self):
+        util.atomic_write(self.dotfile, self.new_text)
+
+    def __repr__(self):
+        return self.dotfile
+
+
+class BulkUpdate:
+    """
+    Applies the same variable updates to the .modulefiles of many modules.
+    Within each selection criterion, any value may match. A module has to
+    match every criterion that is given. Without any criteria, all modules
+    are selected. Shared .modulefiles are rewritten once.
+    """
+
+    def __init__(
+        self,
+        module_tree,
+        names=None,
+        categories=None,
+        patterns=None,
+        maintainers=None,
+        jobs=None,
+    ):
+        """
+        :param module_tree: a ModuleTree object
+        :param names: a list of module names
+        :param categories: a list of categories
+        :param patterns: a list of glob patterns matching module names
+        :param maintainers: a list of glob patterns matching the maintainer
+        :param jobs: the number of concurrent workers
+        """
+        self.module_tree = module_tree
+        self.names = names
+        self.categories = categories
+        self.patterns = patterns
+        self.maintainers = maintainers
+        self.jobs = jobs
+        self.errors = []
+
+    def _module_categories(self):
+        """Return a dict of module names to their categories"""
+        modulefile_dir = self.module_tree.modulefile_dir()
+        categories = {}
+        for category in os.listdir(modulefile_dir):
+            category_dir = os.path.join(modulefile_dir, category)
+            if os.path.isdir(category_dir):
+                for name in os.listdir(category_dir):
+                    categories.setdefault(name, category)
+        return categories
+
+    def _select_name(self, name):
+        if self.names and name not in self.names:
+            return False
+        if self.patterns and not any(fnmatch(name, p) for p in self.patterns):
+            return False
+        return True
+
+    def dotfiles(self):
+        """
+        Return the .modulefiles of the selected modules without considering
+        the maintainer, which is only known once a .modulefile is parsed.
+
+        :return: a list of (dotfile, name, version, shared, category) tuples
+        """
+        categories = self._module_categories()
+        root = self.module_tree.root_dir
+        dotfiles = []
+        for name in sorted(self.module_tree.module_names()):
+            base = os.path.join(root, name)
+            category = categories.get(name)
+            if not os.path.isdir(base) or not self._select_name(name):
+                continue
+            if self.categories and category not in self.categories:
+                continue
+            versions = sorted(
+                (v for v in os.listdir(base) if util.valid_version(v)),
+                key=util.version_key,
+            )
+            shared = os.path.join(base, ".modulefile")
+            if len(versions) and os.path.isfile(shared):
+                dotfiles.append((shared, name, versions[-1], True, category))
+            for version in versions:
+                detached = os.path.join(base, version, ".modulefile")
+                if os.path.isfile(detached):
+                    dotfiles.append((detached, name, version, False, category))
+        return dotfiles
+
+    def _update(self, entry, updates):
+        dotfile, name, version, shared, category = entry
+        try:
+            module = Module.from_file(
+                dotfile, self.module_tree, name, version, shared, category
+            )
+        except (OSError, ValueError) as e:
+            self.errors.append(f"{e}")
+            return None
+        if self.maintainers and not any(
+            fnmatch(module.maintainer, m) for m in self.maintainers
+        ):
+            return None
+        for var, value in updates.items():
+            if var in FIELDS:
+                setattr(module, FIELDS[var], value)
+            else:
+                module.extra_vars[var] = value
+        with open(dotfile) as f:
+            old_text = f.read()
+        new_text = module.dump()
+        if new_text == old_text:
+            return None
+        return BulkChange(
+            dotfile, old_text, new_text, name, None if shared else version
+        )
+
+    def plan(self, updates):
+        """
+        Compute the changes of the selected .modulefiles concurrently.
+        .modulefiles which cannot be parsed are skipped and recorded in the
+        errors of this object, since rewriting them would lose their
+        unparsable lines.
+
+        :param updates: a dict of variables to their new values
+        :return: a list of BulkChange objects
+        """
+        self.errors = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            changes = executor.map(lambda e: self._update(e, updates), self.dotfiles())
+            return [c for c in changes if c is not None]
+
+    def apply(self, changes):
+        """Write the changed .modulefiles concurrently and atomically. The
+        changes are recorded in the journal of the tree as a single batch.
+        Lua modulefiles are rendered again once all .modulefiles are
+        written."""
+        intents = [
+            journal.Intent(
+                journal.Intent.WRITE,
+                c.dotfile,
+                path=c.dotfile,
+                text=c.new_text,
+                name=c.name,
+                version=c.version,
+            )
+            for c in changes
+        ]
+        with journal.Journal(self.module_tree).transaction(intents):
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                list(executor.map(BulkChange.apply, changes))
+            render.update_versions(
+                self.module_tree,
+                [(c.name, c.version) for c in changes if c.name is not None],
+                self.jobs,
+            )
@@ -1,9 +1,42 @@
+import json
 import os
+import sys
+from functools import partial
 from subprocess import call
 
 import click
 
-from . import Config, Module, ModuleTree, Path, util
+from . import (
+    BuildRecipe,
+    BulkUpdate,
+    Config,
+    FederatedTree,
+    GarbageCollector,
+    Installer,
+    Journal,
+    Module,
+    ModuleLinter,
+    ModuleTree,
+    Path,
+    Pruner,
+    RetentionPolicy,
+    Trash,
+    TreeRelocation,
+    TreeSync,
+    bulk,
+    clone,
+    completion,
+    depgraph,
+    environment,
+    integrity,
+    pack,
+    prune,
+    query,
+    render,
+    snapshot,
+    usage,
+    util,
+)
 from ._color import (
     GROUP_CLR,
     INFO_CLR,
@@ -13,9 +46,13 @@ from ._color import (
     ModuleDevGroup,
 )
 from ._options import (
+    category_option,
+    dry_run_option,
     force_option,
+    jobs_option,
     module_arg,
     path_add_options,
+    shared_option,
     version_arg,
     version_option,
 )
@@ -65,7 +102,9 @@ class CliCfg:
 
         :return: a path to the root
         """
-        result = self.root or self.config.get("root")
+        result = self.root[0] if self.root else self.config.get("root")
+        if result is None and self.config.get("roots"):
+            result = self._config_roots()[0]
         if result is None:
             raise SystemExit(
                 "No module root set. Add it to the configuration "
@@ -74,6 +113,41 @@ class CliCfg:
 
         return result
 
+    def _config_roots(self):
+        roots = self.config.get("roots")
+        if isinstance(roots, str):
+            roots = roots.split(":")
+        return roots
+
+    def check_roots(self):
+        """
+        Return the roots to query in order of precedence. These are either the
+        roots given on the commandline, the "roots" list in the configuration or
+        the single configured root.
+
+        :return: a list of paths
+        """
+        if self.root:
+            return self.root
+        if self.config.get("roots"):
+            return self._config_roots()
+        return [self.check_root()]
+
+    def check_federated_tree(self):
+        """
+        Check that all roots have a valid module tree.
+
+        :return: a FederatedTree of all roots
+        """
+        module_trees = [ModuleTree(root) for root in self.check_roots()]
+        for module_tree in module_trees:
+            if not module_tree.valid():
+                raise SystemExit(
+                    f"Module tree {module_tree.root_dir} not set up. "
+                    f"Run moduledev setup first."
+                )
+        return FederatedTree(module_trees)
+
     def check_module_tree(self):
         """
         Check that the root exists and has a valid module tree.
@@ -94,7 +168,11 @@ class CliCfg:
         exists. If it does not exist, inform the user and exit.
         """
 
-        if not module_tree.module_exists(module_name, version):
+        try:
+            exists = module_tree.module_exists(module_name, version)
+        except ValueError as e:
+            raise SystemExit(f"Error loading module: {e}")
+        if not exists:
             module_display = f"{module_name}"
             if version is not None:
                 module_display += f"-{version}"
@@ -110,7 +188,13 @@ class CliCfg:
 @click.option(
     "--maintainer", help="Set the package maintainer, overriding configuration"
 )
-@click.option("--root", help="Set the module root directory, overriding configuration")
+@click.option(
+    "--root",
+    multiple=True,
+    help="Set the module root directory, overriding configuration. May be given "
+    "multiple times for list, show and location to query several roots in order "
+    "of precedence; other commands use the first root.",
+)
 @click.pass_context
 def mdcli(ctx, maintainer, root):
     """
@@ -122,45 +206,12 @@ def mdcli(ctx, maintainer, root):
     ctx.obj = CliCfg(root, maintainer)
 
 
-@mdcli.command(cls=ModuleDevCommand, short_help_color=SETUP_CLR)
-@force_option
-@click.option(
-    "--category", help="Set a category for the module (defaults to the repo name)"
-)
-@click.option(
-    "--shared/--detached",
-    "shared",
-    default=True,
-    help="Use a shared module file (default) that has the same "
-    "relative paths and description as all versions of the package, "
-    "or a detached version-specific module file.",
-)
-@module_arg
-@click.argument("VERSION")
-@click.argument("DESCRIPTION", default="", required=False)
-@click.argument("HELPTEXT", default="", required=False)
-@click.pass_context
-def init(ctx, shared, force, module_name, version, helptext, description, category):
+def new_module(ctx, module_name, version, shared, description, helptext, category):
     """
-    Create a new module or add a module version. For example, the
-    command
-
-    moduledev init --root /path/to/root hello 1.0
-
-    creates the folloing directory structure:
+    Validate the name and version of a new module version and create its
+    Module object, reusing a shared .modulefile which exists.
 
-    \b
-    /path/to/root
-    |-- hello
-    |   |-- .modulefile
-    |   |-- 1.0
-    `-- modulefile
-        `-- eg
-            `-- hello
-                |-- 1.0 -> /path/to/root/module/example_modulefile
-
-    Subsequently paths can be added to the module structure.
-    Note moduledev setup must be run before this command.
+    :return: a tuple of the module tree and the Module
     """
     maintainer = ctx.obj.maintainer or ctx.obj.config.get("maintainer")
     if maintainer is None:
@@ -210,6 +261,43 @@ def init(ctx, shared, force, module_name, version, helptext, description, catego
             category=category,
             shared=shared,
         )
+    return module_tree, m
+
+
+@mdcli.command(cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@force_option
+@category_option
+@shared_option
+@module_arg
+@click.argument("VERSION")
+@click.argument("DESCRIPTION", default="", required=False)
+@click.argument("HELPTEXT", default="", required=False)
+@click.pass_context
+def init(ctx, shared, force, module_name, version, helptext, description, category):
+    """
+    Create a new module or add a module version. For example, the
+    command
+
+    moduledev init --root /path/to/root hello 1.0
+
+    creates the folloing directory structure:
+
+    \b
+    /path/to/root
+    |-- hello
+    |   |-- .modulefile
+    |   |-- 1.0
+    `-- modulefile
+        `-- eg
+            `-- hello
+                |-- 1.0 -> /path/to/root/module/example_modulefile
+
+    Subsequently paths can be added to the module structure.
+    Note moduledev setup must be run before this command.
+    """
+    module_tree, m = new_module(
+        ctx, module_name, version, shared, description, helptext, category
+    )
     if not module_tree.module_clean(m) and not force:
         raise SystemExit(
             f"Some file exist where the module should be "
@@ -221,24 +309,189 @@ def init(ctx, shared, force, module_name, version, helptext, description, catego
 
 @mdcli.command(cls=ModuleDevCommand, short_help_color=SETUP_CLR)
 @force_option
+@category_option
+@shared_option
+@click.option(
+    "--recipe",
+    type=click.Path(exists=True, dir_okay=False),
+    help="A YAML file overriding the configure, build and install commands and "
+    "listing toolchain modules (default: ./configure, make -j and make install)",
+)
+@click.option(
+    "--toolchain",
+    multiple=True,
+    metavar="NAME[/VERSION]",
+    help="Load a module of the tree for the build. May be given multiple times",
+)
+@click.option("--rebuild", is_flag=True, help="Build even if the build is cached")
+@click.option("--description", default="", help="Set the module description")
+@click.option("--helptext", default="", help="Set the module help text")
+@jobs_option
+@module_arg
+@click.argument("VERSION")
+@click.argument("TARBALL", type=click.Path(exists=True, dir_okay=False))
+@click.pass_context
+def install(
+    ctx,
+    force,
+    category,
+    shared,
+    recipe,
+    toolchain,
+    rebuild,
+    description,
+    helptext,
+    jobs,
+    module_name,
+    version,
+    tarball,
+):
+    """Build a module version from a source tarball and install it. The
+    tarball is unpacked and built with the commands of the recipe, by default
+
+    \b
+    ./configure --prefix="$PREFIX"
+    make -j"$JOBS"
+    make install
+
+    where PREFIX is a directory in the build cache of the tree, keyed by the
+    hashes of the tarball and the recipe and the versions of the toolchain
+    modules. The module version is then initialized and the bin, lib, man and
+    pkgconfig directories of the build are linked into it. Installing an
+    unchanged package again reuses the cached build."""
+    module_tree, m = new_module(
+        ctx, module_name, version, shared, description, helptext, category
+    )
+    try:
+        build_recipe = BuildRecipe.load(recipe) if recipe else BuildRecipe()
+        installer = Installer(module_tree, build_recipe, toolchain, jobs)
+        click.echo(f"Installing {os.path.basename(tarball)}...", err=True)
+        builder, cached = installer.install(m, tarball, force, rebuild)
+    except FileExistsError as e:
+        raise SystemExit(f"{e} Use --force to overwrite them.")
+    except (OSError, RuntimeError, ValueError) as e:
+        raise SystemExit(f"Cannot install {module_name}/{version}: {e}")
+    paths = ", ".join(os.path.basename(p.path) for p in builder.module.paths)
+    click.echo(
+        f"Installed {module_name}/{version} "
+        f"({'cached build' if cached else 'built'}: {paths or 'no paths'})"
+    )
+
+
+@mdcli.command(cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@force_option
+@click.option(
+    "--undo",
+    is_flag=True,
+    help="Restore the most recently removed version of the module from the trash",
+)
 @module_arg
 @version_arg
 @click.pass_context
-def rm(ctx, module_name, force, version):
+def rm(ctx, module_name, force, undo, version):
     """Remove a module. Will default to the latest version of the module if no
-    version is provided."""
+    version is provided. Modules depending on the removed module are reported
+    and removal is refused unless --force is given.
+
+    The module is moved into the trash of the tree at once and deleted in the
+    background once the undo window (the trash_window setting, 10m by default)
+    has passed. Until then, it can be restored with --undo."""
     module_tree = ctx.obj.check_module_tree()
+    trash = Trash(module_tree)
+    if undo:
+        entry = trash.find(module_name, version)
+        if entry is None:
+            raise SystemExit(f"No removed version of {module_name} in the trash.")
+        try:
+            entry.restore(module_tree)
+        except ValueError as e:
+            raise SystemExit(f"{e}")
+        click.echo(f"Restored {entry.name}/{entry.version}")
+        return
+    window = ctx.obj.config.get("trash_window") or Trash.DEFAULT_WINDOW
+    try:
+        window = prune.parse_age(f"{window}")
+    except ValueError as e:
+        raise SystemExit(f"Invalid trash_window setting: {e}")
     loader = ctx.obj.check_module(module_tree, module_name, version)
+    graph = depgraph.DependencyGraph(module_tree).load_dependents(loader.name())
+    dependents = graph.dependents(loader.name(), loader.version())
+    if len(dependents):
+        log_error(f"The following modules depend on {loader.module}:")
+        for dependent in dependents:
+            log_error(f"  {dependent}")
+        if not force:
+            raise SystemExit("Use --force to remove it anyway.")
     if not force:  # pragma: no cover
         if not click.confirm(f"Really delete {loader.module}?  "):
             raise SystemExit("Operation cancelled by user")
-    loader.clear()
+    if trash.put(loader) is not None:
+        trash.spawn_worker(window)
+
+
+@mdcli.command(name="clone", cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@click.option(
+    "--replace",
+    "replacements",
+    nargs=2,
+    multiple=True,
+    metavar="OLD NEW",
+    help="Replace the prefix OLD of symlinked paths with NEW (may be given "
+    "multiple times)",
+)
+@click.option(
+    "--copy",
+    is_flag=True,
+    help="Copy the files of copied paths instead of reflinking or hardlinking",
+)
+@module_arg
+@click.argument("FROM_VERSION")
+@click.argument("TO_VERSION")
+@click.pass_context
+def clone_module(ctx, module_name, from_version, to_version, replacements, copy):
+    """Create version TO_VERSION of a module from FROM_VERSION, e.g. for a patch
+    release staged in a new directory:
+
+    moduledev clone hello 2.10 2.11 --replace /stage/hello-2.10 /stage/hello-2.11
+
+    A shared .modulefile is reused, a detached one is copied. Symlinked paths
+    are linked again, with their targets rewritten by the replacements. The
+    files of copied paths are reflinked where the filesystem supports it and
+    hardlinked otherwise, so hardlinked files should not be changed in
+    place."""
+    module_tree = ctx.obj.check_module_tree()
+    loader = ctx.obj.check_module(module_tree, module_name, from_version)
+    try:
+        builder, dangling = clone.clone_version(loader, to_version, replacements, copy)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Could not clone {loader.module}: {e}")
+    for link in dangling:
+        log_error(f"{link} points to {os.readlink(link)}, which does not exist")
+    click.echo(f"Created {builder.module} in {builder.module_path()}")
 
 
 @mdcli.command(cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@click.option(
+    "--seed",
+    type=click.File("rb"),
+    help="Populate the new tree from a snapshot created with moduledev export",
+)
+@click.option(
+    "--relative",
+    is_flag=True,
+    help="Use relative modulefile links, such that the tree can be moved freely",
+)
+@click.option(
+    "--backend",
+    type=click.Choice(render.BACKENDS),
+    default="tcl",
+    show_default=True,
+    help="Also render a Lua modulefile for every version, which Lmod prefers "
+    "over the Tcl modulefile",
+)
 @click.argument("REPO_NAME")
 @click.pass_context
-def setup(ctx, repo_name):
+def setup(ctx, repo_name, seed, relative, backend):
     """
     Set up the root directory structure. The root
     itself should be set either here in the configuration (as "root"). This will
@@ -265,7 +518,10 @@ def setup(ctx, repo_name):
             fg="red",
         )
         raise SystemExit(" ")
-    module_tree.setup(repo_name)
+    try:
+        module_tree.setup(repo_name, seed, relative, backend)
+    except ValueError as e:
+        raise SystemExit(f"Could not import snapshot: {e}")
     click.echo("Module repository successfully setup in\n")
     click.secho(f"{used_root}\n", bold=True)
     click.echo(
@@ -318,8 +574,20 @@ def path():
 
 
 def path_add(
-    ctx, version, module_name, variable_name, src_path, dst_path, copy, overwrite, verb,
+    ctx,
+    version,
+    module_name,
+    variable_name,
+    src_path,
+    dst_path,
+    copy,
+    hardlink,
+    jobs,
+    overwrite,
+    verb,
 ):
+    if copy and hardlink:
+        raise click.UsageError("--copy and --hardlink are mutually exclusive")
     if not os.path.exists(src_path):
         raise SystemExit(f"Cannot add path: source path {src_path} does not exist.")
     if dst_path is None:
@@ -330,14 +598,14 @@ def path_add(
     )
     path_obj = Path(dst_path, f"{verb}", variable_name)
     if loader.path_exists(path_obj):
-        if overwrite:
-            loader.remove_path(path_obj)
-        else:
+        if not overwrite:
             raise SystemExit(
                 f"Path {path_obj.path} already exists. " f"Use --overwrite to force."
             )
-    loader.add_path(src_path, path_obj, not copy)
-    loader.save_module_file()
+        loader.replace_path(src_path, path_obj, not copy, hardlink, jobs)
+    else:
+        loader.add_path(src_path, path_obj, not copy, hardlink, jobs)
+        loader.save_module_file()
     warn_unfulfilled_paths(module_tree, loader.module, log_error)
 
 
@@ -367,18 +635,19 @@ def setenv(*args, **kwargs):
 
 
 @path.command(name="rm", cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@jobs_option
 @version_option
 @module_arg
 @click.argument("SRC_PATH")
 @click.pass_context
-def path_rm(ctx, module_name, src_path, version):
+def path_rm(ctx, module_name, src_path, version, jobs):
     """Remove a path from a module"""
     module_tree = ctx.obj.check_module_tree()
     loader = ctx.obj.check_module(
         module_tree, module_name, version, parse_error_handler=log_error_and_exit
     )
     path_obj = Path(src_path)
-    loader.remove_path(path_obj)
+    loader.remove_path(path_obj, jobs)
     loader.save_module_file()
 
 
@@ -398,6 +667,67 @@ def path_list(ctx, module_name, version):
     )
 
 
+@mdcli.group(name="bulk", cls=ModuleDevGroup, short_help_color=GROUP_CLR)
+def bulk_group():
+    """Modify many modules at once"""
+    pass
+
+
+@bulk_group.command(name="set", cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@click.option("--name", "names", multiple=True, help="Select a module by name")
+@click.option(
+    "--category", "categories", multiple=True, help="Select modules in a category"
+)
+@click.option(
+    "--glob", "patterns", multiple=True, help="Select modules matching a pattern"
+)
+@click.option(
+    "--maintainer",
+    "maintainers",
+    multiple=True,
+    help="Select modules whose maintainer matches a pattern",
+)
+@force_option
+@dry_run_option
+@jobs_option
+@click.argument("ASSIGNMENTS", metavar="VAR=VALUE...", nargs=-1, required=True)
+@click.pass_context
+def bulk_set(
+    ctx, assignments, names, categories, patterns, maintainers, force, dry_run, jobs
+):
+    """Set MAINTAINER, HELPTEXT, DESCRIPTION or any other variable in the
+    .modulefiles of all selected modules, e.g.
+
+    moduledev bulk set --maintainer '*jdoe*' MAINTAINER="Jane Roe <jr@x.org>"
+
+    Each option may be given multiple times, and a module is selected if it
+    matches any value of every given option. Without options, all modules are
+    selected. With --dry-run, the changes are shown as a diff."""
+    module_tree = ctx.obj.check_module_tree()
+    try:
+        updates = dict(bulk.parse_assignment(a) for a in assignments)
+    except ValueError as e:
+        raise click.UsageError(f"{e}")
+    bulk_update = BulkUpdate(
+        module_tree, names, categories, patterns, maintainers, jobs
+    )
+    changes = bulk_update.plan(updates)
+    for error in bulk_update.errors:
+        log_error(f"Skipping unparsable .modulefile: {error}")
+    if not len(changes):
+        click.echo("Nothing to change.")
+        return
+    if dry_run:
+        for change in changes:
+            click.echo(change.diff(), nl=False)
+        return
+    if not force:  # pragma: no cover
+        if not click.confirm(f"Really rewrite {len(changes)} .modulefiles?  "):
+            raise SystemExit("Operation cancelled by user")
+    bulk_update.apply(changes)
+    click.echo(f"Updated {len(changes)} .modulefiles.")
+
+
 @mdcli.command(cls=ModuleDevCommand, short_help_color=INTERACT_CLR)
 @click.option("--editor", help="Specify the editor", default=EDITOR, show_default=True)
 @version_option
@@ -410,6 +740,8 @@ def edit(ctx, module_name, version, editor):
         module_tree, module_name, version, log_error_and_wait_for_confirmation
     )
     call([editor, loader.moduledotfile_path()])
+    loader.load(error_handler=log_error)
+    loader.update_caches()
 
 
 @mdcli.command(cls=ModuleDevCommand, short_help_color=INFO_CLR)
@@ -418,7 +750,7 @@ def edit(ctx, module_name, version, editor):
 @click.pass_context
 def show(ctx, module_name, version):
     """Show the contents of a module's module file"""
-    module_tree = ctx.obj.check_module_tree()
+    module_tree = ctx.obj.check_federated_tree()
     loader = ctx.obj.check_module(module_tree, module_name, version)
     click.echo("".join(open(loader.moduledotfile_path()).readlines()))
 
@@ -434,17 +766,535 @@ def show(ctx, module_name, version):
 @click.pass_context
 def list(ctx, all_versions):
     """Show all available modules"""
-    module_tree = ctx.obj.check_module_tree()
-    for module in module_tree.modules(all_versions):
+    module_tree = ctx.obj.check_federated_tree()
+    for module in module_tree.modules(all_versions, lazy=True):
         click.echo(f"{module.name} {module.version}")
 
 
+@mdcli.command(cls=ModuleDevCommand, short_help_color=INFO_CLR)
+@click.option(
+    "--all",
+    "all_versions",
+    is_flag=True,
+    help="Show all versions of each module (default is to show "
+    "the current version only)",
+)
+@click.option(
+    "--sort",
+    type=click.Choice(["name", "size"]),
+    default="name",
+    show_default=True,
+    help="Sort the versions by name or by size, largest first",
+)
+@click.option("--external", is_flag=True, help="List the symlinked paths")
+@click.option("--bytes", "in_bytes", is_flag=True, help="Show sizes in bytes")
+@click.option("--no-cache", is_flag=True, help="Do not use the disk usage cache")
+@jobs_option
+@click.argument("MODULE_NAMES", nargs=-1)
+@click.pass_context
+def du(ctx, module_names, all_versions, sort, external, in_bytes, no_cache, jobs):
+    """Show the disk usage of modules. Files with several hardlinks are
+    counted once. Symlinked paths point out of the tree and are reported as
+    external. Results are cached and only recomputed for versions whose
+    directories changed."""
+    module_tree = ctx.obj.check_module_tree()
+    disk_usage = usage.DiskUsage(module_tree, jobs, use_cache=not no_cache)
+    usages = disk_usage.usage(disk_usage.versions(all_versions, module_names))
+    if sort == "size":
+        usages.sort(key=lambda u: u.size, reverse=True)
+
+    def fmt(size):
+        return f"{size}" if in_bytes else usage.format_size(size)
+
+    for u in usages:
+        suffix = f"\t({len(u.external)} external)" if len(u.external) else ""
+        click.echo(f"{fmt(u.size)}\t{u.name}/{u.version}{suffix}")
+        if external:
+            for path, target in sorted(u.external.items()):
+                click.echo(f"\t{path} -> {target}")
+    click.echo(f"{fmt(disk_usage.total(usages))}\ttotal")
+
+
 @mdcli.command(cls=ModuleDevCommand, short_help_color=INFO_CLR)
 @version_option
 @click.argument("MODULE_NAME")
 @click.pass_context
 def location(ctx, module_name, version):
     """Get the directory of a module by name"""
-    module_tree = ctx.obj.check_module_tree()
+    module_tree = ctx.obj.check_federated_tree()
     loader = ctx.obj.check_module(module_tree, module_name, version)
     click.echo(loader.module_path())
+
+
+@mdcli.command(name="query", cls=ModuleDevCommand, short_help_color=INFO_CLR)
+@click.pass_context
+def query_modules(ctx):
+    """Answer queries about modules, given as one JSON object per line on
+    standard input, with one JSON object per line on standard output. This
+    avoids starting moduledev for every query. For example,
+
+    \b
+    {"id": 1, "op": "location", "module": "hello", "version": ">=2"}
+    {"id": 2, "op": "paths", "module": "hello"}
+
+    Supported operations are location, show, paths, exists and latest-version.
+    Each response contains the id of its query and either "ok": true and the
+    "result" or "ok": false and an "error"."""
+    module_tree = ctx.obj.check_federated_tree()
+    handler = query.QueryHandler(
+        module_tree,
+        partial(ctx.obj.check_module, parse_error_handler=util.ignore_error),
+    )
+    handler.serve(sys.stdin, sys.stdout)
+
+
+@mdcli.command(cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@force_option
+@dry_run_option
+@click.option(
+    "--trash",
+    "empty_trash",
+    is_flag=True,
+    help="Also delete removed modules in the trash, even if they could still be "
+    "restored",
+)
+@jobs_option
+@click.pass_context
+def gc(ctx, force, dry_run, empty_trash, jobs):
+    """Remove orphaned and broken entries from the module tree. This includes
+    modulefile links without a module directory, module directories without
+    versions, versions without a .modulefile, entries in the root which are
+    not modules at all, and builds of install which no version links to.
+    Versions which only lack their modulefile link are linked again rather
+    than removed.
+
+    The whole tree is scanned concurrently and the plan is shown before
+    anything is removed."""
+    module_tree = ctx.obj.check_module_tree()
+    collector = GarbageCollector(module_tree, jobs)
+    garbage = collector.scan()
+    trash = Trash(module_tree)
+    trashed = trash.entries() if empty_trash else []
+    if not len(garbage) and not len(trashed):
+        click.echo("Nothing to collect.")
+        return
+    for g in garbage:
+        click.echo(f"{g.kind}\t{g.path}\t({g.reason})")
+    for entry in trashed:
+        click.echo(f"trash\t{entry.path}\t({entry.name}/{entry.version})")
+    if dry_run:
+        return
+    if not force:  # pragma: no cover
+        count = len(garbage) + len(trashed)
+        if not click.confirm(f"Really remove {count} entries?  "):
+            raise SystemExit("Operation cancelled by user")
+    collector.collect(garbage)
+    trash.empty(trashed, jobs)
+
+
+@mdcli.command(cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@dry_run_option
+@click.pass_context
+def recover(ctx, dry_run):
+    """Complete operations which were interrupted, e.g. when moduledev was
+    killed while initializing or removing a module, replacing a path or
+    applying a bulk update. Such operations are recorded in the journal of
+    the tree before the tree is changed. Operations which cannot be completed
+    any more are rolled back. Operations still running in other processes are
+    left alone."""
+    module_tree = ctx.obj.check_module_tree()
+    recovered = Journal(module_tree).recover(dry_run)
+    if not len(recovered):
+        click.echo("Nothing to recover.")
+        return
+    for intent, direction in recovered:
+        click.echo(f"{direction}\t{intent}")
+
+
+@mdcli.command(name="prune", cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@click.option("--keep", type=int, help="Keep the newest N versions of each module")
+@click.option(
+    "--keep-newer-than",
+    metavar="AGE",
+    help="Keep versions modified more recently than AGE, e.g. 12h, 30d or 2w",
+)
+@click.option(
+    "--pin",
+    "pins",
+    multiple=True,
+    metavar="NAME[/VERSION]",
+    help="Never remove these versions. VERSION may be a version constraint",
+)
+@force_option
+@dry_run_option
+@jobs_option
+@click.pass_context
+def prune_versions(ctx, keep, keep_newer_than, pins, force, dry_run, jobs):
+    """Remove old module versions according to a retention policy. A version
+    is kept if it is one of the newest --keep versions of its module, was
+    modified more recently than --keep-newer-than, is pinned, or is required
+    by a module which is kept. The module directory and modulefile links are
+    removed along with the last version of a module.
+
+    The plan is shown before anything is removed."""
+    if keep is None and keep_newer_than is None:
+        raise SystemExit("Specify a retention policy with --keep or --keep-newer-than.")
+    if keep is not None and keep < 0:
+        raise SystemExit("--keep must not be negative.")
+    newer_than = None
+    try:
+        if keep_newer_than is not None:
+            newer_than = prune.parse_age(keep_newer_than)
+        pins = [prune.parse_pin(p) for p in pins]
+    except ValueError as e:
+        raise SystemExit(f"{e}")
+    policy = RetentionPolicy(keep=keep, newer_than=newer_than, pins=pins)
+    module_tree = ctx.obj.check_module_tree()
+    pruner = Pruner(module_tree, policy, jobs)
+    garbage = pruner.scan()
+    for node, dependent in sorted(pruner.required.items()):
+        log_error(f"Keeping {node}, which is required by {dependent}")
+    if not len(garbage):
+        click.echo("Nothing to prune.")
+        return
+    for g in garbage:
+        click.echo(f"{g.kind}\t{g.name}/{os.path.basename(g.path)}")
+    if dry_run:
+        return
+    if not force:  # pragma: no cover
+        if not click.confirm(f"Really remove {len(garbage)} versions?  "):
+            raise SystemExit("Operation cancelled by user")
+    pruner.prune(garbage)
+
+
+@mdcli.command(name="completion", cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@click.argument("SHELL", type=click.Choice(completion.SHELLS))
+@click.pass_context
+def completion_script(ctx, shell):
+    """Print a script completing commands, module names, versions, categories
+    and path variables in bash, zsh or fish, e.g.
+
+    eval "$(moduledev completion bash)"
+
+    The script does not run moduledev itself, but reads a small cache in each
+    module tree which moduledev keeps up to date when modules are changed."""
+    click.echo(completion.script(shell, mdcli, ctx.obj.config.filename()), nl=False)
+
+
+@mdcli.command(name="render", cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@click.option(
+    "--backend",
+    type=click.Choice(render.BACKENDS),
+    required=True,
+    help="The backend to convert the tree to",
+)
+@jobs_option
+@click.pass_context
+def render_tree(ctx, backend, jobs):
+    """Convert an existing tree to a rendering backend. With --backend lua, a
+    Lua modulefile is rendered next to the modulefile link of every version,
+    which Lmod evaluates much faster than the Tcl modulefiles. The Lua
+    modulefiles are kept up to date whenever a module is saved. With
+    --backend tcl, the Lua modulefiles are removed again."""
+    module_tree = ctx.obj.check_module_tree()
+    count = render.TreeRenderer(module_tree, backend, jobs).run()
+    verb = "Rendered" if backend == "lua" else "Removed"
+    click.echo(f"{verb} {count} Lua modulefiles.")
+
+
+@mdcli.command(cls=ModuleDevCommand, short_help_color=INFO_CLR)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["text", "json"]),
+    default="text",
+    show_default=True,
+    help="The format of the diagnostics",
+)
+@click.option("--strict", is_flag=True, help="Also fail on warnings")
+@jobs_option
+@click.pass_context
+def lint(ctx, output_format, strict, jobs):
+    """Check all .modulefiles in the tree for parse errors, incomplete set and
+    path lines, duplicate paths, paths outside the module directory and
+    unknown commands. The files are checked in parallel processes. Exits with
+    a nonzero status if errors (or, with --strict, warnings) are found."""
+    module_tree = ctx.obj.check_module_tree()
+    diagnostics = ModuleLinter(module_tree, jobs).run()
+    if output_format == "json":
+        click.echo(json.dumps([d.to_dict() for d in diagnostics], indent=2))
+    else:
+        for d in diagnostics:
+            click.secho(f"{d}", fg="red" if d.severity == "error" else "yellow")
+    errors = sum(d.severity == "error" for d in diagnostics)
+    warnings = len(diagnostics) - errors
+    if errors or (strict and warnings):
+        raise SystemExit(f"{errors} errors and {warnings} warnings found.")
+    if output_format == "text":
+        click.echo(f"{errors} errors and {warnings} warnings found.")
+
+
+@mdcli.command(cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@click.option("--copy", is_flag=True, help="Copy the tree instead of moving it")
+@click.option(
+    "--relative",
+    is_flag=True,
+    help="Convert the tree to relative modulefile links, such that later "
+    "moves need no relocation",
+)
+@jobs_option
+@click.argument("NEW_ROOT", type=click.Path(file_okay=False))
+@click.pass_context
+def relocate(ctx, new_root, copy, relative, jobs):
+    """Move (or copy) the module tree to NEW_ROOT. The MODULEBASE of the master
+    module file and all symlinks into the tree are rewritten to the new
+    location. If the configured root is the old root, it is updated."""
+    module_tree = ctx.obj.check_module_tree()
+    relocation = TreeRelocation(module_tree, new_root, copy, relative, jobs)
+    try:
+        new_tree, count = relocation.run()
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Could not relocate tree: {e}")
+    click.echo(f"Relocated {module_tree.root_dir} to {new_tree.root_dir}")
+    click.echo(f"Rewrote {count} links.")
+    config_root = ctx.obj.config.get("root")
+    if (
+        not copy
+        and config_root
+        and os.path.abspath(config_root) == module_tree.root_dir
+    ):
+        ctx.obj.config.set("root", new_tree.root_dir)
+        ctx.obj.config.save()
+        click.echo(f"Updated the configured root to {new_tree.root_dir}")
+    click.echo("Update the MODULEPATH of your login scripts, e.g.\n")
+    click.secho(f"module use --append {new_tree.root_dir}/modulefile", bold=True)
+
+
+@mdcli.command(cls=ModuleDevCommand, short_help_color=INFO_CLR)
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Hash every file, even if it did not change since it was last verified",
+)
+@jobs_option
+@version_option
+@click.argument("MODULE_NAME", required=False)
+@click.pass_context
+def verify(ctx, module_name, version, full, jobs):
+    """Verify the copied files of all modules (or of a single module) against
+    the integrity manifests recorded when they were added. Files are hashed in
+    parallel, and files whose size and modification time did not change since
+    they were last verified are skipped unless --full is given."""
+    module_tree = ctx.obj.check_module_tree()
+    verifier = integrity.ModuleVerifier(module_tree, jobs, use_cache=not full)
+    manifests = None
+    if module_name is not None:
+        loader = ctx.obj.check_module(module_tree, module_name, version)
+        manifest = integrity.manifest_path(loader)
+        manifests = [manifest] if os.path.exists(manifest) else []
+    mismatches = verifier.verify(manifests)
+    for mismatch in mismatches:
+        log_error(f"{mismatch}")
+    click.echo(f"{verifier.hashed} files hashed, {verifier.skipped} unchanged.")
+    if len(mismatches):
+        raise SystemExit(f"{len(mismatches)} files do not match their manifest.")
+
+
+@mdcli.command(name="export", cls=ModuleDevCommand, short_help_color=INFO_CLR)
+@click.option(
+    "--links",
+    is_flag=True,
+    help="Also record the targets of symlinked module paths",
+)
+@click.argument("snapshot_file", metavar="SNAPSHOT", type=click.File("wb"))
+@click.pass_context
+def export_tree(ctx, snapshot_file, links):
+    """Export the layout of the module tree and the contents of all
+    .modulefiles into a single compressed snapshot file. Use "-" to write to
+    standard output. Copied path contents are not exported."""
+    module_tree = ctx.obj.check_module_tree()
+    snapshot.export_snapshot(module_tree, snapshot_file, include_links=links)
+
+
+@mdcli.command(name="import", cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@click.option(
+    "--overwrite", is_flag=True, help="Overwrite files and links which exist."
+)
+@click.argument(
+    "snapshot_file",
+    metavar="SNAPSHOT",
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.pass_context
+def import_tree(ctx, snapshot_file, overwrite):
+    """Import a snapshot created with moduledev export. If the root is an
+    empty directory, the module tree is set up with the name stored in the
+    snapshot."""
+    module_tree = ModuleTree(ctx.obj.check_root())
+    try:
+        with open(snapshot_file, "rb") as f:
+            if module_tree.valid():
+                snapshot.import_snapshot(module_tree, f, overwrite)
+            elif module_tree.can_setup(None):
+                name = snapshot.snapshot_name(f)
+                f.seek(0)
+                module_tree.setup(name, f)
+            else:
+                raise SystemExit(
+                    "Snapshots can only be imported into a module tree "
+                    "or an empty, writeable directory."
+                )
+    except ValueError as e:
+        raise SystemExit(f"Could not import snapshot: {e}")
+
+
+@mdcli.command(cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@click.option(
+    "--category",
+    "categories",
+    multiple=True,
+    help="Only mirror modules in this category (may be given multiple times)",
+)
+@dry_run_option
+@jobs_option
+@click.argument("DEST", type=click.Path(file_okay=False))
+@click.pass_context
+def sync(ctx, dest, categories, dry_run, jobs):
+    """Mirror the module tree to DEST, e.g. node-local storage. A manifest of
+    the mirrored files is kept in DEST so that subsequent syncs only transfer
+    what has changed. The MODULEBASE of the master module file is rewritten to
+    point to DEST."""
+    module_tree = ctx.obj.check_module_tree()
+    tree_sync = TreeSync(module_tree, dest, categories or None, jobs)
+    result = tree_sync.run(dry_run=dry_run)
+    if dry_run:
+        for label, paths in [
+            ("mkdir", result.created),
+            ("copy", result.copied),
+            ("link", result.linked),
+            ("remove", result.removed),
+        ]:
+            for p in paths:
+                click.echo(f"{label}\t{p}")
+    click.echo(f"{result}")
+
+
+@mdcli.command(name="pack", cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@click.option(
+    "--keep",
+    is_flag=True,
+    help="Keep the packed files in place instead of removing them",
+)
+@click.option("--store", is_flag=True, help="Store the files without compression")
+@module_arg
+@version_arg
+@click.pass_context
+def pack_module(ctx, module_name, version, keep, store):
+    """Pack the contents of a module version into a single indexed archive.
+    This greatly reduces the number of files in the module tree for versions
+    with many small files. Symlinked paths are not packed. Unless --keep is
+    given, the packed files are removed from the version directory. A version
+    sharing its .modulefile is detached with a copy of it. Use unpack to
+    extract the archive again."""
+    module_tree = ctx.obj.check_module_tree()
+    loader = ctx.obj.check_module(module_tree, module_name, version)
+    try:
+        count = pack.pack_version(loader, keep, compress=not store)
+    except ValueError as e:
+        raise SystemExit(f"{e}")
+    click.echo(f"Packed {count} entries into {pack.pack_path(loader)}")
+
+
+@mdcli.command(cls=ModuleDevCommand, short_help_color=SETUP_CLR)
+@click.option(
+    "--dest",
+    type=click.Path(file_okay=False),
+    help="Extract to this directory (e.g. node-local scratch) instead of "
+    "restoring the module version",
+)
+@jobs_option
+@module_arg
+@version_arg
+@click.pass_context
+def unpack(ctx, module_name, version, dest, jobs):
+    """Extract a packed module version in parallel. Without --dest, the
+    contents are restored to the module version and the archive is removed."""
+    module_tree = ctx.obj.check_module_tree()
+    loader = ctx.obj.check_module(module_tree, module_name, version)
+    try:
+        count = pack.unpack_version(loader, dest, jobs)
+    except ValueError as e:
+        raise SystemExit(f"{e}")
+    click.echo(f"Extracted {count} entries to {dest or loader.module_path()}")
+
+
+@mdcli.command(cls=ModuleDevCommand, short_help_color=INFO_CLR)
+@click.option(
+    "--shell",
+    type=click.Choice(environment.SHELLS),
+    default="bash",
+    show_default=True,
+    help="The shell to format the environment for",
+)
+@click.option("--no-cache", is_flag=True, help="Do not use the environment cache")
+@click.argument("MODULES", nargs=-1, required=True)
+@click.pass_context
+def env(ctx, modules, shell, no_cache):
+    """Print the environment changes of loading MODULES without running
+    modulecmd. Modules may be given as NAME or NAME/VERSION. The result can be
+    applied with e.g.
+
+    eval "$(moduledev env hello/2.10)"
+    """
+    module_tree = ctx.obj.check_module_tree()
+    resolver = environment.EnvironmentResolver(module_tree, use_cache=not no_cache)
+    try:
+        changed = resolver.resolve(modules)
+    except ValueError as e:
+        raise SystemExit(f"Error loading module: {e}")
+    click.echo(environment.format_environment(changed, shell))
+
+
+@mdcli.command(cls=ModuleDevCommand, short_help_color=INFO_CLR)
+@click.option(
+    "--reverse",
+    is_flag=True,
+    help="Show the modules which would break if the module was removed",
+)
+@click.option(
+    "--check",
+    is_flag=True,
+    help="Check the whole tree for dependency cycles and missing dependencies",
+)
+@version_option
+@click.argument("MODULE_NAME", required=False)
+@click.pass_context
+def deps(ctx, module_name, version, reverse, check):
+    """Show the dependencies of a module in the order they have to be loaded,
+    as given by the prereq and module load commands in the .modulefiles."""
+    module_tree = ctx.obj.check_module_tree()
+    graph = depgraph.DependencyGraph(module_tree).load()
+    if check:
+        problems = 0
+        for cycle in graph.cycles():
+            log_error("Dependency cycle: " + " -> ".join(cycle))
+            problems += 1
+        for node, dependency in graph.missing():
+            log_error(f"{node}: missing dependency {dependency}")
+            problems += 1
+        if problems:
+            raise SystemExit(f"{problems} dependency problems found.")
+        click.echo("No dependency problems found.")
+        return
+    if module_name is None:
+        raise click.UsageError("MODULE_NAME is required unless --check is given")
+    loader = ctx.obj.check_module(module_tree, module_name, version)
+    if reverse:
+        nodes = graph.dependents(loader.name(), loader.version())
+    else:
+        try:
+            nodes = graph.load_order(loader.name(), loader.version())
+        except ValueError as e:
+            raise SystemExit(f"{e}")
+    for node in nodes:
+        click.echo(node)
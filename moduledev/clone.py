@@ -0,0 +1,106 @@
+import fcntl
+import os
+import shutil
+
+from . import util
+from .module import Module, ModuleBuilder
+
+# ioctl request to share the extents of a file (Linux btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """Create dst as a copy-on-write clone of src, raising OSError if the
+    filesystem does not support it."""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def clone_file(src, dst):
+    """
+    Clone a file without duplicating its contents if possible: as a
+    copy-on-write reflink, else as a hardlink, else as a plain copy. Note that
+    hardlinked files are shared, i.e. changing one in place changes both.
+    """
+    try:
+        return reflink(src, dst)
+    except OSError:
+        pass
+    try:
+        return os.link(src, dst)
+    except OSError:
+        return shutil.copy2(src, dst)
+
+
+def substitute_prefix(target, replacements):
+    """Replace the first matching prefix of a path"""
+    for old, new in replacements:
+        if target == old or target.startswith(old.rstrip(os.sep) + os.sep):
+            return new + target[len(old) :]
+    return target
+
+
+def clone_version(loader, version, replacements=(), copy=False):
+    """
+    Create a new version of a module from an existing one. The new version is
+    built from a copy of the loaded module, writing a detached .modulefile or
+    rewriting the shared one, and the contents of the old version directory
+    are added to it afterwards. Symlinked paths are linked again with their
+    targets rewritten by the prefix replacements and copied paths are cloned
+    with clone_file.
+
+    :param loader: a loaded ModuleLocation of the version to clone
+    :param version: the new version
+    :param replacements: a list of (old, new) prefixes of link targets
+    :param copy: duplicate copied paths instead of cloning their files
+    :return: a tuple of a ModuleBuilder of the new version and a list of
+        links whose target does not exist
+    """
+    if not util.valid_version(version):
+        raise ValueError(f'"{version}" is not a valid version')
+    old = loader.module
+    module = Module(
+        loader.module_tree,
+        old.name,
+        version,
+        maintainer=old.maintainer,
+        helptext=old.helptext,
+        description=old.description,
+        extra_vars=dict(old.extra_vars),
+        category=loader.category_name(),
+        shared=loader.shared(),
+        extra_commands=list(old.extra_commands),
+    )
+    module.paths = list(old.paths)
+    module.command_positions = list(old.command_positions)
+    builder = ModuleBuilder(loader.module_tree, module)
+    src, dest = loader.module_path(), builder.module_path()
+    # the old version directory itself is a target of its own links
+    replacements = list(replacements) + [(src, dest)]
+    builder.build()
+    dangling = []
+    for entry in os.scandir(src):
+        target = os.path.join(dest, entry.name)
+        if entry.name == ".modulefile":
+            continue
+        if entry.is_symlink():
+            os.symlink(substitute_prefix(os.readlink(entry.path), replacements), target)
+            if not os.path.exists(target):
+                dangling.append(target)
+        elif entry.is_dir():
+            shutil.copytree(
+                entry.path,
+                target,
+                symlinks=True,
+                copy_function=shutil.copy2 if copy else clone_file,
+            )
+        elif copy:
+            shutil.copy2(entry.path, target)
+        else:
+            clone_file(entry.path, target)
+    return builder, dangling
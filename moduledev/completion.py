@@ -0,0 +1,354 @@
+import os
+
+import click
+
+from . import util
+
+SHELLS = ["bash", "zsh", "fish"]
+
+# the kinds of values completed for arguments and options, by parameter name
+ARGUMENT_KINDS = {
+    "module_name": "module",
+    "module_names": "module",
+    "modules": "module",
+    "version": "version",
+    "from_version": "version",
+    "variable_name": "variable",
+}
+OPTION_KINDS = {
+    "version": "version",
+    "category": "category",
+    "categories": "category",
+    "names": "module",
+    "toolchain": "module",
+}
+
+
+class CompletionCache:
+    """
+    The module names, versions, categories and path variables of a tree in a
+    tab separated file in the tree's cache directory, one line per version:
+
+    name<TAB>version<TAB>category<TAB>VARIABLE VARIABLE ...
+
+    The file is kept up to date by the operations changing the tree, such that
+    the shell completion scripts only need to read it.
+    """
+
+    CACHE_NAME = "complete.tsv"
+
+    def __init__(self, module_tree):
+        self.module_tree = module_tree
+
+    def cache_path(self):
+        return os.path.join(self.module_tree.cache_dir(), self.CACHE_NAME)
+
+    def read(self):
+        """
+        :return: a dict mapping (name, version) tuples to (category,
+            variables) tuples, or None if there is no cache
+        """
+        try:
+            with open(self.cache_path()) as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return None
+        entries = {}
+        for line in lines:
+            fields = line.split("\t")
+            if len(fields) == 4:
+                entries[fields[0], fields[1]] = (fields[2], fields[3].split())
+        return entries
+
+    def _write(self, entries):
+        lines = [
+            f"{name}\t{version}\t{category}\t{' '.join(variables)}\n"
+            for (name, version), (category, variables) in sorted(entries.items())
+        ]
+        try:
+            os.makedirs(self.module_tree.cache_dir(), exist_ok=True)
+            util.atomic_write(self.cache_path(), "".join(lines))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _variables(paths):
+        return sorted(set(p.name for p in paths))
+
+    def rebuild(self):
+        """Write the cache from scratch, parsing every .modulefile"""
+        # module imports this module
+        from .module import ModuleDescriptor, ModuleLoader
+
+        entries = {}
+        for name in self.module_tree.module_names():
+            # skip stray files in the root, which are not module bases
+            if not os.path.isdir(os.path.join(self.module_tree.root_dir, name)):
+                continue
+            for version in ModuleLoader(self.module_tree, name).available_versions():
+                m = ModuleDescriptor(self.module_tree, name, version)
+                entries[name, version] = (m.category, self._variables(m.paths))
+        self._write(entries)
+
+    def _change(self, change):
+        entries = self.read()
+        if entries is None:
+            try:
+                self.rebuild()
+            except (OSError, RuntimeError, ValueError):
+                pass
+            return
+        change(entries)
+        self._write(entries)
+
+    def update(self, loader):
+        """
+        Record a module version after its .modulefile was saved. The whole
+        cache is built if it does not exist yet.
+
+        :param loader: a loaded ModuleLocation
+        """
+
+        def change(entries):
+            entries[loader.name(), loader.version()] = (
+                loader.category_name(),
+                self._variables(loader.module.paths),
+            )
+
+        self._change(change)
+
+    def remove(self, name, version):
+        """Forget a removed module version"""
+        self._change(lambda entries: entries.pop((name, version), None))
+
+    def prune(self):
+        """Forget all versions whose directory no longer exists"""
+        entries = self.read()
+        if entries is None:
+            return
+        root = self.module_tree.root_dir
+        kept = {
+            (name, version): entry
+            for (name, version), entry in entries.items()
+            if os.path.isdir(os.path.join(root, name, version))
+        }
+        if len(kept) != len(entries):
+            self._write(kept)
+
+
+def _table_rows(command, path=""):
+    """
+    Describe the commands, arguments and options of a click command as
+    tab separated rows:
+
+    <command path> sub <subcommand>
+    <command path> arg <kind> <nargs>
+    <command path> opt <option> <nargs> <kind>
+    """
+    rows = []
+    for param in command.params:
+        if isinstance(param, click.Option):
+            nargs = 0 if param.is_flag else param.nargs
+            kind = OPTION_KINDS.get(param.name, "-")
+            rows.extend(f"{path}\topt\t{o}\t{nargs}\t{kind}" for o in param.opts)
+        elif isinstance(param, click.Argument):
+            kind = ARGUMENT_KINDS.get(param.name, "-")
+            rows.append(f"{path}\targ\t{kind}\t{param.nargs}")
+    if isinstance(command, click.Group):
+        for name in sorted(command.commands):
+            rows.append(f"{path}\tsub\t{name}")
+            rows.extend(_table_rows(command.commands[name], f"{path} {name}".strip()))
+    return rows
+
+
+# Completes the word under the cursor given the words before it as ARGV. The
+# command table and the configuration file are substituted when the script is
+# generated, and the module trees are read from --root or the configuration.
+# Everything happens in the BEGIN block, so that a single awk process is
+# started per completion. The program contains no single quotes or double
+# backslashes so that it can be quoted the same way by all shells.
+_awk_program = r"""
+function add(c) {
+    if (index(c, cur) == 1 && !(c in seen)) {
+        seen[c] = 1
+        print c
+    }
+}
+function unquote(s,    q) {
+    q = sprintf("%c", 39)
+    gsub(/^[ ]+|[ ]+$/, "", s)
+    gsub("^[\"" q "]|[\"" q "]$", "", s)
+    return s
+}
+function config_roots(    line, inlist, root, list, n, i, parts) {
+    list = ""
+    while ((getline line < config) > 0) {
+        if (line ~ /^root:/) {
+            sub(/^root:/, "", line)
+            root = unquote(line)
+        } else if (line ~ /^roots:[ ]*$/) {
+            inlist = 1
+            continue
+        } else if (line ~ /^roots:/) {
+            sub(/^roots:/, "", line)
+            list = unquote(line)
+        } else if (inlist && line ~ /^[ ]*- /) {
+            sub(/^[ ]*- /, "", line)
+            list = list (list == "" ? "" : ":") unquote(line)
+            continue
+        }
+        inlist = 0
+    }
+    close(config)
+    if (list == "")
+        list = root
+    n = split(list, parts, ":")
+    for (i = 1; i <= n; i++)
+        if (parts[i] != "")
+            roots[++nroots] = parts[i]
+}
+function complete_tree(kind, module,    i, file, line, f, vars, n, j) {
+    if (!nroots)
+        config_roots()
+    for (i = 1; i <= nroots; i++) {
+        file = roots[i] "/module/.cache/complete.tsv"
+        while ((getline line < file) > 0) {
+            split(line, f, "\t")
+            if (kind == "module")
+                add(f[1])
+            else if (kind == "version" && f[1] == module)
+                add(f[2])
+            else if (kind == "category")
+                add(f[3])
+            else if (kind == "variable") {
+                n = split(f[4], vars, " ")
+                for (j = 1; j <= n; j++)
+                    add(vars[j])
+            }
+        }
+        close(file)
+    }
+}
+BEGIN {
+    nrows = split(TABLE, rows, "\n")
+    for (i = 1; i <= nrows; i++) {
+        split(rows[i], f, "\t")
+        if (f[2] == "sub") {
+            subs[f[1]] = subs[f[1]] " " f[3]
+            group[f[1]] = 1
+        } else if (f[2] == "arg") {
+            nargs[f[1]]++
+            argkind[f[1], nargs[f[1]]] = f[3]
+            argmany[f[1], nargs[f[1]]] = (f[4] == "-1")
+        } else if (f[2] == "opt") {
+            opts[f[1]] = opts[f[1]] " " f[3]
+            optn[f[1], f[3]] = f[4]
+            optkind[f[1], f[3]] = f[5]
+        }
+    }
+    cur = ARGV[ARGC - 1]
+    path = ""
+    na = 0
+    expect = 0
+    for (i = 1; i < ARGC - 1; i++) {
+        w = ARGV[i]
+        if (expect > 0) {
+            if (lastopt == "--root" && lastpath == "")
+                roots[++nroots] = w
+            expect--
+            continue
+        }
+        if (w ~ /^-/) {
+            if (w ~ /=/)
+                continue
+            lastopt = w
+            lastpath = ((path, w) in optn) ? path : ""
+            expect = optn[lastpath, w] + 0
+            lastkind = optkind[lastpath, w]
+            continue
+        }
+        if (path in group)
+            path = (path == "" ? w : path " " w)
+        else
+            args[++na] = w
+    }
+    kind = "-"
+    if (expect > 0)
+        kind = lastkind
+    else if (cur ~ /^-/) {
+        n = split(opts[path], words, " ")
+        for (i = 1; i <= n; i++)
+            add(words[i])
+    } else if (path in group) {
+        n = split(subs[path], words, " ")
+        for (i = 1; i <= n; i++)
+            add(words[i])
+    } else if (na < nargs[path])
+        kind = argkind[path, na + 1]
+    else if (nargs[path] && argmany[path, nargs[path]])
+        kind = argkind[path, nargs[path]]
+    if (kind != "-" && kind != "")
+        complete_tree(kind, args[1])
+    exit
+}
+"""
+
+_bash_template = """\
+# bash completion for moduledev. Add this to ~/.bashrc:
+#   eval "$(moduledev completion bash)"
+_moduledev_awk='%(program)s'
+
+_moduledev() {
+    local IFS=$'\\n'
+    COMPREPLY=($(awk -v config=%(config)s -v TABLE=%(table)s "$_moduledev_awk" \\
+        "${COMP_WORDS[@]:1:COMP_CWORD-1}" "${COMP_WORDS[COMP_CWORD]}"))
+}
+
+complete -o default -F _moduledev moduledev
+"""
+
+_zsh_template = """\
+# zsh completion for moduledev. Add this to ~/.zshrc:
+#   eval "$(moduledev completion zsh)"
+autoload -U +X bashcompinit && bashcompinit
+"""
+
+_fish_template = """\
+# fish completion for moduledev. Add this to ~/.config/fish/config.fish:
+#   moduledev completion fish | source
+function __moduledev_complete
+    set -l words (commandline -opc)
+    awk -v config=%(config)s -v TABLE=%(table)s '%(program)s' \\
+        $words[2..-1] (commandline -ct)
+end
+
+complete -c moduledev -f -a '(__moduledev_complete)'
+"""
+
+
+def _quote(s):
+    """Quote a string for awk -v, which interprets escape sequences, and for
+    the shells, which all accept single quoted strings without quotes"""
+    return "'" + s.replace("\\", "\\\\").replace("\n", "\\n").replace("'", "") + "'"
+
+
+def script(shell, command, config):
+    """
+    Return the completion script for a shell.
+
+    :param shell: one of SHELLS
+    :param command: the click command to complete
+    :param config: the location of the configuration file, from which the
+        module roots are read unless --root is given
+    """
+    if shell not in SHELLS:
+        raise ValueError(f"Unknown shell {shell}, expected one of {', '.join(SHELLS)}")
+    values = {
+        "program": _awk_program,
+        "config": _quote(config),
+        "table": _quote("\n".join(_table_rows(command))),
+    }
+    if shell == "fish":
+        return _fish_template % values
+    text = _bash_template % values
+    return _zsh_template + text if shell == "zsh" else text
@@ -0,0 +1,429 @@
+import json
+import os
+import shlex
+
+from . import util
+
+
+class Dependency:
+    """A dependency of a module on another module"""
+
+    def __init__(self, name, version=None, kind="prereq"):
+        """
+        :param name: the name of the required module
+        :param version: the required version, or None for any version
+        :param kind: "prereq" or "load", depending on the modulefile command
+        """
+        self.name = name
+        self.version = version
+        self.kind = kind
+
+    def __repr__(self):
+        spec = self.name if self.version is None else f"{self.name}/{self.version}"
+        return f"{self.kind} {spec}"
+
+    def __eq__(self, other):
+        return (self.name, self.version, self.kind) == (
+            other.name,
+            other.version,
+            other.kind,
+        )
+
+    def __hash__(self):
+        return hash((self.name, self.version, self.kind))
+
+    @classmethod
+    def from_spec(cls, spec, kind="prereq"):
+        name, _, version = spec.partition("/")
+        return cls(name, version or None, kind)
+
+
+def parse_dependencies(commands):
+    """
+    Parse prereq and module load commands into dependencies.
+
+    :param commands: an iterable of modulefile lines
+    :return: a list of Dependency objects
+    """
+    dependencies = []
+    for command in commands:
+        try:
+            fields = shlex.split(command)
+        except ValueError:
+            continue
+        if len(fields) > 1 and fields[0] == "prereq":
+            specs, kind = fields[1:], "prereq"
+        elif len(fields) > 2 and fields[0] == "module" and fields[1] in ("load", "add"):
+            specs, kind = fields[2:], "load"
+        else:
+            continue
+        dependencies.extend(
+            Dependency.from_spec(s, kind) for s in specs if not s.startswith("-")
+        )
+    return dependencies
+
+
+def node_key(name, version):
+    return f"{name}/{version}"
+
+
+class DependencyCycleError(ValueError):
+    """Raised when modules depend on each other in a cycle"""
+
+    def __init__(self, cycle):
+        self.cycle = cycle
+        super(DependencyCycleError, self).__init__(
+            "Dependency cycle: " + " -> ".join(cycle)
+        )
+
+
+class DependencyGraph:
+    """
+    The dependencies between all module versions in a tree. The parsed
+    dependencies are cached in the tree's cache directory, one file per
+    module name keyed by the modification time of each .modulefile, so that
+    only changed .modulefiles are parsed when the graph is loaded and saving
+    a .modulefile only rewrites the entry of its module.
+
+    The cache also keeps a reverse index, one file per required module name
+    listing the names of the modules which require it, so that the modules
+    depending on a module can be loaded without scanning the whole tree (see
+    load_dependents). The reverse index covers the .modulefiles saved by
+    moduledev and those seen by the last full load. .modulefiles edited by
+    hand are found by their modification times when load_dependents is
+    called.
+    """
+
+    CACHE_NAME = "depgraph"
+
+    def __init__(self, module_tree):
+        self.module_tree = module_tree
+        self.versions = {}
+        self.edges = {}
+
+    def cache_path(self):
+        return os.path.join(self.module_tree.cache_dir(), self.CACHE_NAME)
+
+    def _entry_path(self, name):
+        return os.path.join(self.cache_path(), "deps", f"{name}.json")
+
+    def _reverse_path(self, name):
+        return os.path.join(self.cache_path(), "reverse", f"{name}.json")
+
+    @staticmethod
+    def _read_json(path, default):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    @staticmethod
+    def _write_json(path, data):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            util.atomic_write(path, json.dumps(data))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _prune(path, keep):
+        """Remove the cache files of the names not kept from a directory"""
+        try:
+            files = os.listdir(path)
+        except OSError:
+            return
+        for f in files:
+            if f.endswith(".json") and f[: -len(".json")] not in keep:
+                os.unlink(os.path.join(path, f))
+
+    def read_entry(self, name):
+        """
+        :return: a dict mapping the .modulefiles of a module to their
+            modification times and dependencies
+        """
+        return self._read_json(self._entry_path(name), {})
+
+    def read_reverse(self, name):
+        """:return: the names of the modules requiring a module"""
+        return self._read_json(self._reverse_path(name), [])
+
+    @staticmethod
+    def _required(entry):
+        return set(d[0] for dotfile in entry.values() for d in dotfile["deps"])
+
+    def _update_reverse(self, name, old, new):
+        """Update the reverse index after the cache entry of a module changed"""
+        old, new = self._required(old), self._required(new)
+        for required in old ^ new:
+            names = set(self.read_reverse(required))
+            if required in new:
+                names.add(name)
+            else:
+                names.discard(name)
+            self._write_json(self._reverse_path(required), sorted(names))
+
+    def _scan_module(self, name, cached):
+        """
+        Add the versions of a module and their dependencies to the graph,
+        parsing only changed .modulefiles.
+
+        :param cached: the cache entry of the module
+        :return: the new cache entry of the module
+        """
+        base = os.path.join(self.module_tree.root_dir, name)
+        try:
+            versions = [
+                e.name
+                for e in os.scandir(base)
+                if util.valid_version(e.name) and e.is_dir()
+            ]
+        except OSError:
+            versions = []
+        self.versions[name] = sorted(versions, key=util.version_key)
+        shared = os.path.join(base, ".modulefile")
+        entry = {}
+        for version in versions:
+            detached = os.path.join(base, version, ".modulefile")
+            dotfile = detached if os.path.exists(detached) else shared
+            if dotfile not in entry:
+                try:
+                    mtime = os.stat(dotfile).st_mtime_ns
+                except OSError:
+                    continue
+                parsed = cached.get(dotfile)
+                if parsed is None or parsed["mtime"] != mtime:
+                    with open(dotfile) as f:
+                        deps = [
+                            [d.name, d.version, d.kind] for d in parse_dependencies(f)
+                        ]
+                    parsed = {"mtime": mtime, "deps": deps}
+                entry[dotfile] = parsed
+            self.edges[node_key(name, version)] = [
+                Dependency(*d) for d in entry[dotfile]["deps"]
+            ]
+        return entry
+
+    def load(self):
+        """
+        Scan the tree for module versions and their dependencies, and bring
+        the cache and its reverse index up to date.
+
+        :return: the graph itself
+        """
+        self.versions, self.edges = {}, {}
+        exists = os.path.isdir(self.cache_path())
+        try:
+            os.makedirs(self.cache_path(), exist_ok=True)
+        except OSError:
+            pass
+        reverse = {}
+        for name in self.module_tree.module_names():
+            if not os.path.isdir(os.path.join(self.module_tree.root_dir, name)):
+                continue
+            cached = self.read_entry(name) if exists else {}
+            entry = self._scan_module(name, cached)
+            if entry != cached:
+                self._write_json(self._entry_path(name), entry)
+            for required in self._required(entry):
+                reverse.setdefault(required, set()).add(name)
+        self._prune(os.path.dirname(self._entry_path("")), self.versions)
+        self._prune(os.path.dirname(self._reverse_path("")), reverse)
+        for required, names in reverse.items():
+            if self.read_reverse(required) != sorted(names):
+                self._write_json(self._reverse_path(required), sorted(names))
+        return self
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _refresh_index(self):
+        """
+        Bring the cache and its reverse index up to date with .modulefiles
+        which were changed without update(), e.g. edited by hand. Only the
+        modification times of the cached .modulefiles are checked, and only
+        changed modules and modules without a cache entry are scanned again.
+        """
+        try:
+            files = os.listdir(os.path.dirname(self._entry_path("")))
+        except OSError:
+            files = []
+        cached = set(f[: -len(".json")] for f in files if f.endswith(".json"))
+        root = self.module_tree.root_dir
+        changed = [
+            n
+            for n in self.module_tree.module_names()
+            if n not in cached and os.path.isdir(os.path.join(root, n))
+        ]
+        for name in sorted(cached):
+            if any(
+                self._mtime(dotfile) != parsed["mtime"]
+                for dotfile, parsed in self.read_entry(name).items()
+            ):
+                changed.append(name)
+        for name in changed:
+            old = self.read_entry(name)
+            entry = self._scan_module(name, old)
+            if entry != old:
+                self._write_json(self._entry_path(name), entry)
+                self._update_reverse(name, old, entry)
+        self.versions, self.edges = {}, {}
+
+    def load_dependents(self, name):
+        """
+        Load only a module and the modules depending on it, directly or
+        indirectly, as found by the reverse index. This is enough for
+        dependents() and falls back to a full load if there is no cache yet.
+        .modulefiles changed since they were cached are indexed first.
+
+        :param name: the module name
+        :return: the graph itself
+        """
+        if not os.path.isdir(self.cache_path()):
+            return self.load()
+        self._refresh_index()
+        stack = [name]
+        while len(stack):
+            current = stack.pop()
+            if current in self.versions:
+                continue
+            cached = self.read_entry(current)
+            entry = self._scan_module(current, cached)
+            if entry != cached:
+                self._write_json(self._entry_path(current), entry)
+                self._update_reverse(current, cached, entry)
+            stack.extend(
+                n for n in self.read_reverse(current) if n not in self.versions
+            )
+        return self
+
+    def update(self, loader):
+        """
+        Update the cached dependencies of a single module after its
+        .modulefile was saved. Nothing is done if no cache exists yet.
+
+        :param loader: a loaded ModuleLocation
+        """
+        if not os.path.isdir(self.cache_path()):
+            return
+        name = loader.name()
+        cached = self.read_entry(name)
+        entry = dict(cached)
+        path = loader.moduledotfile_path()
+        entry[path] = {
+            "mtime": os.stat(path).st_mtime_ns,
+            "deps": [[d.name, d.version, d.kind] for d in loader.module.dependencies],
+        }
+        self._write_json(self._entry_path(name), entry)
+        self._update_reverse(name, cached, entry)
+
+    def resolve(self, dependency):
+        """
+        Return the node satisfying a dependency, or None if it is missing.
+        Unversioned dependencies resolve to the latest version.
+        """
+        versions = self.versions.get(dependency.name, [])
+        if dependency.version is None:
+            return node_key(dependency.name, versions[-1]) if len(versions) else None
+        if dependency.version in versions:
+            return node_key(dependency.name, dependency.version)
+        return None
+
+    def missing(self):
+        """Return (node, dependency) tuples for all unsatisfied dependencies"""
+        return [
+            (node, d)
+            for node, deps in sorted(self.edges.items())
+            for d in deps
+            if self.resolve(d) is None
+        ]
+
+    def load_order(self, name, version=None):
+        """
+        Return the order in which modules have to be loaded for the given
+        module, dependencies first and the module itself last. Missing
+        dependencies are skipped.
+
+        :raises DependencyCycleError: if the dependencies contain a cycle
+        """
+        versions = self.versions.get(name, [])
+        if version is None and len(versions):
+            version = versions[-1]
+        start = node_key(name, version)
+        if start not in self.edges:
+            raise ValueError(f"Module {start} not found")
+        order, done = [], set()
+
+        def visit(node, path):
+            if node in done:
+                return
+            if node in path:
+                raise DependencyCycleError(path[path.index(node) :] + [node])
+            for dependency in self.edges.get(node, []):
+                resolved = self.resolve(dependency)
+                if resolved is not None:
+                    visit(resolved, path + [node])
+            done.add(node)
+            order.append(node)
+
+        visit(start, [])
+        return order
+
+    def cycles(self):
+        """Return a list of dependency cycles in the tree"""
+        cycles = []
+        seen = set()
+        for node in sorted(self.edges):
+            try:
+                self.load_order(*node.split("/", 1))
+            except DependencyCycleError as e:
+                key = frozenset(e.cycle)
+                if key not in seen:
+                    seen.add(key)
+                    cycles.append(e.cycle)
+        return cycles
+
+    def reverse(self):
+        """Return a dict mapping every node to the nodes depending on it"""
+        reverse = {}
+        for node, deps in self.edges.items():
+            for dependency in deps:
+                resolved = self.resolve(dependency)
+                if resolved is not None:
+                    reverse.setdefault(resolved, []).append(node)
+        return reverse
+
+    def dependents(self, name, version, transitive=True):
+        """
+        Return the modules which would break if a module version was removed.
+        Modules requiring any version of the module only break when the last
+        version is removed.
+
+        :param name: the module name
+        :param version: the module version
+        :param transitive: also include modules depending on broken modules
+        :return: a sorted list of node keys
+        """
+        remaining = [v for v in self.versions.get(name, []) if v != version]
+        broken = set()
+        for node, deps in self.edges.items():
+            if node.split("/", 1)[0] == name:
+                continue
+            for d in deps:
+                if d.name == name and (
+                    d.version == version or (d.version is None and not len(remaining))
+                ):
+                    broken.add(node)
+        if transitive:
+            reverse = self.reverse()
+            stack = list(broken)
+            while len(stack):
+                for dependent in reverse.get(stack.pop(), []):
+                    if dependent not in broken:
+                        broken.add(dependent)
+                        stack.append(dependent)
+        return sorted(broken)
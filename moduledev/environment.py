@@ -0,0 +1,247 @@
+import json
+import os
+import re
+import shlex
+
+from . import util
+
+SHELLS = ["bash", "zsh", "fish", "json"]
+
+_tcl_var = re.compile(r"\$\{(\w+)\}|\$(\w+)")
+
+
+def substitute(value, variables):
+    """Replace Tcl style $VAR and ${VAR} references of known variables"""
+
+    def repl(m):
+        name = m.group(1) or m.group(2)
+        return variables.get(name, m.group(0))
+
+    return _tcl_var.sub(repl, value)
+
+
+def module_variables(loader):
+    """Return the Tcl variables defined for a loaded module by its modulefile"""
+    module = loader.module
+    variables = dict(module.extra_vars)
+    variables.update(
+        {
+            "basedir": loader.module_path(),
+            "MODULEBASE": loader.module_tree.root_dir,
+            "MODULENAME": module.name,
+            "MODULEVERSION": module.version,
+            "MAINTAINER": module.maintainer,
+            "HELPTEXT": module.helptext,
+            "DESCRIPTION": module.description,
+        }
+    )
+    return variables
+
+
+def raw_operations(module):
+    """
+    Return the environment operations of a module in the order of its
+    .modulefile, with Tcl variable references left in place.
+
+    :param module: a Module object
+    :return: a list of (operation, variable, value) lists
+    """
+    operations = []
+    for line in module.lines():
+        if not isinstance(line, str):
+            operations.append([line.operation, line.name, line.path])
+            continue
+        try:
+            fields = shlex.split(line)
+        except ValueError:
+            continue
+        if len(fields) == 3 and fields[0] in ("setenv", "prepend-path", "append-path"):
+            operations.append(fields)
+        elif len(fields) == 2 and fields[0] == "unsetenv":
+            operations.append(["unsetenv", fields[1], None])
+    return operations
+
+
+def module_operations(loader):
+    """
+    Return the environment operations of a loaded module in the order they
+    are applied.
+
+    :param loader: a loaded ModuleLocation
+    :return: a list of (operation, variable, value) lists
+    """
+    variables = module_variables(loader)
+    return [
+        [operation, var, None if value is None else substitute(value, variables)]
+        for operation, var, value in raw_operations(loader.module)
+    ]
+
+
+def apply_operations(operations, environ):
+    """
+    Apply environment operations to an environment. Path variables are
+    deduplicated, keeping the first occurrence of every entry.
+
+    :param operations: a list of (operation, variable, value) tuples
+    :param environ: the environment to start from
+    :return: a dict of the changed variables. Unset variables map to None.
+    """
+    changed = {}
+
+    def get(var):
+        return changed[var] if var in changed else environ.get(var)
+
+    for operation, var, value in operations:
+        if operation == "setenv":
+            changed[var] = value
+        elif operation == "unsetenv":
+            changed[var] = None
+        else:
+            entries = [e for e in (get(var) or "").split(":") if e and e != value]
+            if operation == "prepend-path":
+                entries.insert(0, value)
+            else:
+                entries.append(value)
+            changed[var] = ":".join(dict.fromkeys(entries))
+    return changed
+
+
+def format_environment(changed, shell="bash"):
+    """Format changed environment variables as statements for a shell"""
+    if shell == "json":
+        return json.dumps(changed, sort_keys=True)
+    lines = []
+    for var, value in sorted(changed.items()):
+        if shell == "fish":
+            if value is None:
+                lines.append(f"set -e {var};")
+            elif var.endswith("PATH"):
+                lines.append(f"set -gx {var} (string split : -- {shlex.quote(value)});")
+            else:
+                lines.append(f"set -gx {var} {shlex.quote(value)};")
+        elif shell in ("bash", "zsh"):
+            if value is None:
+                lines.append(f"unset {var};")
+            else:
+                lines.append(f"export {var}={shlex.quote(value)};")
+        else:
+            raise ValueError(f"Unknown shell {shell}")
+    return "\n".join(lines)
+
+
+def parse_module_spec(spec):
+    """Split a NAME or NAME/VERSION module specification"""
+    name, _, version = spec.partition("/")
+    return name, version or None
+
+
+class EnvironmentResolver:
+    """
+    Resolves the environment of modules without a Tcl interpreter. The
+    operations of every module are cached in the tree's cache directory and
+    keyed by the modification times of the module base, its .modulefile and
+    the detached .modulefile of the version, which may not exist.
+    """
+
+    CACHE_NAME = "env.json"
+
+    def __init__(self, module_tree, use_cache=True):
+        self.module_tree = module_tree
+        self.use_cache = use_cache
+        self._cache = None
+        self._dirty = False
+
+    def cache_path(self):
+        return os.path.join(self.module_tree.cache_dir(), self.CACHE_NAME)
+
+    def _load_cache(self):
+        if self._cache is None:
+            self._cache = {}
+            if self.use_cache:
+                try:
+                    with open(self.cache_path()) as f:
+                        self._cache = json.load(f)
+                except (OSError, ValueError):
+                    pass
+        return self._cache
+
+    def save_cache(self):
+        """Write the cache if it changed. Unwriteable trees are not cached."""
+        if not self.use_cache or not self._dirty:
+            return
+        try:
+            os.makedirs(self.module_tree.cache_dir(), exist_ok=True)
+            tmp = f"{self.cache_path()}.{os.getpid()}"
+            with open(tmp, "w") as f:
+                json.dump(self._cache, f)
+            os.replace(tmp, self.cache_path())
+            self._dirty = False
+        except OSError:
+            pass
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _cached(self, key):
+        entry = self._load_cache().get(key)
+        # entries written before detached .modulefiles were recorded are stale
+        if entry is None or "detached" not in entry:
+            return None
+        if self._mtime(entry["base"]) != entry["base_mtime"]:
+            return None
+        if self._mtime(entry["dotfile"]) != entry["dotfile_mtime"]:
+            return None
+        # a shared version which was detached since
+        if self._mtime(entry["detached"]) != entry["detached_mtime"]:
+            return None
+        return entry
+
+    def operations(self, name, version=None):
+        """
+        Return the environment operations for a module, loading it only if
+        the cached operations are out of date.
+
+        :param name: the module name
+        :param version: the module version (default: the latest)
+        :return: a tuple of the resolved version and the operations
+        """
+        key = f"{name}/{version or ''}"
+        entry = self._cached(key)
+        if entry is None:
+            loader = self.module_tree.load_module(
+                name, version, parse_error_handler=util.ignore_error
+            )
+            detached = os.path.join(loader.module_path(), ".modulefile")
+            entry = {
+                "version": loader.version(),
+                "base": loader.module_base(),
+                "base_mtime": self._mtime(loader.module_base()),
+                "dotfile": loader.moduledotfile_path(),
+                "dotfile_mtime": self._mtime(loader.moduledotfile_path()),
+                "detached": detached,
+                "detached_mtime": self._mtime(detached),
+                "operations": module_operations(loader),
+            }
+            self._load_cache()[key] = entry
+            self._dirty = True
+        return entry["version"], entry["operations"]
+
+    def resolve(self, specs, environ=None):
+        """
+        Resolve the environment changes of loading the given modules in order.
+
+        :param specs: a list of NAME or NAME/VERSION module specifications
+        :param environ: the environment to start from (default: os.environ)
+        :return: a dict of the changed variables. Unset variables map to None.
+        """
+        if environ is None:
+            environ = os.environ
+        operations = []
+        for spec in specs:
+            operations.extend(self.operations(*parse_module_spec(spec))[1])
+        self.save_cache()
+        return apply_operations(operations, environ)
@@ -0,0 +1,151 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from . import util, versionspec
+from .module import ModuleDescriptor
+
+
+class FederatedTree:
+    """
+    A merged view of several module trees. Trees are given in order of
+    precedence: if the same version of a module exists in several trees, the
+    first one wins. Without a version, the latest version over all trees is
+    used.
+    """
+
+    def __init__(self, module_trees, jobs=None):
+        """
+        :param module_trees: a list of ModuleTree objects in order of precedence
+        :param jobs: the number of concurrent workers
+        """
+        self.module_trees = list(module_trees)
+        self.jobs = jobs
+        self._index = {}
+        self._version_indexes = {}
+
+    def _map(self, fn, trees=None):
+        trees = self.module_trees if trees is None else trees
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(fn, trees))
+
+    @staticmethod
+    def _index_tree(module_tree):
+        """Return a dict of module names to their sorted versions in a tree"""
+        index = {}
+        for name in module_tree.module_names():
+            base = os.path.join(module_tree.root_dir, name)
+            if not os.path.isdir(base):
+                continue
+            versions = [
+                v
+                for v in os.listdir(base)
+                if util.valid_version(v) and os.path.isdir(os.path.join(base, v))
+            ]
+            if len(versions):
+                index[name] = sorted(versions, key=util.version_key)
+        return index
+
+    def index(self, module_tree):
+        """Return the cached index of a single tree"""
+        if module_tree.root_dir not in self._index:
+            self.refresh()
+        return self._index[module_tree.root_dir]
+
+    def refresh(self, module_tree=None):
+        """
+        Rebuild the cached index of one tree, or of all trees concurrently.
+        """
+        trees = self.module_trees if module_tree is None else [module_tree]
+        for tree, index in zip(trees, self._map(self._index_tree, trees)):
+            self._index[tree.root_dir] = index
+        self._version_indexes = {}
+
+    def version_index(self, name):
+        """
+        Return a versionspec.VersionIndex of the versions of a module over all
+        trees, cached per module name until the trees are refreshed
+        """
+        if name not in self._version_indexes:
+            self._version_indexes[name] = versionspec.VersionIndex(
+                v for v, _ in self.available_versions(name)
+            )
+        return self._version_indexes[name]
+
+    def module_names(self):
+        names = set()
+        for tree in self.module_trees:
+            names.update(self.index(tree))
+        return sorted(names)
+
+    def available_versions(self, name):
+        """
+        :return: a list of (version, tree) tuples sorted by version, where each
+            version is listed once with the tree of highest precedence
+        """
+        versions = {}
+        for tree in self.module_trees:
+            for version in self.index(tree).get(name, []):
+                versions.setdefault(version, tree)
+        return sorted(versions.items(), key=lambda vt: util.version_key(vt[0]))
+
+    def locate(self, name, version=None):
+        """
+        Find the tree providing a module.
+
+        :param name: the name of the module
+        :param version: the version of the module or a version constraint
+            (default: the latest)
+        :return: a tuple of the tree and version, or (None, None) if not found
+        """
+        versions = self.available_versions(name)
+        if version is None:
+            return versions[-1][::-1] if len(versions) else (None, None)
+        if versionspec.is_constraint(version):
+            version = self.version_index(name).best(version)
+        for v, tree in versions:
+            if v == version:
+                return tree, v
+        return None, None
+
+    def module_exists(self, name, version=None):
+        tree, version = self.locate(name, version)
+        return tree is not None and tree.module_exists(name, version)
+
+    def load_module(
+        self, name, version=None, parse_error_handler=util.raise_value_error
+    ):
+        """
+        Load a module from the tree of highest precedence providing it.
+
+        :return: a ModuleLoader used to load the module
+        """
+        tree, found_version = self.locate(name, version)
+        if tree is None:
+            raise ValueError(
+                f"Module {name}-{version} does not appear to be a valid module "
+                f"in any of the trees {', '.join(t.root_dir for t in self.module_trees)}"
+            )
+        return tree.load_module(name, found_version, parse_error_handler)
+
+    def modules(self, all_versions=False, lazy=False):
+        """
+        Yield the merged modules of all trees, sorted by name and version.
+
+        :param all_versions: yield every version instead of only the latest
+        :param lazy: yield unvalidated ModuleDescriptor objects (see
+            ModuleTree.modules)
+        """
+        for name in self.module_names():
+            versions = self.available_versions(name)
+            if not all_versions:
+                versions = versions[-1:]
+            for version, tree in versions:
+                if lazy:
+                    yield ModuleDescriptor(tree, name, version)
+                    continue
+                if not tree.module_exists(name, version):
+                    continue
+                loader = tree.load_module(
+                    name, version, parse_error_handler=util.ignore_error
+                )
+                yield loader.module
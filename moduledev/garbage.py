@@ -0,0 +1,300 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from . import completion, util
+
+
+class Garbage:
+    """An orphaned or broken entry in a module tree"""
+
+    ORPHAN_LINK = "orphan-link"
+    EMPTY_BASE = "empty-base"
+    MISSING_DOTFILE = "missing-dotfile"
+    UNLINKED_VERSION = "unlinked-version"
+    INVALID_MODULE = "invalid-module"
+    # a version which is not kept by a retention policy (see prune.Pruner)
+    EXPIRED = "expired"
+    # a build of moduledev install which no module version links to
+    UNUSED_BUILD = "unused-build"
+
+    def __init__(self, kind, path, name, reason, links=None, relink=None):
+        """
+        :param kind: one of the garbage kinds defined in this class
+        :param path: the path to remove
+        :param name: the module name the path belongs to, or None for paths
+            outside of modules
+        :param reason: a human readable explanation
+        :param links: modulefile links or other files which should be removed
+            along with the path
+        :param relink: a modulefile link to create instead of removing the
+            path, for versions which are intact apart from their link
+        """
+        self.kind = kind
+        self.path = path
+        self.name = name
+        self.reason = reason
+        self.links = links or []
+        self.relink = relink
+
+    def __repr__(self):
+        return f"{self.kind} {self.path}"
+
+    def remove(self):
+        """Remove the path and its links from the filesystem if they still exist."""
+        for link in self.links:
+            if os.path.lexists(link):
+                os.unlink(link)
+        if os.path.islink(self.path) or os.path.isfile(self.path):
+            os.unlink(self.path)
+        elif os.path.isdir(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+class GarbageCollector:
+    """Finds and removes orphaned and broken entries in a module tree."""
+
+    def __init__(self, module_tree, jobs=None):
+        """
+        :param module_tree: a ModuleTree object
+        :param jobs: the number of concurrent workers (defaults to the
+            executor default)
+        """
+        self.module_tree = module_tree
+        self.jobs = jobs
+
+    def _executor(self):
+        return ThreadPoolExecutor(max_workers=self.jobs)
+
+    def _category_links(self, category):
+        """Return (name, version, path) for every modulefile link in a category"""
+        category_dir = os.path.join(self.module_tree.modulefile_dir(), category)
+        links = []
+        if not os.path.isdir(category_dir):
+            return links
+        for name in os.listdir(category_dir):
+            name_dir = os.path.join(category_dir, name)
+            if not os.path.isdir(name_dir) or os.path.islink(name_dir):
+                continue
+            for version in os.listdir(name_dir):
+                path = os.path.join(name_dir, version)
+                if version.endswith(".lua"):
+                    # rendered by the Lua backend next to the modulefile link
+                    version = version[: -len(".lua")]
+                links.append((name, version, path))
+        return links
+
+    def modulefile_links(self):
+        """
+        Scan all categories concurrently for modulefile links.
+
+        :return: a dict mapping module names to lists of (version, path) tuples
+        """
+        categories = os.listdir(self.module_tree.modulefile_dir())
+        links = {}
+        with self._executor() as executor:
+            for category_links in executor.map(self._category_links, categories):
+                for name, version, path in category_links:
+                    links.setdefault(name, []).append((version, path))
+        return links
+
+    def _scan_module(self, name, links):
+        base = os.path.join(self.module_tree.root_dir, name)
+        garbage = []
+        if not os.path.lexists(base):
+            # only modulefile links remain, which are reported as orphan links
+            # at their own paths below
+            versions = []
+        elif not os.path.isdir(base) or not util.valid_package_name(name):
+            garbage.append(
+                Garbage(Garbage.INVALID_MODULE, base, name, "not a module directory")
+            )
+            versions = []
+        else:
+            versions = [
+                v
+                for v in os.listdir(base)
+                if util.valid_version(v) and os.path.isdir(os.path.join(base, v))
+            ]
+            if not len(versions):
+                garbage.append(
+                    Garbage(Garbage.EMPTY_BASE, base, name, "no versions installed")
+                )
+        shared_dotfile = os.path.exists(os.path.join(base, ".modulefile"))
+        version_links = {}
+        for version, path in links:
+            version_links.setdefault(version, []).append(path)
+        # unlinked versions are linked again in the category of the other
+        # versions, or in the default category of the tree
+        if len(links):
+            category_base = os.path.dirname(links[0][1])
+        else:
+            category_base = os.path.join(
+                self.module_tree.modulefile_dir(), self.module_tree.name, name
+            )
+        for version in versions:
+            path = os.path.join(base, version)
+            if not shared_dotfile and not os.path.exists(
+                os.path.join(path, ".modulefile")
+            ):
+                garbage.append(
+                    Garbage(
+                        Garbage.MISSING_DOTFILE,
+                        path,
+                        name,
+                        "no .modulefile",
+                        version_links.get(version),
+                    )
+                )
+            elif version not in version_links:
+                garbage.append(
+                    Garbage(
+                        Garbage.UNLINKED_VERSION,
+                        path,
+                        name,
+                        "no modulefile link, linked again",
+                        relink=os.path.join(category_base, version),
+                    )
+                )
+        for version, path in links:
+            if version not in versions:
+                garbage.append(
+                    Garbage(Garbage.ORPHAN_LINK, path, name, "no module directory")
+                )
+        return garbage
+
+    def _version_dirs(self):
+        """Return the version directories of the tree and of its trash"""
+        bases = [
+            os.path.join(self.module_tree.root_dir, n)
+            for n in self.module_tree.module_names()
+        ]
+        dirs = []
+        trash_dir = self.module_tree.trash_dir()
+        if os.path.isdir(trash_dir):
+            for entry in os.listdir(trash_dir):
+                dirs.append(os.path.join(trash_dir, entry, "version"))
+                bases.append(os.path.join(trash_dir, entry, "base"))
+        for base in bases:
+            if os.path.isdir(base):
+                dirs.extend(
+                    os.path.join(base, v)
+                    for v in os.listdir(base)
+                    if util.valid_version(v)
+                )
+        return dirs
+
+    def linked_builds(self, path):
+        """Return the keys of the builds linked into a version directory"""
+        builds_dir = self.module_tree.builds_dir()
+        keys = set()
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return keys
+        for entry in entries:
+            if not entry.is_symlink():
+                continue
+            target = os.path.normpath(os.path.join(path, os.readlink(entry.path)))
+            rel = os.path.relpath(target, builds_dir)
+            if rel != os.curdir and not rel.startswith(os.pardir):
+                keys.add(rel.split(os.sep)[0])
+        return keys
+
+    def unused_builds(self, keys=None):
+        """
+        Find the builds of moduledev install which no module version links
+        to, including the versions in the trash. Builds in progress are not
+        listed before they are complete.
+
+        :param keys: only consider the builds with these keys (default: all)
+        :return: a list of Garbage objects
+        """
+        builds_dir = self.module_tree.builds_dir()
+        if not os.path.isdir(builds_dir):
+            return []
+        if keys is None:
+            keys = [
+                e.name
+                for e in os.scandir(builds_dir)
+                if not e.name.startswith(".") and e.is_dir(follow_symlinks=False)
+            ]
+        keys = set(keys)
+        if not len(keys):
+            return []
+        with self._executor() as executor:
+            linked = set().union(
+                *executor.map(self.linked_builds, self._version_dirs())
+            )
+        return [
+            Garbage(
+                Garbage.UNUSED_BUILD,
+                os.path.join(builds_dir, key),
+                None,
+                "no module version links to the build",
+                [
+                    os.path.join(builds_dir, f"{key}.log"),
+                    os.path.join(builds_dir, f"{key}.lock"),
+                ],
+            )
+            for key in sorted(keys - linked)
+            if os.path.isdir(os.path.join(builds_dir, key))
+        ]
+
+    def scan(self):
+        """
+        Scan the module tree concurrently for garbage. Nothing is removed.
+
+        :return: a list of Garbage objects
+        """
+        if not self.module_tree.valid():
+            raise RuntimeError("Cannot collect garbage in a tree that is not set up")
+        links = self.modulefile_links()
+        names = set(self.module_tree.module_names()) | set(links)
+        with self._executor() as executor:
+            results = executor.map(
+                lambda n: self._scan_module(n, links.get(n, [])), sorted(names)
+            )
+            garbage = [g for garbage in results for g in garbage]
+        return garbage + self.unused_builds()
+
+    def _tidy(self, name):
+        """
+        Remove the module base and modulefile bases of a module if no versions
+        remain, as ModuleLocation.clear does.
+        """
+        base = os.path.join(self.module_tree.root_dir, name)
+        if os.path.isdir(base) and not any(
+            util.valid_version(v) and os.path.isdir(os.path.join(base, v))
+            for v in os.listdir(base)
+        ):
+            shutil.rmtree(base, ignore_errors=True)
+        modulefile_dir = self.module_tree.modulefile_dir()
+        for category in os.listdir(modulefile_dir):
+            modulefile_base = os.path.join(modulefile_dir, category, name)
+            if os.path.isdir(modulefile_base) and not len(os.listdir(modulefile_base)):
+                os.rmdir(modulefile_base)
+
+    def _collect(self, g):
+        if g.relink is None:
+            g.remove()
+            return
+        os.makedirs(os.path.dirname(g.relink), exist_ok=True)
+        if not os.path.lexists(g.relink):
+            self.module_tree.link_master(g.relink)
+
+    def collect(self, garbage):
+        """
+        Remove the given garbage concurrently and tidy up the modules it
+        belonged to. Versions which only lack their modulefile link are
+        linked again rather than removed.
+
+        :param garbage: a list of Garbage objects, typically from scan()
+        :return: the list of collected Garbage objects
+        """
+        with self._executor() as executor:
+            list(executor.map(self._collect, garbage))
+            names = set(g.name for g in garbage if g.name is not None)
+            list(executor.map(self._tidy, sorted(names)))
+        completion.CompletionCache(self.module_tree).prune()
+        return garbage
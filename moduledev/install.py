@@ -0,0 +1,301 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+
+import yaml
+
+from . import environment, linkfarm
+from .module import Path
+from .sync import file_hash
+
+STEPS = ["configure", "build", "install"]
+
+# the commands of a recipe which does not override them. $PREFIX is the
+# directory in the build cache the package is installed into and $JOBS the
+# number of parallel make jobs
+DEFAULT_STEPS = {
+    "configure": './configure --prefix="$PREFIX"',
+    "build": 'make -j"$JOBS"',
+    "install": "make install",
+}
+
+# the variable, the name in the module directory and the candidate locations
+# in the installation prefix of the paths added to installed modules
+STANDARD_PATHS = [
+    ("PATH", "bin", ["bin"]),
+    ("LD_LIBRARY_PATH", "lib", ["lib", "lib64"]),
+    ("MANPATH", "man", ["share/man", "man"]),
+    ("PKG_CONFIG_PATH", "pkgconfig", ["lib/pkgconfig", "share/pkgconfig"]),
+]
+
+BUILD_INFO = ".moduledev-build.json"
+
+
+class BuildRecipe:
+    """
+    The shell commands which configure, build and install a package, run in
+    the unpacked source directory. A recipe file is a YAML mapping which may
+    override any of the steps and list toolchain modules to build with:
+
+    configure: cmake -DCMAKE_INSTALL_PREFIX="$PREFIX" .
+    toolchain:
+      - gcc/12.2
+    """
+
+    def __init__(self, steps=None, toolchain=()):
+        """
+        :param steps: a dict of step names to commands, overriding
+            DEFAULT_STEPS
+        :param toolchain: a list of NAME or NAME/VERSION module
+            specifications loaded for the build
+        """
+        self.steps = dict(DEFAULT_STEPS)
+        self.steps.update(steps or {})
+        self.toolchain = list(toolchain)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            try:
+                recipe = yaml.safe_load(f) or {}
+            except yaml.YAMLError as e:
+                raise ValueError(f"Cannot parse recipe {path}: {e}")
+        if not isinstance(recipe, dict):
+            raise ValueError(f"Recipe {path} is not a mapping")
+        unknown = set(recipe) - set(STEPS) - {"toolchain"}
+        if len(unknown):
+            raise ValueError(
+                f"Unknown keys in recipe {path}: {', '.join(sorted(unknown))}"
+            )
+        toolchain = recipe.pop("toolchain", None) or []
+        if isinstance(toolchain, str):
+            toolchain = [toolchain]
+        return cls({s: f"{c}" for s, c in recipe.items()}, toolchain)
+
+    def digest(self):
+        """Return the sha256 hex digest of the build steps"""
+        text = json.dumps([self.steps[s] for s in STEPS])
+        return hashlib.sha256(text.encode()).hexdigest()
+
+
+class Installer:
+    """
+    Builds packages from source tarballs and installs them as module
+    versions. The installation prefix of a build is a directory in the build
+    cache of the tree, keyed by the hashes of the tarball and the recipe and
+    the versions of the toolchain modules, so that installing an unchanged
+    package again only links the cached build into the module.
+    """
+
+    def __init__(self, module_tree, recipe=None, toolchain=(), jobs=None):
+        """
+        :param module_tree: a ModuleTree object
+        :param recipe: a BuildRecipe (default: configure, make and make
+            install)
+        :param toolchain: module specifications loaded for the build in
+            addition to those of the recipe
+        :param jobs: the number of parallel make jobs (default: the number of
+            CPUs)
+        """
+        self.module_tree = module_tree
+        self.recipe = recipe or BuildRecipe()
+        self.toolchain = self.recipe.toolchain + list(toolchain)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.resolver = environment.EnvironmentResolver(module_tree)
+
+    def builds_dir(self):
+        return self.module_tree.builds_dir()
+
+    def toolchain_versions(self):
+        """Return the toolchain as NAME/VERSION with the versions resolved"""
+        return [
+            f"{name}/{self.resolver.operations(name, version)[0]}"
+            for name, version in map(environment.parse_module_spec, self.toolchain)
+        ]
+
+    def key(self, tarball):
+        """Return the cache key of building a tarball"""
+        text = json.dumps(
+            {
+                "source": file_hash(tarball),
+                "recipe": self.recipe.digest(),
+                "toolchain": self.toolchain_versions(),
+            },
+            sort_keys=True,
+        )
+        # short enough to keep the shebangs of installed scripts within the
+        # limits of the kernel
+        return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+    def prefix(self, key):
+        return os.path.join(self.builds_dir(), key)
+
+    def cached(self, key):
+        return os.path.exists(os.path.join(self.prefix(key), BUILD_INFO))
+
+    def environment(self, prefix):
+        """Return the environment of the build with the toolchain loaded"""
+        operations = []
+        for spec in self.toolchain:
+            operations.extend(
+                self.resolver.operations(*environment.parse_module_spec(spec))[1]
+            )
+        env = dict(os.environ)
+        for var, value in environment.apply_operations(operations, env).items():
+            if value is None:
+                env.pop(var, None)
+            else:
+                env[var] = value
+        env["PREFIX"] = prefix
+        env["JOBS"] = f"{self.jobs}"
+        return env
+
+    @staticmethod
+    def _unpack(tarball, dest):
+        """Unpack a tarball and return its top level directory, if any"""
+        try:
+            with tarfile.open(tarball) as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(dest, filter="data")
+                else:
+                    tar.extractall(dest)
+        except tarfile.TarError as e:
+            raise ValueError(f"Cannot unpack {tarball}: {e}")
+        entries = os.listdir(dest)
+        if len(entries) == 1 and os.path.isdir(os.path.join(dest, entries[0])):
+            return os.path.join(dest, entries[0])
+        return dest
+
+    def log_path(self, key):
+        return f"{self.prefix(key)}.log"
+
+    def lock_path(self, key):
+        return f"{self.prefix(key)}.lock"
+
+    def build(self, tarball, rebuild=False):
+        """
+        Build a tarball into the build cache unless it is cached. The output
+        of the build is written to log_path(key). Builds of the same key wait
+        for each other on a lock, and a rebuild keeps the old prefix aside
+        until it succeeds, so that a failure leaves installed versions
+        linking to the old build.
+
+        :param tarball: the source tarball
+        :param rebuild: build even if the build is cached
+        :return: a tuple of the installation prefix and whether it was cached
+        """
+        key = self.key(tarball)
+        prefix = self.prefix(key)
+        if self.cached(key) and not rebuild:
+            return prefix, True
+        os.makedirs(self.builds_dir(), exist_ok=True)
+        lock = os.open(self.lock_path(key), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # built by another process while waiting for the lock
+            if self.cached(key) and not rebuild:
+                return prefix, True
+            self._build(tarball, key, prefix)
+        finally:
+            os.close(lock)
+        return prefix, False
+
+    def _build(self, tarball, key, prefix):
+        old = None
+        if self.cached(key):
+            old = os.path.join(self.builds_dir(), f".{key}.old-{os.getpid()}")
+            os.rename(prefix, old)
+        elif os.path.lexists(prefix):
+            # an interrupted build
+            linkfarm.remove_tree(prefix, self.jobs)
+        work = tempfile.mkdtemp(prefix=f".{key}-", dir=self.builds_dir())
+        try:
+            source_dir = self._unpack(tarball, work)
+            env = self.environment(prefix)
+            with open(self.log_path(key), "w") as log:
+                for step in STEPS:
+                    command = self.recipe.steps[step]
+                    log.write(f"+ {command}\n")
+                    log.flush()
+                    status = subprocess.call(
+                        command,
+                        shell=True,
+                        cwd=source_dir,
+                        env=env,
+                        stdin=subprocess.DEVNULL,
+                        stdout=log,
+                        stderr=subprocess.STDOUT,
+                    )
+                    if status != 0:
+                        raise RuntimeError(
+                            f"The {step} step of {os.path.basename(tarball)} "
+                            f"failed with exit status {status}, see "
+                            f"{self.log_path(key)}"
+                        )
+            os.makedirs(prefix, exist_ok=True)
+            with open(os.path.join(prefix, BUILD_INFO), "w") as f:
+                json.dump(
+                    {
+                        "tarball": os.path.abspath(tarball),
+                        "steps": self.recipe.steps,
+                        "toolchain": self.toolchain_versions(),
+                        "at": time.time(),
+                    },
+                    f,
+                )
+        except BaseException:
+            shutil.rmtree(prefix, ignore_errors=True)
+            if old is not None:
+                os.rename(old, prefix)
+            raise
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+        if old is not None:
+            linkfarm.remove_tree(old, self.jobs)
+
+    @staticmethod
+    def standard_paths(prefix):
+        """
+        Return (source, Path) tuples of the standard paths found in an
+        installation prefix
+        """
+        paths = []
+        for variable, name, candidates in STANDARD_PATHS:
+            for candidate in candidates:
+                source = os.path.join(prefix, candidate)
+                if os.path.isdir(source):
+                    paths.append((source, Path(name, "prepend-path", variable)))
+                    break
+        return paths
+
+    def install(self, module, tarball, overwrite=False, rebuild=False):
+        """
+        Build a tarball unless it is cached, initialize the module version
+        and link the standard paths of the build into it.
+
+        :param module: the Module to initialize
+        :param tarball: the source tarball
+        :param overwrite: replace files where the module version should be
+        :param rebuild: build even if the build is cached
+        :return: a tuple of the ModuleBuilder and whether the build was cached
+        :raises FileExistsError: if files are in the way and overwrite is not
+            given
+        """
+        if not self.module_tree.module_clean(module) and not overwrite:
+            raise FileExistsError(
+                f"Some files exist in the module tree where {module} should be."
+            )
+        prefix, cached = self.build(tarball, rebuild)
+        builder = self.module_tree.init_module(module, overwrite)
+        for source, path_obj in self.standard_paths(prefix):
+            # a shared .modulefile may list the path already
+            builder.module.remove_path(path_obj)
+            builder.add_path(source, path_obj)
+        builder.save_module_file()
+        return builder, cached
@@ -0,0 +1,246 @@
+import json
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+from . import util
+from .pack import PACK_NAME
+from .sync import file_hash
+
+MANIFEST_NAME = ".modulemanifest.json"
+
+
+def manifest_path(loader):
+    """Return the location of the integrity manifest of a module version"""
+    return os.path.join(loader.module_path(), MANIFEST_NAME)
+
+
+def read_manifest(path):
+    """Return the files recorded in a manifest, or an empty dict"""
+    try:
+        with open(path) as f:
+            return json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def write_manifest(path, files):
+    if len(files):
+        util.atomic_write(path, json.dumps({"files": files}, sort_keys=True))
+    elif os.path.exists(path):
+        os.unlink(path)
+
+
+def _files(path):
+    """Return the regular files below a path, not following symlinks"""
+    if os.path.islink(path):
+        return []
+    if not os.path.isdir(path):
+        return [path]
+    files = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            if not os.path.islink(os.path.join(dirpath, name)):
+                files.append(os.path.join(dirpath, name))
+    return files
+
+
+def _inside(rel, prefix):
+    return rel == prefix or rel.startswith(prefix + os.sep)
+
+
+def record_path(loader, path_obj, jobs=None):
+    """
+    Hash the files of a copied path concurrently and record their size, mode
+    and hash in the manifest of the module version. Symlinks are not
+    recorded.
+
+    :param loader: a ModuleLocation
+    :param path_obj: the Path object of the copied path
+    :param jobs: the number of concurrent workers
+    """
+    base = loader.module_path()
+    prefix = os.path.relpath(path_obj.resolve(base), base)
+
+    def entry(path):
+        st = os.stat(path)
+        return os.path.relpath(path, base), {
+            "size": st.st_size,
+            "mode": stat.S_IMODE(st.st_mode),
+            "hash": file_hash(path),
+        }
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        entries = dict(executor.map(entry, _files(path_obj.resolve(base))))
+    files = {
+        rel: e
+        for rel, e in read_manifest(manifest_path(loader)).items()
+        if not _inside(rel, prefix)
+    }
+    files.update(entries)
+    write_manifest(manifest_path(loader), files)
+
+
+def forget_path(loader, path_obj):
+    """Remove the files of a path from the manifest of a module version"""
+    path = manifest_path(loader)
+    if not os.path.exists(path):
+        return
+    base = loader.module_path()
+    prefix = os.path.relpath(path_obj.resolve(base), base)
+    files = read_manifest(path)
+    write_manifest(path, {r: e for r, e in files.items() if not _inside(r, prefix)})
+
+
+class Mismatch:
+    """A file which does not match its manifest entry"""
+
+    MISSING = "missing"
+    SIZE = "size"
+    MODE = "mode"
+    HASH = "hash"
+
+    def __init__(self, kind, path, expected=None, actual=None):
+        """
+        :param kind: one of the mismatch kinds defined in this class
+        :param path: the absolute path of the file
+        :param expected: the recorded value
+        :param actual: the value found on disk
+        """
+        self.kind = kind
+        self.path = path
+        self.expected = expected
+        self.actual = actual
+
+    def __repr__(self):
+        if self.kind == self.MISSING:
+            return f"{self.kind}\t{self.path}"
+        return (
+            f"{self.kind}\t{self.path}\t(expected {self.expected}, found {self.actual})"
+        )
+
+
+class ModuleVerifier:
+    """
+    Verifies module versions against their integrity manifests. The hash of
+    every verified file is cached in the tree's cache directory along with
+    its size and modification time, and files which did not change since they
+    were last verified are not hashed again.
+    """
+
+    CACHE_NAME = "verify.json"
+
+    def __init__(self, module_tree, jobs=None, use_cache=True):
+        """
+        :param module_tree: a ModuleTree object
+        :param jobs: the number of concurrent workers
+        :param use_cache: skip files whose size and modification time match
+            the cached verification stamp
+        """
+        self.module_tree = module_tree
+        self.jobs = jobs
+        self.use_cache = use_cache
+        self.hashed = 0
+        self.skipped = 0
+
+    def cache_path(self):
+        return os.path.join(self.module_tree.cache_dir(), self.CACHE_NAME)
+
+    def _read_cache(self):
+        if not self.use_cache:
+            return {}
+        try:
+            with open(self.cache_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self, cache):
+        try:
+            os.makedirs(self.module_tree.cache_dir(), exist_ok=True)
+            util.atomic_write(self.cache_path(), json.dumps(cache))
+        except OSError:
+            pass
+
+    def manifests(self):
+        """
+        Return the manifests of all module versions in the tree. Packed
+        versions are skipped, since their files are only present once they
+        are unpacked.
+        """
+        root = self.module_tree.root_dir
+        manifests = []
+        for name in sorted(self.module_tree.module_names()):
+            base = os.path.join(root, name)
+            if not os.path.isdir(base):
+                continue
+            for version in os.listdir(base):
+                path = os.path.join(base, version, MANIFEST_NAME)
+                packed = os.path.exists(os.path.join(base, version, PACK_NAME))
+                if util.valid_version(version) and os.path.exists(path) and not packed:
+                    manifests.append(path)
+        return manifests
+
+    def _check(self, path, entry, stamp):
+        """
+        Check a single file.
+
+        :return: a tuple of the new stamp (or None), a Mismatch (or None) and
+            whether the file was hashed
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None, Mismatch(Mismatch.MISSING, path), False
+        if st.st_size != entry["size"]:
+            size_mismatch = Mismatch(Mismatch.SIZE, path, entry["size"], st.st_size)
+            return None, size_mismatch, False
+        mode = stat.S_IMODE(st.st_mode)
+        if mode != entry["mode"]:
+            mismatch = Mismatch(Mismatch.MODE, path, oct(entry["mode"]), oct(mode))
+        else:
+            mismatch = None
+        hashed = stamp is None or stamp[:2] != [st.st_size, st.st_mtime_ns]
+        digest = file_hash(path) if hashed else stamp[2]
+        if digest != entry["hash"]:
+            mismatch = Mismatch(Mismatch.HASH, path, entry["hash"], digest)
+        return [st.st_size, st.st_mtime_ns, digest], mismatch, hashed
+
+    def verify(self, manifests=None):
+        """
+        Verify the files recorded in the manifests concurrently.
+
+        :param manifests: a list of manifest paths (default: all in the tree)
+        :return: a list of Mismatch objects, sorted by path
+        """
+        cache = self._read_cache()
+        if manifests is None:
+            manifests = self.manifests()
+            # only keep the stamps of files which are still recorded
+            old_cache, cache = cache, {}
+        else:
+            old_cache = cache
+        checks = []
+        for manifest in manifests:
+            base = os.path.dirname(manifest)
+            for rel, entry in read_manifest(manifest).items():
+                path = os.path.join(base, rel)
+                checks.append((path, entry, old_cache.get(path)))
+        self.hashed = self.skipped = 0
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            results = list(executor.map(lambda c: self._check(*c), checks))
+        mismatches = []
+        for (path, _, _), (stamp, mismatch, hashed) in zip(checks, results):
+            if hashed:
+                self.hashed += 1
+            elif stamp is not None:
+                self.skipped += 1
+            if stamp is not None:
+                cache[path] = stamp
+            else:
+                cache.pop(path, None)
+            if mismatch is not None:
+                mismatches.append(mismatch)
+        if self.use_cache:
+            self._write_cache(cache)
+        return sorted(mismatches, key=lambda m: m.path)
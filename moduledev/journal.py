@@ -0,0 +1,345 @@
+import ctypes
+import errno
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+from . import completion, integrity, render, util
+
+FORWARD = "rolled forward"
+BACK = "rolled back"
+
+
+def _syncfs(fd):
+    """
+    Flush all changes to the filesystem of a file descriptor with a single
+    syncfs call, or flush every filesystem where syncfs is not available.
+    """
+    try:
+        if ctypes.CDLL(None, use_errno=True).syncfs(fd) == 0:
+            return
+    except (OSError, AttributeError):
+        pass
+    os.sync()
+
+
+def _fsync_paths(paths):
+    """
+    Flush the files and directories at the given paths and the directories
+    containing them. Missing paths and symlinks only have their directory
+    flushed.
+    """
+    dirs = []
+    for path in paths:
+        for p in [path, os.path.dirname(path)]:
+            if p in dirs:
+                continue
+            try:
+                fd = os.open(p, os.O_RDONLY | os.O_NOFOLLOW)
+            except OSError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            if p != path:
+                dirs.append(p)
+
+
+class Intent:
+    """An operation recorded in the journal before the tree is changed"""
+
+    # ModuleBuilder.build: create the modulefile link, the version directory
+    # and the .modulefile
+    BUILD = "build"
+    # ModuleLocation.clear: remove a version, its link and its empty bases
+    CLEAR = "clear"
+    # ModuleLocation.replace_path: remove a path and add it again
+    REPLACE_PATH = "replace-path"
+    # write a file, such as the .modulefiles of a bulk update
+    WRITE = "write"
+    # Trash.put: move a version and its empty base into the trash
+    TRASH = "trash"
+
+    def __init__(self, kind, target, **args):
+        """
+        :param kind: one of the intent kinds defined in this class
+        :param target: what the operation changes, e.g. NAME/VERSION
+        :param args: everything needed to repeat the operation
+        """
+        self.kind = kind
+        self.target = target
+        self.args = args
+
+    def to_dict(self):
+        return {"kind": self.kind, "target": self.target, "args": self.args}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["kind"], d["target"], **d["args"])
+
+    def __repr__(self):
+        return f"{self.kind}\t{self.target}"
+
+
+class Journal:
+    """
+    The write-ahead journal of a module tree in ${ROOT}/module/.journal.
+    Operations which change the tree in several steps record their intents in
+    a journal file before the first step and remove it after the last one. A
+    file left behind belongs to an interrupted operation, which recover()
+    completes by repeating its steps, since all of them can be repeated, or
+    rolls back if it can no longer be completed.
+
+    Steps are not synced individually. The intents of an operation are
+    recorded with a single fsync of the journal file. Before the journal file
+    is removed, the paths the operation touched are synced along with their
+    directories, or, for large batches such as bulk updates, the filesystem is
+    synced once. While an operation is in progress, its journal file is
+    locked, so that recovery leaves operations of other processes alone.
+    """
+
+    def __init__(self, module_tree):
+        self.module_tree = module_tree
+
+    def path(self):
+        return self.module_tree.journal_dir()
+
+    def _record(self, intents):
+        """
+        Write and lock a journal file, returning its path and descriptor. The
+        file is written, synced and locked under a temporary name, which
+        pending() ignores, before it is renamed into place, so that recovery
+        never sees a partially written file of a running operation.
+        """
+        os.makedirs(self.path(), exist_ok=True)
+        path = os.path.join(
+            self.path(), f"{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        )
+        tmp = f".{os.path.basename(path)}.tmp"
+        tmp = os.path.join(self.path(), tmp)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.write(fd, json.dumps([i.to_dict() for i in intents]).encode())
+            os.fsync(fd)
+            os.rename(tmp, path)
+        except BaseException:
+            os.close(fd)
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return path, fd
+
+    @staticmethod
+    def _commit(path, fd, touched=None):
+        if touched is None:
+            _syncfs(fd)
+        else:
+            _fsync_paths(touched)
+        os.unlink(path)
+        os.close(fd)
+
+    @contextmanager
+    def transaction(self, intents, touched=None):
+        """
+        Record intents, carry them out in the with block and commit them. If
+        the block raises, the journal file is left for recover(). Steps which
+        may be refused, such as checking that nothing is in the way, belong
+        before the transaction, so that only interrupted operations are
+        recovered.
+
+        :param intents: a list of Intent objects
+        :param touched: the paths changed by the operation, which are synced
+            along with their directories on commit. Without them, the whole
+            filesystem is synced once.
+        """
+        if not len(intents):
+            yield
+            return
+        path, fd = self._record(intents)
+        try:
+            yield
+        except BaseException:
+            os.close(fd)
+            raise
+        self._commit(path, fd, touched)
+
+    def pending(self):
+        """Return the journal files left in the journal, oldest first"""
+        if not os.path.isdir(self.path()):
+            return []
+        return [
+            os.path.join(self.path(), f)
+            for f in sorted(os.listdir(self.path()))
+            if not f.startswith(".")
+        ]
+
+    def _direction(self, intent):
+        args = intent.args
+        if intent.kind == Intent.REPLACE_PATH and not os.path.exists(args["source"]):
+            return BACK
+        if intent.kind == Intent.TRASH:
+            # trash imports this module
+            from .trash import TrashEntry
+
+            try:
+                TrashEntry.load(args["entry"])
+            except (OSError, ValueError, TypeError):
+                return BACK
+        return FORWARD
+
+    def recover(self, dry_run=False):
+        """
+        Complete the operations of all journal files which are not locked by
+        a running operation, oldest first, or roll them back if they can no
+        longer be completed:
+
+        - an interrupted path replacement whose source is gone leaves the
+          module without the path
+        - an interrupted move into the trash whose trash entry cannot be read
+          moves the version back into place
+
+        Journal files which cannot be read were not completely written, so
+        none of their steps were taken, and are removed.
+
+        :param dry_run: only report what would be done
+        :return: a list of (Intent, direction) tuples, where direction is
+            FORWARD or BACK
+        """
+        recovered = []
+        for path in self.pending():
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                # committed in the meantime
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            try:
+                with open(path) as f:
+                    intents = [Intent.from_dict(d) for d in json.load(f)]
+            except (ValueError, KeyError, TypeError):
+                intents = []
+            for intent in intents:
+                direction = self._direction(intent)
+                if not dry_run:
+                    getattr(self, f"_{intent.kind.replace('-', '_')}")(
+                        intent.args, direction
+                    )
+                recovered.append((intent, direction))
+            if dry_run:
+                os.close(fd)
+            else:
+                self._commit(path, fd)
+        return recovered
+
+    def _load(self, args):
+        return self.module_tree.load_module(
+            args["name"], args["version"], parse_error_handler=util.ignore_error
+        )
+
+    def _build(self, args, direction):
+        os.makedirs(os.path.dirname(args["link"]), exist_ok=True)
+        if not os.path.lexists(args["link"]):
+            self.module_tree.link_master(args["link"])
+        os.makedirs(args["path"], exist_ok=True)
+        util.atomic_write(args["dotfile"], args["text"])
+        self._load(args).save_module_file()
+
+    def _clear(self, args, direction):
+        for link in [args["link"], f"{args['link']}.lua"]:
+            if os.path.lexists(link):
+                os.unlink(link)
+        shutil.rmtree(args["path"], ignore_errors=True)
+        base = args["base"]
+        if os.path.isdir(base) and not any(
+            util.valid_version(v) for v in os.listdir(base)
+        ):
+            shutil.rmtree(base)
+            shutil.rmtree(args["modulefile_base"], ignore_errors=True)
+        completion.CompletionCache(self.module_tree).remove(
+            args["name"], args["version"]
+        )
+
+    def _replace_path(self, args, direction):
+        # module imports this module
+        from .module import Path
+
+        loader = self._load(args)
+        path_obj = Path(args["path"], args["operation"], args["variable"])
+        if os.path.lexists(path_obj.resolve(loader.module_path())):
+            loader.remove_path(path_obj)
+        else:
+            integrity.forget_path(loader, path_obj)
+            loader.module.remove_path(path_obj)
+        if direction == FORWARD:
+            loader.add_path(args["source"], path_obj, args["link"], args["hardlink"])
+        loader.save_module_file()
+
+    def _write(self, args, direction):
+        if os.path.isdir(os.path.dirname(args["path"])):
+            util.atomic_write(args["path"], args["text"])
+            if args.get("name") is not None:
+                render.update_versions(
+                    self.module_tree, [(args["name"], args.get("version"))]
+                )
+
+    def _trash(self, args, direction):
+        # trash imports this module
+        from .trash import TrashEntry
+
+        if direction == BACK:
+            entry = TrashEntry(args["entry"], args["name"], args["version"])
+            base, module_path = args["base"], args["module_path"]
+            if os.path.isdir(entry.base_path()) and not os.path.lexists(base):
+                os.rename(entry.base_path(), base)
+            if os.path.isdir(entry.version_path()) and not os.path.lexists(module_path):
+                os.rename(entry.version_path(), module_path)
+            if os.path.isdir(module_path) and not os.path.lexists(args["link"]):
+                os.makedirs(os.path.dirname(args["link"]), exist_ok=True)
+                self.module_tree.link_master(args["link"])
+            shutil.rmtree(args["entry"], ignore_errors=True)
+            render.update_versions(self.module_tree, [(args["name"], args["version"])])
+            return
+        entry = TrashEntry.load(args["entry"])
+        for link in [args["link"], f"{args['link']}.lua"]:
+            if os.path.lexists(link):
+                os.unlink(link)
+        deleted = False
+        if os.path.isdir(args["module_path"]) and not os.path.lexists(
+            entry.version_path()
+        ):
+            try:
+                os.rename(args["module_path"], entry.version_path())
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # the trash is on another device, as in Trash.put
+                shutil.rmtree(args["module_path"])
+                deleted = True
+        base = args["base"]
+        if os.path.isdir(base) and not any(
+            util.valid_version(v) for v in os.listdir(base)
+        ):
+            if deleted:
+                shutil.rmtree(base)
+                shutil.rmtree(args["modulefile_base"], ignore_errors=True)
+            else:
+                os.rename(base, entry.base_path())
+                entry.removed_base = True
+                entry.save()
+        if entry.removed_base:
+            shutil.rmtree(args["modulefile_base"], ignore_errors=True)
+        if deleted:
+            shutil.rmtree(args["entry"])
+        completion.CompletionCache(self.module_tree).remove(
+            args["name"], args["version"]
+        )
@@ -0,0 +1,70 @@
+import errno
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# errors of os.link which are resolved by copying the file instead
+_COPY_ERRNOS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP)
+
+
+def link_file(src, dst):
+    """Hardlink a file, copying it if it cannot be linked, e.g. across devices"""
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in _COPY_ERRNOS:
+            raise
+        shutil.copy2(src, dst)
+
+
+def hardlink_tree(src, dest, jobs=None):
+    """
+    Mirror a directory as a hardlink farm: the directories are recreated,
+    symlinks are copied as symlinks and all files are hardlinked
+    concurrently. A single file is hardlinked directly.
+
+    :param src: the file or directory to mirror
+    :param dest: the destination, which must not exist
+    :param jobs: the number of concurrent workers
+    :return: the number of linked files
+    """
+    if not os.path.isdir(src):
+        link_file(src, dest)
+        return 1
+    files = []
+    os.makedirs(dest)
+    for dirpath, dirnames, filenames in os.walk(src):
+        target_dir = os.path.join(dest, os.path.relpath(dirpath, src))
+        for name in dirnames + filenames:
+            path, target = os.path.join(dirpath, name), os.path.join(target_dir, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), target)
+            elif name in dirnames:
+                os.mkdir(target)
+            else:
+                files.append((path, target))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(lambda f: link_file(*f), files))
+    for dirpath, _, _ in os.walk(src):
+        shutil.copystat(dirpath, os.path.join(dest, os.path.relpath(dirpath, src)))
+    return len(files)
+
+
+def remove_tree(path, jobs=None):
+    """
+    Remove a directory tree, unlinking its files concurrently. Symlinks are
+    removed, not followed.
+    """
+    if os.path.islink(path) or not os.path.isdir(path):
+        os.unlink(path)
+        return
+    files, dirs = [], []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirs.append(dirpath)
+        for name in dirnames + filenames:
+            if name in filenames or os.path.islink(os.path.join(dirpath, name)):
+                files.append(os.path.join(dirpath, name))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(os.unlink, files))
+    for dirpath in reversed(dirs):
+        os.rmdir(dirpath)
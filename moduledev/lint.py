@@ -0,0 +1,234 @@
+import os
+import shlex
+from concurrent.futures import ProcessPoolExecutor
+
+from . import util
+
+ERROR = "error"
+WARNING = "warning"
+
+PATH_COMMANDS = ("prepend-path", "append-path")
+
+KNOWN_COMMANDS = frozenset(
+    [
+        "always-load",
+        "append",
+        "append-path",
+        "break",
+        "chdir",
+        "conflict",
+        "continue",
+        "depends-on",
+        "else",
+        "elseif",
+        "exit",
+        "family",
+        "for",
+        "foreach",
+        "getenv",
+        "global",
+        "if",
+        "is-loaded",
+        "lappend",
+        "module",
+        "module-info",
+        "module-whatis",
+        "prepend-path",
+        "prereq",
+        "proc",
+        "pushenv",
+        "puts",
+        "remove-path",
+        "return",
+        "set",
+        "set-alias",
+        "setenv",
+        "source",
+        "switch",
+        "system",
+        "unset",
+        "unset-alias",
+        "unsetenv",
+        "while",
+    ]
+)
+
+
+class Diagnostic:
+    """A problem found in a .modulefile"""
+
+    PARSE_ERROR = "parse-error"
+    SHORT_SET = "short-set"
+    SHORT_PATH = "short-path"
+    DUPLICATE_PATH = "duplicate-path"
+    NO_BASEDIR = "no-basedir"
+    UNKNOWN_COMMAND = "unknown-command"
+
+    def __init__(self, path, line, severity, code, message):
+        """
+        :param path: the .modulefile the problem was found in
+        :param line: the line number, starting at 1
+        :param severity: ERROR or WARNING
+        :param code: one of the diagnostic codes defined in this class
+        :param message: a human readable explanation
+        """
+        self.path = path
+        self.line = line
+        self.severity = severity
+        self.code = code
+        self.message = message
+
+    def __repr__(self):
+        return f"{self.path}:{self.line}: {self.severity}: {self.message} [{self.code}]"
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "line": self.line,
+            "severity": self.severity,
+            "code": self.code,
+            "message": self.message,
+        }
+
+
+def lint_lines(path, lines):
+    """
+    Check the lines of a .modulefile.
+
+    :param path: the name of the file, used in the diagnostics
+    :param lines: an iterable of lines
+    :return: a list of Diagnostic objects in order of appearance
+    """
+    diagnostics = []
+    seen_paths = {}
+    depth = 0
+    for number, line in enumerate(lines, 1):
+        stripped = line.strip()
+        in_block = depth > 0
+        depth = max(0, depth + stripped.count("{") - stripped.count("}"))
+        if not len(stripped) or stripped.startswith("#"):
+            continue
+        try:
+            fields = shlex.split(stripped)
+        except ValueError as e:
+            diagnostics.append(
+                Diagnostic(path, number, ERROR, Diagnostic.PARSE_ERROR, f"{e}")
+            )
+            continue
+        if not len(fields):
+            continue
+        command = fields[0]
+        if command == "set" and len(fields) < 3:
+            diagnostics.append(
+                Diagnostic(
+                    path,
+                    number,
+                    ERROR,
+                    Diagnostic.SHORT_SET,
+                    "set requires a variable name and a value",
+                )
+            )
+        elif command in PATH_COMMANDS and len(fields) < 3:
+            diagnostics.append(
+                Diagnostic(
+                    path,
+                    number,
+                    ERROR,
+                    Diagnostic.SHORT_PATH,
+                    f"{command} requires a variable name and a path",
+                )
+            )
+        elif command in PATH_COMMANDS or (
+            command == "setenv" and len(fields) == 3 and "$basedir" in fields[2]
+        ):
+            name, value = fields[1], fields[2]
+            if (name, value) in seen_paths:
+                diagnostics.append(
+                    Diagnostic(
+                        path,
+                        number,
+                        WARNING,
+                        Diagnostic.DUPLICATE_PATH,
+                        f"{value} is already added to {name} "
+                        f"on line {seen_paths[(name, value)]}",
+                    )
+                )
+            else:
+                seen_paths[(name, value)] = number
+            if "$basedir" not in value:
+                diagnostics.append(
+                    Diagnostic(
+                        path,
+                        number,
+                        WARNING,
+                        Diagnostic.NO_BASEDIR,
+                        f"{value} is not relative to $basedir",
+                    )
+                )
+        elif not in_block and command not in KNOWN_COMMANDS and command != "}":
+            diagnostics.append(
+                Diagnostic(
+                    path,
+                    number,
+                    WARNING,
+                    Diagnostic.UNKNOWN_COMMAND,
+                    f"unknown command {command}",
+                )
+            )
+    return diagnostics
+
+
+def lint_file(path):
+    """Check a single .modulefile. Unreadable files are reported as errors."""
+    try:
+        with open(path) as f:
+            return lint_lines(path, f.readlines())
+    except (OSError, UnicodeDecodeError) as e:
+        return [Diagnostic(path, 0, ERROR, Diagnostic.PARSE_ERROR, f"{e}")]
+
+
+class ModuleLinter:
+    """Checks all .modulefiles of a module tree in a pool of processes."""
+
+    def __init__(self, module_tree, jobs=None):
+        """
+        :param module_tree: a ModuleTree object
+        :param jobs: the number of worker processes (defaults to the number
+            of CPUs)
+        """
+        self.module_tree = module_tree
+        self.jobs = jobs
+
+    def dotfiles(self):
+        """Return the shared and detached .modulefiles of the tree"""
+        root = self.module_tree.root_dir
+        dotfiles = []
+        for name in sorted(self.module_tree.module_names()):
+            base = os.path.join(root, name)
+            if not os.path.isdir(base):
+                continue
+            shared = os.path.join(base, ".modulefile")
+            if os.path.isfile(shared):
+                dotfiles.append(shared)
+            versions = [v for v in os.listdir(base) if util.valid_version(v)]
+            for version in sorted(versions, key=util.version_key):
+                detached = os.path.join(base, version, ".modulefile")
+                if os.path.isfile(detached):
+                    dotfiles.append(detached)
+        return dotfiles
+
+    def run(self, dotfiles=None):
+        """
+        Check the .modulefiles, distributing them to the workers in chunks.
+
+        :param dotfiles: the files to check (default: all in the tree)
+        :return: a list of Diagnostic objects in the order of the files
+        """
+        dotfiles = self.dotfiles() if dotfiles is None else dotfiles
+        if not len(dotfiles):
+            return []
+        workers = self.jobs or os.cpu_count() or 1
+        chunksize = max(1, len(dotfiles) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lint_file, dotfiles, chunksize=chunksize)
+            return [d for diagnostics in results for d in diagnostics]
@@ -2,9 +2,21 @@ import os
 import shlex
 import shutil
 from abc import ABCMeta, abstractmethod
+from collections import namedtuple
+from functools import lru_cache
 from glob import glob
 
-from . import util
+from . import (
+    completion,
+    depgraph,
+    integrity,
+    journal,
+    linkfarm,
+    render,
+    snapshot,
+    util,
+    versionspec,
+)
 
 _modulefile_template = """#%%Module1.0
 set MODULENAME [ file tail [ file dirname $ModulesCurrentModulefile ] ]
@@ -36,10 +48,18 @@ proc ModulesHelp { } {
 module-whatis $DESCRIPTION
 """
 
+# the root of the tree derived from the location of a modulefile link
+# (${ROOT}/modulefile/<category>/<name>/<version>), used in relocatable trees
+_relative_modulebase = (
+    "[ file dirname [ file dirname [ file dirname [ file dirname "
+    "$ModulesCurrentModulefile ] ] ] ]"
+)
+
 
 class ModuleTree:
     def __init__(self, root_dir):
         self.root_dir = os.path.abspath(root_dir)
+        self._version_indexes = {}
 
     @property
     def name(self):
@@ -55,6 +75,42 @@ class ModuleTree:
     def modulefile_dir(self):
         return os.path.join(self.root_dir, "modulefile")
 
+    def cache_dir(self):
+        """The directory in which moduledev keeps its caches for this tree."""
+        return os.path.join(self.module_dir(), ".cache")
+
+    def backend(self):
+        """Return the rendering backend of the tree (see render.BACKENDS)."""
+        try:
+            with open(os.path.join(self.module_dir(), ".backend")) as f:
+                return f.read().strip()
+        except OSError:
+            return "tcl"
+
+    def set_backend(self, backend):
+        """Record the rendering backend of the tree. See render.TreeRenderer for
+        converting the modulefiles of an existing tree."""
+        if backend not in render.BACKENDS:
+            raise ValueError(f"Unknown backend {backend}")
+        path = os.path.join(self.module_dir(), ".backend")
+        if backend == "tcl":
+            if os.path.exists(path):
+                os.unlink(path)
+        else:
+            util.atomic_write(path, f"{backend}\n")
+
+    def trash_dir(self):
+        """The directory into which removed module versions are moved."""
+        return os.path.join(self.module_dir(), ".trash")
+
+    def journal_dir(self):
+        """The directory in which operations are recorded until they are done."""
+        return os.path.join(self.module_dir(), ".journal")
+
+    def builds_dir(self):
+        """The directory in which moduledev install keeps its builds."""
+        return os.path.join(self.module_dir(), ".builds")
+
     def master_module_file(self):
         """Return the master module file if it exists, None otherwise."""
         files = glob(os.path.join(self.module_dir(), "*modulefile"))
@@ -63,6 +119,40 @@ class ModuleTree:
         else:
             return None
 
+    def relative_layout(self):
+        """
+        Return True if the tree is relocatable, i.e. its modulefile links are
+        relative and the master module file derives MODULEBASE from the
+        location of the links.
+        """
+        master = self.master_module_file()
+        if master is None:
+            return False
+        with open(master) as f:
+            return _relative_modulebase in f.read()
+
+    def is_master_link(self, path):
+        """Return True if the path is a symlink to the master module file"""
+        return (
+            os.path.islink(path)
+            and util.link_target(path) == self.master_module_file()
+        )
+
+    def link_master(self, path, relative=None):
+        """
+        Create a symlink to the master module file.
+
+        :param path: the location of the link
+        :param relative: create a relative link (default: relative if the tree
+            has a relative layout)
+        """
+        master = self.master_module_file()
+        if relative is None:
+            relative = self.relative_layout()
+        if relative:
+            master = os.path.relpath(master, os.path.dirname(path))
+        os.symlink(master, path)
+
     def _master_module_file_name(self, name):
         """Construct the name of the master module file"""
         return os.path.join(self.module_dir(), f"{name}_modulefile")
@@ -89,13 +179,45 @@ class ModuleTree:
             m for m in os.listdir(self.root_dir) if m != "module" and m != "modulefile"
         ]
 
-    def modules(self, all_versions=False):
+    def version_index(self, name):
+        """
+        Return a versionspec.VersionIndex of the versions of a module. The
+        index is cached per module name until the modification time of the
+        module directory changes, i.e. until versions are added or removed.
+        """
+        base = os.path.join(self.root_dir, name)
+        mtime = os.stat(base).st_mtime_ns
+        cached = self._version_indexes.get(name)
+        if cached is None or cached[0] != mtime:
+            versions = [v for v in os.listdir(base) if util.valid_version(v)]
+            cached = (mtime, versionspec.VersionIndex(versions))
+            self._version_indexes[name] = cached
+        return cached[1]
+
+    def modules(self, all_versions=False, lazy=False):
+        """
+        Iterate over the modules in the tree.
+
+        :param all_versions: yield every version instead of only the latest
+        :param lazy: yield ModuleDescriptor objects, which only parse the
+            .modulefile once attributes other than the name, version, category
+            and dotfile location are accessed. Module versions are not
+            validated in this case.
+        """
         if not self.valid():
             raise RuntimeError(
                 "Cannot get available modules from a "
                 "module tree that has not been setup"
             )
         for m in self.module_names():
+            if lazy:
+                loader = ModuleLoader(self, m)
+                versions = loader.available_versions()
+                if not all_versions:
+                    versions = [loader.version()]
+                for v in versions:
+                    yield ModuleDescriptor(self, m, v)
+                continue
             loader = self.load_module(m, parse_error_handler=util.ignore_error)
             if all_versions:
                 for v in loader.available_versions():
@@ -115,8 +237,19 @@ class ModuleTree:
             and not len(os.listdir(self.root_dir))
         )
 
-    def setup(self, name):
-        """Set up the module root tree."""
+    def setup(self, name, seed=None, relative=False, backend="tcl"):
+        """
+        Set up the module root tree.
+
+        :param name: the name of the module tree
+        :param seed: an optional binary file object containing a snapshot
+            (see moduledev export) with which the tree is populated
+        :param relative: set up a relocatable tree with relative modulefile
+            links (see relative_layout)
+        :param backend: the rendering backend of the tree (see
+            render.BACKENDS). With the Lua backend, a Lua modulefile is
+            rendered for every version in addition to the modulefile link.
+        """
         if not self.can_setup(name):
             raise ValueError(
                 "Module tree must be set up in an empty, " "writeable directory"
@@ -124,8 +257,15 @@ class ModuleTree:
         os.makedirs(str(self.modulefile_dir()))
         os.makedirs(str(self.module_dir()))
         f = open(self._master_module_file_name(name), "w")
-        f.write(_modulefile_template % self.root_dir)
+        f.write(
+            _modulefile_template
+            % (_relative_modulebase if relative else self.root_dir)
+        )
         f.close()
+        if seed is not None:
+            snapshot.import_snapshot(self, seed)
+        if backend != "tcl":
+            render.TreeRenderer(self, backend).run()
 
     def init_module(self, module, overwrite=False):
         """
@@ -187,8 +327,8 @@ class ModuleTree:
         given name and version.
 
         :param name: the name of the module
-        :param version: the version of the module. if none is provided, the
-            latest is loaded
+        :param version: the version of the module or a version constraint such
+            as ">=2.1,<3". if none is provided, the latest is loaded
         :param parse_error_handler: a function which handles parse error
             messages. If none is provided, an exception is raised.
 
@@ -271,41 +411,99 @@ class ModuleLocation(metaclass=ABCMeta):
             and self.version() is not None
             and util.writeable_dir(self.module_path())
             and os.path.exists(self.moduledotfile_path())
-            and os.readlink(self.modulefile_path())
-            == self.module_tree.master_module_file()
+            and self.module_tree.is_master_link(self.modulefile_path())
         )
 
     def path_exists(self, path):
         """Return true if the path that the path object implies already exists."""
         return os.path.lexists(path.resolve(self.module_path()))
 
-    def add_path(self, source, path_obj, link=True):
+    def add_path(self, source, path_obj, link=True, hardlink=False, jobs=None):
         """Copy or link the contents of the source path to the path implied
-           in the destination path object."""
+           in the destination path object. With hardlink, the directories
+           are recreated and the files are hardlinked concurrently (or copied
+           if they are on another device). Copied and hardlinked files are
+           recorded in the integrity manifest of the version."""
         dest = path_obj.resolve(self.module_path())
-        cp = os.symlink if link else shutil.copytree
-        cp(os.path.abspath(source), dest)
+        if hardlink:
+            linkfarm.hardlink_tree(os.path.abspath(source), dest, jobs)
+        else:
+            cp = os.symlink if link else shutil.copytree
+            cp(os.path.abspath(source), dest)
+        if hardlink or not link:
+            integrity.record_path(self, path_obj, jobs)
         self.module.paths.append(path_obj)
 
-    def remove_path(self, path_obj):
-        loc = path_obj.resolve(self.module_path())
-        rm = os.unlink if os.path.islink(loc) else shutil.rmtree
-        rm(path_obj.resolve(self.module_path()))
+    def remove_path(self, path_obj, jobs=None):
+        """Remove the path from the module directory, removing the files of
+           copied or hardlinked paths concurrently."""
+        linkfarm.remove_tree(path_obj.resolve(self.module_path()), jobs)
+        integrity.forget_path(self, path_obj)
         self.module.remove_path(path_obj)
 
+    def replace_path(self, source, path_obj, link=True, hardlink=False, jobs=None):
+        """Replace an existing path with the contents of the source path and
+           save the module file. The replacement is recorded in the journal
+           of the tree, so that it can be completed if it is interrupted."""
+        intent = self.journal_intent(
+            journal.Intent.REPLACE_PATH,
+            source=os.path.abspath(source),
+            operation=path_obj.operation,
+            variable=path_obj.name,
+            path=path_obj.path,
+            link=link,
+            hardlink=hardlink,
+        )
+        touched = [self.module_path(), self.moduledotfile_path()]
+        with journal.Journal(self.module_tree).transaction([intent], touched):
+            self.remove_path(path_obj, jobs)
+            self.add_path(source, path_obj, link, hardlink, jobs)
+            self.save_module_file()
+
     def save_module_file(self):
         if self.module is None:
             raise RuntimeError("Cannot save unloaded module")
         with open(self.moduledotfile_path(), "w") as f:
             f.write(self.module.dump())
+        self.update_caches()
+
+    def update_caches(self):
+        """
+        Update the caches and the rendered modulefiles of the tree after the
+        .modulefile of the loaded module changed.
+        """
+        depgraph.DependencyGraph(self.module_tree).update(self)
+        completion.CompletionCache(self.module_tree).update(self)
+        render.update(self)
+
+    def journal_intent(self, kind, **args):
+        """Describe an operation on this module version for the journal"""
+        return journal.Intent(
+            kind,
+            f"{self.name()}/{self.version()}",
+            name=self.name(),
+            version=self.version(),
+            **args,
+        )
 
     def clear(self):
-        if os.path.exists(self.modulefile_path()):
-            os.unlink(self.modulefile_path())
-        shutil.rmtree(self.module_path(), ignore_errors=True)
-        if len(self.available_versions()) == 0:
-            shutil.rmtree(self.module_base())
-            shutil.rmtree(self.modulefile_base())
+        intent = self.journal_intent(
+            journal.Intent.CLEAR,
+            link=self.modulefile_path(),
+            path=self.module_path(),
+            base=self.module_base(),
+            modulefile_base=self.modulefile_base(),
+        )
+        touched = [self.modulefile_path(), self.module_path(), self.module_base()]
+        with journal.Journal(self.module_tree).transaction([intent], touched):
+            if os.path.exists(self.modulefile_path()):
+                os.unlink(self.modulefile_path())
+            render.remove(self)
+            shutil.rmtree(self.module_path(), ignore_errors=True)
+            if len(self.available_versions()) == 0:
+                shutil.rmtree(self.module_base())
+                shutil.rmtree(self.modulefile_base())
+        completion.CompletionCache(self.module_tree).remove(self.name(), self.version())
 
 
 class ModuleBuilder(ModuleLocation):
@@ -328,10 +526,29 @@ class ModuleBuilder(ModuleLocation):
         return self.module.version
 
     def build(self):
-        os.makedirs(os.path.dirname(self.modulefile_path()), exist_ok=True)
-        os.symlink(self.module_tree.master_module_file(), self.modulefile_path())
-        os.makedirs(self.module_path())
-        self.save_module_file()
+        # refused before the intent is recorded, so that recover() never
+        # completes a build over existing files
+        if not self.clean() or os.path.lexists(self.modulefile_path()):
+            raise FileExistsError(
+                f"Some files exist in the module tree where {self.module} should be."
+            )
+        intent = self.journal_intent(
+            journal.Intent.BUILD,
+            link=self.modulefile_path(),
+            path=self.module_path(),
+            dotfile=self.moduledotfile_path(),
+            text=self.module.dump(),
+        )
+        touched = [
+            self.modulefile_path(),
+            self.module_path(),
+            self.moduledotfile_path(),
+        ]
+        with journal.Journal(self.module_tree).transaction([intent], touched):
+            os.makedirs(os.path.dirname(self.modulefile_path()), exist_ok=True)
+            self.module_tree.link_master(self.modulefile_path())
+            os.makedirs(self.module_path())
+            self.save_module_file()
 
 
 class ModuleLoader(ModuleLocation):
@@ -348,6 +565,7 @@ class ModuleLoader(ModuleLocation):
         super(ModuleLoader, self).__init__(module_tree)
         self._name = name
         self._version = version
+        self._resolved_version = None
 
     def category_name(self):
         files = glob(os.path.join(self.module_tree.modulefile_dir(), "*", self.name()))
@@ -367,11 +585,21 @@ class ModuleLoader(ModuleLocation):
         return self._name
 
     def version(self):
+        """
+        Return the version of the module. A version constraint (see
+        versionspec.VersionConstraint) resolves to the latest matching version,
+        or None if no version matches.
+        """
         if self._version is None:
             available_versions = self.available_versions()
             if len(available_versions) == 0:
                 raise ValueError(f"No versions found for module {self.name()}")
             return max(available_versions, key=util.version_key)
+        elif versionspec.is_constraint(self._version):
+            if self._resolved_version is None:
+                index = self.module_tree.version_index(self.name())
+                self._resolved_version = index.best(self._version)
+            return self._resolved_version
         else:
             return self._version
 
@@ -387,15 +615,70 @@ class ModuleLoader(ModuleLocation):
         )
 
 
+class ModuleDescriptor:
+    """
+    A lightweight reference to a module version. The .modulefile is parsed
+    only when an attribute of the module itself, such as its description,
+    paths or extra_vars, is first accessed.
+    """
+
+    def __init__(
+        self, module_tree, name, version, parse_error_handler=util.ignore_error
+    ):
+        """
+        :param module_tree: a ModuleTree object
+        :param name: The name of the module
+        :param version: The version of the module
+        :param parse_error_handler: a function which handles parse error
+            messages once the module is parsed
+        """
+        self.loader = ModuleLoader(module_tree, name, version)
+        self.name = name
+        self.version = version
+        self._parse_error_handler = parse_error_handler
+        self._category = None
+
+    @property
+    def category(self):
+        if self._category is None:
+            self._category = self.loader.category_name()
+        return self._category
+
+    @property
+    def dotfile(self):
+        """The location of the .modulefile of this version"""
+        return self.loader.moduledotfile_path()
+
+    @property
+    def module(self):
+        """The parsed Module object"""
+        if self.loader.module is None:
+            self.loader.load(error_handler=self._parse_error_handler)
+        return self.loader.module
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self.module, attr)
+
+    def __repr__(self):
+        return f"{self.name}-{self.version}"
+
+
 class Path:
-    """A module path object"""
+    """A module path object. Path objects have no instance dictionary and their
+    strings are interned, since there are many of them in large trees."""
+
+    __slots__ = ("operation", "name", "path")
 
     def __init__(self, path, operation="prepend-path", name="PATH"):
-        (self.operation, self.name) = operation, name
+        (self.operation, self.name) = util.intern(operation), util.intern(name)
         if "$basedir" in path:
-            self.path = path
+            self.path = util.intern(path)
         else:
-            self.path = os.path.join("$basedir", os.path.basename(path.rstrip("/")))
+            self.path = util.intern(
+                os.path.join("$basedir", os.path.basename(path.rstrip("/")))
+            )
 
     def __repr__(self):
         return f"{self.operation} {self.name} {self.path}"
@@ -405,6 +688,57 @@ class Path:
         return self.path.replace("$basedir", basedir)
 
 
+_ParsedModuleFile = namedtuple(
+    "_ParsedModuleFile",
+    ["variables", "paths", "extra_commands", "command_positions", "errors"],
+)
+
+
+@lru_cache(maxsize=4096)
+def _parse_module_file(filename, mtime, size):
+    """
+    Parse a module dotfile. The modification time and size are only part of
+    the arguments so that changed files are not served from the cache.
+
+    :return: a _ParsedModuleFile with the set variables, paths, remaining
+        commands, the number of paths preceding each of the commands and the
+        parse errors encountered, in order of appearance.
+    """
+    variables, paths, extra_commands, positions, errors = [], [], [], [], []
+    for line in open(filename):
+        try:
+            fields = shlex.split(line.strip())
+        except ValueError as e:
+            errors.append(f"parse error in {filename}: {e}")
+            continue
+        if len(fields) == 0:
+            continue
+        if fields[0] == "set":
+            if len(fields) < 3:
+                errors.append(f"Unparsable line in {filename}:\n{line}")
+                continue
+            variables.append((util.intern(fields[1]), util.intern(fields[2])))
+        elif (
+            fields[0] == "prepend-path"
+            or fields[0] == "append-path"
+            or (fields[0] == "setenv" and len(fields) == 3 and "$basedir" in fields[2])
+        ):
+            if len(fields) < 3:
+                errors.append(f"Unparsable line in {filename}:\n{line}")
+                continue
+            paths.append(Path(path=fields[2], operation=fields[0], name=fields[1]))
+        else:
+            extra_commands.append(line.strip())
+            positions.append(len(paths))
+    return _ParsedModuleFile(
+        tuple(variables),
+        tuple(paths),
+        tuple(extra_commands),
+        tuple(positions),
+        tuple(errors),
+    )
+
+
 class Module:
     def __init__(
         self,
@@ -439,17 +773,19 @@ class Module:
         if extra_vars is None:
             extra_vars = {}
         self.root = root
-        self.name = name
-        self.version = version
-        self.maintainer = maintainer
-        self.helptext = helptext
-        self.description = description
-        self.category = category
+        self.name = util.intern(name)
+        self.version = util.intern(version)
+        self.maintainer = util.intern(maintainer)
+        self.helptext = util.intern(helptext)
+        self.description = util.intern(description)
+        self.category = util.intern(category)
         self.shared = shared
         self.extra_vars = extra_vars
         self.extra_commands = extra_commands
 
         self.paths = []
+        # the number of paths preceding each extra command in the .modulefile
+        self.command_positions = []
 
     @classmethod
     def from_file(
@@ -474,36 +810,53 @@ class Module:
             not interpreted and error handler is called. The default handler
             raises a value error with the given error message.
 
+        The parsed contents of a file are cached by its path, modification time
+        and size, such that the shared .modulefile of many versions is only
+        parsed once. Every call returns a new Module object.
+
         :return: a new module parsed from the given file
         """
         module = cls(root, name, version, shared=shared, category=category)
-        for line in open(filename):
-            try:
-                fields = shlex.split(line.strip())
-            except ValueError as e:
-                error_handler(f"parse error in {filename}: {e}")
-                continue
-            if len(fields) == 0:
-                continue
-            if fields[0] == "set":
-                if len(fields) < 3:
-                    error_handler(f"Unparsable line in {filename}:\n{line}")
-                if fields[1] == "MAINTAINER":
-                    module.maintainer = fields[2]
-                elif fields[1] == "HELPTEXT":
-                    module.helptext = fields[2]
-                elif fields[1] == "DESCRIPTION":
-                    module.description = fields[2]
-                else:
-                    module.extra_vars.update({fields[1]: fields[2]})
-            elif fields[0] == "prepend-path" or fields[0] == "append-path":
-                module.paths.append(
-                    Path(path=fields[2], operation=fields[0], name=fields[1])
-                )
+        st = os.stat(filename)
+        parsed = _parse_module_file(filename, st.st_mtime_ns, st.st_size)
+        for error in parsed.errors:
+            error_handler(error)
+        for var, value in parsed.variables:
+            if var == "MAINTAINER":
+                module.maintainer = value
+            elif var == "HELPTEXT":
+                module.helptext = value
+            elif var == "DESCRIPTION":
+                module.description = value
             else:
-                module.extra_commands.append(line.strip())
+                module.extra_vars[var] = value
+        module.paths = list(parsed.paths)
+        module.extra_commands = list(parsed.extra_commands)
+        module.command_positions = list(parsed.command_positions)
         return module
 
+    def lines(self):
+        """
+        Return the paths and extra commands of the module in the order of its
+        .modulefile. Commands without a known position follow all paths.
+
+        :return: a list of Path objects and command strings
+        """
+        lines = list(self.paths)
+        # insert from the last command, so that earlier positions still count
+        # paths only
+        for i in reversed(range(len(self.extra_commands))):
+            position = len(self.paths)
+            if i < len(self.command_positions):
+                position = min(self.command_positions[i], position)
+            lines.insert(position, self.extra_commands[i])
+        return lines
+
+    @property
+    def dependencies(self):
+        """The prereq and module load dependencies of the module"""
+        return depgraph.parse_dependencies(self.extra_commands)
+
     def remove_path(self, path_obj):
         """
         Remove the path from the module if the path_obj.path itself matches any of the paths in the module.
@@ -0,0 +1,167 @@
+import os
+import shutil
+import stat
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from . import util
+
+PACK_NAME = ".modulepack.zip"
+PACK_VAR = "MODULEDEV_PACK"
+
+
+def pack_path(loader):
+    """Return the location of the pack of a module version"""
+    return os.path.join(loader.module_path(), PACK_NAME)
+
+
+def packable_entries(loader):
+    """
+    Return the top level entries of a module version which can be packed.
+    Symlinked paths and the files of moduledev itself, such as the .modulefile
+    or the integrity manifest, stay in place.
+    """
+    return sorted(
+        e
+        for e in os.listdir(loader.module_path())
+        if not e.startswith(".module")
+        and not os.path.islink(os.path.join(loader.module_path(), e))
+    )
+
+
+def _add_to_pack(zf, path, arcname):
+    if os.path.islink(path):
+        info = zipfile.ZipInfo(arcname, time.localtime(os.lstat(path).st_mtime)[:6])
+        info.external_attr = (stat.S_IFLNK | 0o777) << 16
+        zf.writestr(info, os.readlink(path))
+    else:
+        zf.write(path, arcname)
+
+
+def pack_version(loader, keep=False, compress=True):
+    """
+    Pack the contents of a module version into a single zip file in the
+    version directory. The central directory of the zip file serves as a
+    random access table of contents. The pack is recorded in the .modulefile
+    of the version. A version sharing its .modulefile is detached first, i.e.
+    the pack is recorded in a copy of the shared .modulefile in the version
+    directory. Unless keep is given, the packed entries are removed from the
+    version directory.
+
+    :param loader: a loaded ModuleLocation
+    :param keep: keep the packed files in place
+    :param compress: compress the packed files
+    :return: the number of packed entries
+    """
+    dest = pack_path(loader)
+    if os.path.exists(dest):
+        raise ValueError(f"{loader.module} is already packed")
+    base = loader.module_path()
+    entries = packable_entries(loader)
+    count = 0
+    tmp = dest + ".tmp"
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(tmp, "w", compression) as zf:
+        for entry in entries:
+            top = os.path.join(base, entry)
+            _add_to_pack(zf, top, entry)
+            count += 1
+            if os.path.islink(top) or not os.path.isdir(top):
+                continue
+            for dirpath, dirnames, filenames in os.walk(top):
+                for name in sorted(dirnames + filenames):
+                    path = os.path.join(dirpath, name)
+                    _add_to_pack(zf, path, os.path.relpath(path, base))
+                    count += 1
+    os.replace(tmp, dest)
+    loader.module.extra_vars[PACK_VAR] = f"$basedir/{PACK_NAME}"
+    if loader.shared():
+        # the shared .modulefile stays as it is for the other versions
+        loader.module.shared = False
+        util.atomic_write(os.path.join(base, ".modulefile"), loader.module.dump())
+    loader.save_module_file()
+    if not keep:
+        for entry in entries:
+            path = os.path.join(base, entry)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+    return count
+
+
+def pack_contents(filename):
+    """Return the table of contents of a pack without reading its data."""
+    with zipfile.ZipFile(filename) as zf:
+        return zf.namelist()
+
+
+def _extract_members(filename, dest, names):
+    with zipfile.ZipFile(filename) as zf:
+        for name in names:
+            info = zf.getinfo(name)
+            path = util.safe_path(dest, name)
+            mode = info.external_attr >> 16
+            if os.path.lexists(path):
+                os.unlink(path)
+            if stat.S_ISLNK(mode):
+                os.symlink(zf.read(info).decode(), path)
+                continue
+            with zf.open(info) as src, open(path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            if mode:
+                os.chmod(path, stat.S_IMODE(mode))
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            os.utime(path, (mtime, mtime))
+    return len(names)
+
+
+def extract_pack(filename, dest, jobs=None):
+    """
+    Extract a pack in parallel. Directories are created first, then the files
+    are distributed over the workers, each of which reads from its own handle
+    of the pack.
+
+    :param filename: the pack file
+    :param dest: the directory to extract to
+    :param jobs: the number of concurrent workers
+    :return: the number of extracted entries
+    """
+    with zipfile.ZipFile(filename) as zf:
+        infos = zf.infolist()
+    dirs = [i.filename for i in infos if i.is_dir()]
+    files = [i.filename for i in infos if not i.is_dir()]
+    os.makedirs(dest, exist_ok=True)
+    for d in dirs:
+        os.makedirs(util.safe_path(dest, d), exist_ok=True)
+    for f in files:
+        os.makedirs(os.path.dirname(util.safe_path(dest, f)), exist_ok=True)
+    workers = jobs or min(32, (os.cpu_count() or 1) + 4)
+    chunks = [files[i::workers] for i in range(workers) if len(files[i::workers])]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        extracted = executor.map(lambda c: _extract_members(filename, dest, c), chunks)
+        return len(dirs) + sum(extracted)
+
+
+def unpack_version(loader, dest=None, jobs=None):
+    """
+    Extract the pack of a module version. If no destination is given the
+    contents are restored to the version directory and the pack is removed.
+    A version which was detached by pack_version stays detached.
+
+    :param loader: a loaded ModuleLocation
+    :param dest: a directory to extract to instead, e.g. node-local scratch
+    :param jobs: the number of concurrent workers
+    :return: the number of extracted entries
+    """
+    filename = pack_path(loader)
+    if not os.path.exists(filename):
+        raise ValueError(f"{loader.module} is not packed")
+    if dest is not None:
+        return extract_pack(filename, dest, jobs)
+    count = extract_pack(filename, loader.module_path(), jobs)
+    os.unlink(filename)
+    loader.module.extra_vars.pop(PACK_VAR, None)
+    loader.save_module_file()
+    return count
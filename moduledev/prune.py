@@ -0,0 +1,189 @@
+import os
+import re
+import time
+
+from . import util
+from .depgraph import DependencyGraph, node_key
+from .garbage import Garbage, GarbageCollector
+from .versionspec import VersionConstraint
+
+AGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+_age = re.compile(r"^\s*(\d+)\s*([smhdw]?)\s*$")
+
+
+def parse_age(age):
+    """Parse an age such as "90", "12h" or "30d" into seconds"""
+    m = _age.match(age)
+    if m is None:
+        raise ValueError(
+            f'Invalid age "{age}", expected a number with one of the units '
+            f"{', '.join(AGE_UNITS)}"
+        )
+    return int(m.group(1)) * AGE_UNITS[m.group(2) or "s"]
+
+
+def parse_pin(spec):
+    """
+    Parse a pin of the form NAME or NAME/VERSION, where VERSION may also be a
+    version constraint such as "2.*" or ">=1.4,<2".
+
+    :return: a tuple of the module name and a VersionConstraint, or None if
+        every version of the module is pinned
+    """
+    name, _, version = spec.partition("/")
+    if not util.valid_package_name(name):
+        raise ValueError(f'Invalid pin "{spec}"')
+    return name, VersionConstraint(version) if len(version) else None
+
+
+class RetentionPolicy:
+    """
+    Decides which versions of a module are kept. A version is kept if any of
+    the rules applies to it.
+    """
+
+    def __init__(self, keep=None, newer_than=None, pins=(), now=None):
+        """
+        :param keep: keep the newest versions, ordered by util.version_key
+        :param newer_than: keep versions modified less than this many seconds
+            ago
+        :param pins: a list of (name, VersionConstraint or None) tuples as
+            returned by parse_pin
+        :param now: the reference time for ages (default: the current time)
+        """
+        self.keep = keep
+        self.newer_than = newer_than
+        self.pins = list(pins)
+        self.now = time.time() if now is None else now
+
+    def _pinned(self, name, version):
+        return any(
+            n == name and (c is None or c.matches(version)) for n, c in self.pins
+        )
+
+    def kept(self, name, versions):
+        """
+        :param name: the module name
+        :param versions: a list of (version, mtime) tuples
+        :return: a dict mapping kept versions to the reason they are kept
+        """
+        ordered = sorted(versions, key=lambda v: util.version_key(v[0]))
+        newest = set(v for v, _ in ordered[-self.keep :]) if self.keep else set()
+        kept = {}
+        for version, mtime in ordered:
+            if self._pinned(name, version):
+                kept[version] = "pinned"
+            elif version in newest:
+                kept[version] = f"one of the newest {self.keep}"
+            elif self.newer_than is not None and self.now - mtime < self.newer_than:
+                kept[version] = "recently modified"
+        return kept
+
+
+class Pruner:
+    """
+    Removes module versions which are not kept by a retention policy. Versions
+    which kept modules depend on are kept as well. The plan is computed from a
+    single scan of the tree and removed in parallel by a GarbageCollector, so
+    that the module base and modulefile bases are removed along with the last
+    version of a module as ModuleLocation.clear does.
+    """
+
+    def __init__(self, module_tree, policy, jobs=None):
+        """
+        :param module_tree: a ModuleTree object
+        :param policy: a RetentionPolicy
+        :param jobs: the number of concurrent workers
+        """
+        self.module_tree = module_tree
+        self.policy = policy
+        self.collector = GarbageCollector(module_tree, jobs)
+        self.required = {}
+
+    def _versions(self, name):
+        """Return (version, mtime) tuples of the versions of a module"""
+        base = os.path.join(self.module_tree.root_dir, name)
+        if not os.path.isdir(base):
+            return []
+        with os.scandir(base) as entries:
+            return [
+                (e.name, e.stat().st_mtime)
+                for e in entries
+                if util.valid_version(e.name) and e.is_dir(follow_symlinks=False)
+            ]
+
+    def _protect_required(self, expired):
+        """
+        Remove versions which kept versions depend on from the expired nodes
+        until no kept version would break. Unversioned dependencies keep the
+        latest version.
+
+        :param expired: a set of node keys, modified in place
+        """
+        graph = DependencyGraph(self.module_tree).load()
+        self.required = {}
+        changed = True
+        while changed:
+            changed = False
+            for node, deps in sorted(graph.edges.items()):
+                if node in expired:
+                    continue
+                for d in deps:
+                    versions = graph.versions.get(d.name, [])
+                    if d.version is not None:
+                        required = node_key(d.name, d.version)
+                    elif len(versions) and all(
+                        node_key(d.name, v) in expired for v in versions
+                    ):
+                        required = node_key(d.name, versions[-1])
+                    else:
+                        continue
+                    if required in expired:
+                        expired.discard(required)
+                        self.required[required] = node
+                        changed = True
+
+    def scan(self):
+        """
+        Compute the versions to remove. Nothing is removed. Versions which are
+        only kept since other modules require them are recorded in required,
+        mapping them to one of the modules requiring them.
+
+        :return: a list of Garbage objects sorted by name and version
+        """
+        if not self.module_tree.valid():
+            raise RuntimeError("Cannot prune a tree that is not set up")
+        links = self.collector.modulefile_links()
+        expired = set()
+        for name in self.module_tree.module_names():
+            if not util.valid_package_name(name):
+                continue
+            versions = self._versions(name)
+            kept = self.policy.kept(name, versions)
+            expired.update(node_key(name, v) for v, _ in versions if v not in kept)
+        self._protect_required(expired)
+        garbage = []
+        for node in expired:
+            name, version = node.split("/", 1)
+            garbage.append(
+                Garbage(
+                    Garbage.EXPIRED,
+                    os.path.join(self.module_tree.root_dir, name, version),
+                    name,
+                    "not retained",
+                    [p for v, p in links.get(name, []) if v == version],
+                )
+            )
+        return sorted(
+            garbage, key=lambda g: (g.name, util.version_key(os.path.basename(g.path)))
+        )
+
+    def prune(self, garbage):
+        """
+        Remove the versions concurrently.
+
+        :param garbage: a list of Garbage objects, typically from scan()
+        :return: the list of removed Garbage objects
+        """
+        return self.collector.collect(garbage)
@@ -0,0 +1,152 @@
+import json
+import os
+
+OPERATIONS = ["location", "show", "paths", "exists", "latest-version"]
+
+
+class QueryError(ValueError):
+    """Raised when a query cannot be answered"""
+
+    pass
+
+
+class QueryHandler:
+    """
+    Answers newline-delimited JSON queries about modules from a single module
+    tree (or FederatedTree), such that many queries can be answered by one
+    process. A query has the form
+
+    {"id": 1, "op": "location", "module": "hello", "version": ">=2"}
+
+    where "id" and "version" are optional, and is answered with
+
+    {"id": 1, "ok": true, "result": "/root/hello/2.10"}
+
+    or {"id": 1, "ok": false, "error": "..."} if it fails. Loaded modules are
+    cached for as long as the modification times of their module base and
+    .modulefile do not change.
+    """
+
+    def __init__(self, module_tree, check_module):
+        """
+        :param module_tree: a ModuleTree or FederatedTree object
+        :param check_module: a function taking a module tree, a module name and
+            a version, which returns a loaded ModuleLocation. It raises
+            SystemExit or ValueError if the module does not exist or cannot
+            be loaded.
+        """
+        self.module_tree = module_tree
+        self.check_module = check_module
+        self._loaders = {}
+
+    @staticmethod
+    def _stamp(loader):
+        try:
+            return (
+                os.stat(loader.module_base()).st_mtime_ns,
+                os.stat(loader.moduledotfile_path()).st_mtime_ns,
+            )
+        except OSError:
+            return None
+
+    def _refresh(self):
+        """
+        Rebuild the version index of a FederatedTree, since versions may have
+        been added or removed since it was built.
+
+        :return: True if there was an index to refresh
+        """
+        if not hasattr(self.module_tree, "refresh"):
+            return False
+        self.module_tree.refresh()
+        return True
+
+    def _check_module(self, name, version):
+        try:
+            return self.check_module(self.module_tree, name, version)
+        except SystemExit as e:
+            raise QueryError(f"{e.code}")
+
+    def loader(self, name, version=None):
+        """Return the cached loader of a module, loading it if it changed"""
+        key = (name, version)
+        cached = self._loaders.get(key)
+        if cached is not None:
+            if cached[1] == self._stamp(cached[0]):
+                return cached[0]
+            self._refresh()
+        try:
+            loader = self._check_module(name, version)
+        except QueryError:
+            if not self._refresh():
+                raise
+            loader = self._check_module(name, version)
+        self._loaders[key] = (loader, self._stamp(loader))
+        return loader
+
+    def _result(self, op, name, version):
+        if op == "exists":
+            try:
+                self.loader(name, version)
+                return True
+            except ValueError:
+                return False
+        loader = self.loader(name, version)
+        if op == "location":
+            return loader.module_path()
+        elif op == "latest-version":
+            return loader.version()
+        elif op == "show":
+            with open(loader.moduledotfile_path()) as f:
+                return f.read()
+        elif op == "paths":
+            return [
+                {
+                    "operation": p.operation,
+                    "name": p.name,
+                    "path": p.path,
+                    "resolved": p.resolve(loader.module_path()),
+                }
+                for p in loader.module.paths
+            ]
+
+    def handle(self, request):
+        """
+        Answer a single query.
+
+        :param request: a dict with an "op", a "module" and optionally a
+            "version" and an "id"
+        :return: the response dict
+        """
+        response = {"id": request.get("id") if isinstance(request, dict) else None}
+        try:
+            if not isinstance(request, dict):
+                raise QueryError("A query must be a JSON object")
+            op, name = request.get("op"), request.get("module")
+            if op not in OPERATIONS:
+                raise QueryError(
+                    f"Unknown operation {op}, expected one of {', '.join(OPERATIONS)}"
+                )
+            if not isinstance(name, str):
+                raise QueryError("A query requires a module name")
+            response["result"] = self._result(op, name, request.get("version"))
+            response["ok"] = True
+        except (OSError, ValueError) as e:
+            response["ok"] = False
+            response["error"] = f"{e}"
+        return response
+
+    def serve(self, instream, outstream):
+        """
+        Answer queries line by line until the input is closed. Every response
+        is flushed immediately, so that queries can be pipelined.
+        """
+        for line in iter(instream.readline, ""):
+            if not line.strip():
+                continue
+            try:
+                response = self.handle(json.loads(line))
+            except ValueError as e:
+                response = {"id": None, "ok": False, "error": f"Invalid JSON: {e}"}
+            outstream.write(json.dumps(response) + "\n")
+            outstream.flush()
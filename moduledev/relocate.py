@@ -0,0 +1,140 @@
+import errno
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from . import util
+from .module import ModuleTree, _relative_modulebase
+from .sync import rewrite_modulebase
+
+
+def _inside(path, root):
+    return path == root or path.startswith(root + os.sep)
+
+
+def _transfer_tree(src, dest, copy):
+    """Move or copy a tree, copying across filesystems if it cannot be moved"""
+    if not copy:
+        try:
+            os.rename(src, dest)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    shutil.copytree(src, dest, symlinks=True, dirs_exist_ok=True)
+    if not copy:
+        shutil.rmtree(src)
+
+
+class TreeRelocation:
+    """
+    Moves or copies a module tree to a new root. The MODULEBASE of the master
+    module file and all symlinks pointing into the old root are rewritten.
+    Optionally, the tree is converted to a relative layout (see
+    ModuleTree.relative_layout), such that later moves need no rewriting.
+    """
+
+    def __init__(self, module_tree, new_root, copy=False, relative=False, jobs=None):
+        """
+        :param module_tree: the ModuleTree object to relocate
+        :param new_root: the new root directory. It must not exist or be empty.
+        :param copy: copy the tree instead of moving it
+        :param relative: convert the tree to a relative layout
+        :param jobs: the number of concurrent workers
+        """
+        self.module_tree = module_tree
+        self.new_root = os.path.abspath(new_root)
+        self.copy = copy
+        self.relative = relative
+        self.jobs = jobs
+
+    def check(self):
+        """Raise a ValueError if the tree cannot be relocated"""
+        old_root = self.module_tree.root_dir
+        if not self.module_tree.valid():
+            raise ValueError(f"{old_root} is not a module tree")
+        if _inside(self.new_root, old_root):
+            raise ValueError("A module tree cannot be relocated into itself")
+        if os.path.lexists(self.new_root) and (
+            not os.path.isdir(self.new_root) or len(os.listdir(self.new_root))
+        ):
+            raise ValueError(f"{self.new_root} must not exist or be empty")
+
+    def _new_target(self, link, old_link):
+        """
+        Return the target a link in the relocated tree should have, or None
+        if it can stay as is.
+
+        :param link: the location of the link in the new tree
+        :param old_link: the location the link had in the old tree
+        """
+        old_root = self.module_tree.root_dir
+        target = os.readlink(link)
+        resolved = os.path.normpath(os.path.join(os.path.dirname(old_link), target))
+        if not _inside(resolved, old_root):
+            # relative links out of the tree would break when moved
+            return None if os.path.isabs(target) else resolved
+        new_target = os.path.join(self.new_root, os.path.relpath(resolved, old_root))
+        if self.relative:
+            new_target = os.path.relpath(new_target, os.path.dirname(link))
+        elif not os.path.isabs(target):
+            return None
+        return None if new_target == target else new_target
+
+    def _rewrite_links(self, top):
+        """Rewrite the links below a top level entry and return their number"""
+        old_root = self.module_tree.root_dir
+        count = 0
+        stack = [top]
+        while len(stack):
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    if not entry.is_symlink():
+                        continue
+                    old_link = os.path.join(
+                        old_root, os.path.relpath(entry.path, self.new_root)
+                    )
+                    target = self._new_target(entry.path, old_link)
+                    if target is None:
+                        continue
+                    tmp = f"{entry.path}.relocate-tmp"
+                    os.symlink(target, tmp)
+                    os.replace(tmp, entry.path)
+                    count += 1
+        return count
+
+    def _rewrite_master(self, new_tree):
+        master = new_tree.master_module_file()
+        with open(master) as f:
+            text = f.read()
+        modulebase = (
+            _relative_modulebase
+            if self.relative or new_tree.relative_layout()
+            else self.new_root
+        )
+        util.atomic_write(master, rewrite_modulebase(text, modulebase))
+
+    def run(self):
+        """
+        Relocate the tree.
+
+        :return: a tuple of the relocated ModuleTree and the number of
+            rewritten links
+        """
+        self.check()
+        _transfer_tree(self.module_tree.root_dir, self.new_root, self.copy)
+        new_tree = ModuleTree(self.new_root)
+        self._rewrite_master(new_tree)
+        # the caches contain absolute paths of the old root
+        shutil.rmtree(new_tree.cache_dir(), ignore_errors=True)
+        tops = [
+            entry.path
+            for entry in os.scandir(self.new_root)
+            if entry.is_dir(follow_symlinks=False)
+        ]
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            count = sum(executor.map(self._rewrite_links, tops))
+        return new_tree, count
@@ -0,0 +1,269 @@
+import os
+import re
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+
+from . import depgraph, environment, util
+
+BACKENDS = ["tcl", "lua"]
+
+LUA_OPERATIONS = {
+    "prepend-path": "prepend_path",
+    "append-path": "append_path",
+    "setenv": "setenv",
+    "unsetenv": "unsetenv",
+}
+
+# Tcl variables which are Lua locals in every rendered modulefile
+_lua_locals = {"basedir": "basedir", "MODULEBASE": "modulebase"}
+
+_lua_ref = re.compile(r"\$\{(basedir|MODULEBASE)\}|\$(basedir|MODULEBASE)(?!\w)")
+
+# the root of the tree derived from the location of the Lua modulefile
+# (${ROOT}/modulefile/<category>/<name>/<version>.lua), such that rendered
+# modulefiles remain valid when the tree is relocated or mirrored
+_lua_modulebase = (
+    'local modulebase = (myFileName():gsub("/[^/]+/[^/]+/[^/]+/[^/]+$", ""))'
+)
+
+
+def lua_quote(s):
+    """Quote a string as a Lua string literal"""
+    s = s.replace("\\", "\\\\").replace('"', '\\"')
+    s = s.replace("\n", "\\n").replace("\t", "\\t")
+    return f'"{s}"'
+
+
+def lua_value(value, variables):
+    """
+    Convert a Tcl value to a Lua expression. References to $basedir and
+    $MODULEBASE refer to the Lua locals of the modulefile, other known Tcl
+    variables are substituted.
+    """
+    value = environment.substitute(value, variables)
+    parts, pos = [], 0
+    for m in _lua_ref.finditer(value):
+        if m.start() > pos:
+            parts.append(lua_quote(value[pos : m.start()]))
+        parts.append(_lua_locals[m.group(1) or m.group(2)])
+        pos = m.end()
+    if pos < len(value) or not len(parts):
+        parts.append(lua_quote(value[pos:]))
+    return " .. ".join(parts)
+
+
+def _lua_command(command):
+    """
+    Convert a modulefile command which is not an environment operation to
+    Lua, or return None if it is not supported.
+    """
+    try:
+        fields = shlex.split(command)
+    except ValueError:
+        return None
+    if len(fields) and fields[0] in LUA_OPERATIONS:
+        # rendered by raw_operations
+        return ""
+    dependencies = depgraph.parse_dependencies([command])
+    if len(dependencies):
+        specs = ", ".join(
+            lua_quote(d.name if d.version is None else f"{d.name}/{d.version}")
+            for d in dependencies
+        )
+        if dependencies[0].kind == "load":
+            return f"load({specs})"
+        # a Tcl prereq with several modules requires any one of them
+        return f"prereq{'_any' if len(dependencies) > 1 else ''}({specs})"
+    if len(fields) > 1 and fields[0] == "conflict":
+        return f"conflict({', '.join(lua_quote(f) for f in fields[1:])})"
+    return None
+
+
+def render_lua(loader):
+    """
+    Render the Lua modulefile of a loaded module version, equivalent to the
+    master module file of the tree sourcing its .modulefile. Commands which
+    cannot be converted are kept as comments.
+
+    :param loader: a loaded ModuleLocation
+    :return: the text of the Lua modulefile
+    """
+    module = loader.module
+    variables = environment.module_variables(loader)
+    for name in _lua_locals:
+        variables.pop(name)
+    helptext = (
+        f"\t{module.name} {module.version} - {module.description}\n"
+        f"\tMaintainer: {module.maintainer}\n\n{module.helptext}"
+    )
+    lines = [
+        f"-- Generated by moduledev from the .modulefile of {module.name}/"
+        f"{module.version}.",
+        "-- Changes are overwritten whenever the .modulefile is saved.",
+        _lua_modulebase,
+        f"local basedir = pathJoin(modulebase, {lua_quote(module.name)}, "
+        f"{lua_quote(module.version)})",
+        "",
+        f"whatis({lua_quote(module.description)})",
+        f"help({lua_quote(helptext)})",
+        f"conflict({lua_quote(module.name)})",
+    ]
+    for operation, var, value in environment.raw_operations(module):
+        args = [lua_quote(var)]
+        if value is not None:
+            args.append(lua_value(value, variables))
+        lines.append(f"{LUA_OPERATIONS[operation]}({', '.join(args)})")
+    for command in module.extra_commands:
+        converted = _lua_command(command)
+        if converted is None:
+            lines.append(f"-- not converted: {command}")
+        elif len(converted):
+            lines.append(converted)
+    return "\n".join(lines) + "\n"
+
+
+def lua_path(loader):
+    """Return the location of the Lua modulefile next to the modulefile link"""
+    return f"{loader.modulefile_path()}.lua"
+
+
+def write_lua(loader):
+    """
+    Write the Lua modulefile of a loaded module version unless it is up to
+    date.
+
+    :return: True if the file was written
+    """
+    text = render_lua(loader)
+    path = lua_path(loader)
+    try:
+        with open(path) as f:
+            if f.read() == text:
+                return False
+    except OSError:
+        pass
+    util.atomic_write(path, text)
+    return True
+
+
+def remove_lua(loader):
+    """
+    Remove the Lua modulefile of a module version if it exists.
+
+    :return: True if the file was removed
+    """
+    if not os.path.exists(lua_path(loader)):
+        return False
+    os.unlink(lua_path(loader))
+    return True
+
+
+def update(loader):
+    """
+    Regenerate the Lua modulefiles rendered from the .modulefile of a loaded
+    module version after it was saved, if the tree uses the Lua backend. A
+    shared .modulefile is rendered for every version of the module, but only
+    changed files are written.
+
+    :param loader: a loaded ModuleLocation
+    """
+    module_tree = loader.module_tree
+    if module_tree.backend() != "lua":
+        return
+    write_lua(loader)
+    if not loader.shared():
+        return
+    for version in loader.available_versions():
+        if version == loader.version():
+            continue
+        other = module_tree.load_module(
+            loader.name(), version, parse_error_handler=util.ignore_error
+        )
+        if other.shared():
+            write_lua(other)
+
+
+def update_versions(module_tree, versions, jobs=None):
+    """
+    Regenerate the Lua modulefiles of many module versions concurrently after
+    their .modulefiles were written without save_module_file, e.g. by a bulk
+    update or a snapshot import, if the tree uses the Lua backend. Versions
+    which are not valid are skipped.
+
+    :param module_tree: a ModuleTree object
+    :param versions: (name, version) tuples. A version of None stands for
+        every version sharing the .modulefile of the module.
+    :param jobs: the number of concurrent workers
+    :return: the number of written Lua modulefiles
+    """
+    if module_tree.backend() != "lua":
+        return 0
+    selected = set()
+    for name, version in versions:
+        if version is not None:
+            selected.add((name, version))
+            continue
+        base = os.path.join(module_tree.root_dir, name)
+        if os.path.isdir(base):
+            selected.update(
+                (name, v)
+                for v in os.listdir(base)
+                if util.valid_version(v)
+                and not os.path.exists(os.path.join(base, v, ".modulefile"))
+            )
+
+    def render(name_version):
+        try:
+            loader = module_tree.load_module(
+                *name_version, parse_error_handler=util.ignore_error
+            )
+        except ValueError:
+            return False
+        return write_lua(loader)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return sum(executor.map(render, sorted(selected)))
+
+
+def remove(loader):
+    """Remove the Lua modulefile of a removed module version, if any"""
+    if loader.module_tree.backend() == "lua":
+        remove_lua(loader)
+
+
+class TreeRenderer:
+    """Converts all module versions of a tree to a rendering backend."""
+
+    def __init__(self, module_tree, backend, jobs=None):
+        """
+        :param module_tree: a ModuleTree object
+        :param backend: one of BACKENDS. The Tcl backend only uses the master
+            module file, so converting to it removes all Lua modulefiles.
+        :param jobs: the number of concurrent workers
+        """
+        if backend not in BACKENDS:
+            raise ValueError(
+                f"Unknown backend {backend}, expected one of {', '.join(BACKENDS)}"
+            )
+        self.module_tree = module_tree
+        self.backend = backend
+        self.jobs = jobs
+
+    def _render(self, descriptor):
+        if self.backend == "lua":
+            # loads the module on first access
+            descriptor.module
+            return write_lua(descriptor.loader)
+        return remove_lua(descriptor.loader)
+
+    def run(self):
+        """
+        Render every module version concurrently and record the backend of
+        the tree, such that saving a module keeps its rendering up to date.
+
+        :return: the number of written or removed Lua modulefiles
+        """
+        descriptors = list(self.module_tree.modules(all_versions=True, lazy=True))
+        self.module_tree.set_backend(self.backend)
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return sum(executor.map(self._render, descriptors))
@@ -0,0 +1,208 @@
+import gzip
+import json
+import os
+
+from . import render, util
+
+SNAPSHOT_FORMAT = 1
+
+
+def _scan_module(module_tree, name, include_links):
+    """Yield snapshot records for a single module base"""
+    base = os.path.join(module_tree.root_dir, name)
+    yield {"type": "dir", "path": name}
+    for entry in os.scandir(base):
+        rel = os.path.join(name, entry.name)
+        if entry.name == ".modulefile" and entry.is_file():
+            yield {"type": "file", "path": rel}
+        elif util.valid_version(entry.name) and entry.is_dir(follow_symlinks=False):
+            yield {"type": "dir", "path": rel}
+            for version_entry in os.scandir(entry.path):
+                version_rel = os.path.join(rel, version_entry.name)
+                if version_entry.name == ".modulefile" and version_entry.is_file():
+                    yield {"type": "file", "path": version_rel}
+                elif include_links and version_entry.is_symlink():
+                    yield {
+                        "type": "link",
+                        "path": version_rel,
+                        "target": os.readlink(version_entry.path),
+                    }
+
+
+def _scan_modulefiles(module_tree, include_links):
+    """Yield snapshot records for the modulefile link tree"""
+    master = module_tree.master_module_file()
+    root = module_tree.root_dir
+    for dirpath, dirnames, filenames in os.walk(module_tree.modulefile_dir()):
+        for d in dirnames:
+            path = os.path.join(dirpath, d)
+            if not os.path.islink(path):
+                yield {"type": "dir", "path": os.path.relpath(path, root)}
+        for f in filenames + dirnames:
+            path = os.path.join(dirpath, f)
+            if not os.path.islink(path):
+                continue
+            target = os.readlink(path)
+            if util.link_target(path) == master:
+                yield {"type": "modulefile-link", "path": os.path.relpath(path, root)}
+            elif include_links:
+                yield {
+                    "type": "link",
+                    "path": os.path.relpath(path, root),
+                    "target": target,
+                }
+
+
+def scan_tree(module_tree, include_links=False):
+    """
+    Collect the records describing the layout of a module tree. Directory
+    records are always listed before anything that is placed inside of them.
+
+    :param module_tree: a ModuleTree object
+    :param include_links: include the targets of symlinked module paths
+    :return: a list of snapshot records
+    """
+    if not module_tree.valid():
+        raise RuntimeError("Cannot snapshot a module tree that has not been setup")
+    records = list(_scan_modulefiles(module_tree, include_links))
+    for name in sorted(module_tree.module_names()):
+        if os.path.isdir(os.path.join(module_tree.root_dir, name)):
+            records.extend(_scan_module(module_tree, name, include_links))
+    records.sort(key=lambda r: r["type"] != "dir")
+    return records
+
+
+def export_snapshot(module_tree, fileobj, include_links=False):
+    """
+    Write the layout of the module tree and the contents of all .modulefiles
+    to a gzip compressed stream of JSON lines. Copied path contents are not
+    included.
+
+    :param module_tree: a ModuleTree object
+    :param fileobj: a binary file object to write to
+    :param include_links: include the targets of symlinked module paths
+    :return: the number of records written
+    """
+    records = scan_tree(module_tree, include_links)
+    header = {"type": "header", "format": SNAPSHOT_FORMAT, "name": module_tree.name}
+    with gzip.GzipFile(fileobj=fileobj, mode="wb") as f:
+        f.write((json.dumps(header) + "\n").encode())
+        for record in records:
+            if record["type"] == "file":
+                path = os.path.join(module_tree.root_dir, record["path"])
+                with open(path) as dotfile:
+                    record = dict(record, content=dotfile.read())
+            f.write((json.dumps(record) + "\n").encode())
+    return len(records)
+
+
+def read_snapshot(fileobj):
+    """
+    Read the records of a snapshot lazily.
+
+    :param fileobj: a binary file object containing a snapshot
+    :return: a tuple of the header and an iterator over the records
+    """
+    f = gzip.GzipFile(fileobj=fileobj, mode="rb")
+    lines = (json.loads(line) for line in f)
+    try:
+        header = next(lines)
+    except (StopIteration, OSError, ValueError) as e:
+        raise ValueError(f"Could not read snapshot: {e}")
+    if header.get("type") != "header" or header.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError("Unsupported snapshot format")
+    return header, lines
+
+
+def snapshot_name(fileobj):
+    """Return the name of the module tree stored in a snapshot."""
+    header, _ = read_snapshot(fileobj)
+    return header["name"]
+
+
+def _make_dirs(root, dirs):
+    """Create a batch of directories, only creating the leaves explicitly"""
+    dirs = sorted(set(dirs))
+    leaves = [
+        d
+        for i, d in enumerate(dirs)
+        if i + 1 == len(dirs) or not dirs[i + 1].startswith(d + os.sep)
+    ]
+    for d in leaves:
+        os.makedirs(_record_path(root, d), exist_ok=True)
+
+
+def _record_path(root, rel):
+    """
+    Resolve the path of a snapshot record, refusing paths which escape the
+    root, either directly or through a symlink in the tree.
+    """
+    path = util.safe_path(root, rel)
+    parent = os.path.realpath(os.path.dirname(path))
+    if not (parent + os.sep).startswith(os.path.realpath(root) + os.sep):
+        raise ValueError(f"Refusing to write {rel} outside of {root}")
+    return path
+
+
+def _rendered_version(rel):
+    """
+    Return the (name, version) tuple whose Lua modulefile depends on a .modulefile
+    or modulefile link record, with a version of None for a shared .modulefile,
+    or None for other records
+    """
+    parts = rel.split(os.sep)
+    if parts[-1] == ".modulefile":
+        return (parts[0], parts[1] if len(parts) == 3 else None)
+    if parts[0] == "modulefile" and len(parts) == 4:
+        return (parts[2], parts[3])
+    return None
+
+
+def import_snapshot(module_tree, fileobj, overwrite=False):
+    """
+    Recreate the contents of a snapshot in a module tree which has been set
+    up. Modulefile links are pointed to the master module file of the tree.
+    If the tree uses the Lua backend, the imported versions are rendered.
+
+    :param module_tree: a ModuleTree object
+    :param fileobj: a binary file object containing a snapshot
+    :param overwrite: replace files and links which already exist
+    :return: the number of records imported
+    :raises ValueError: if a record would be written outside of the tree
+    """
+    if not module_tree.valid():
+        raise RuntimeError("Cannot import into a module tree that has not been setup")
+    _, records = read_snapshot(fileobj)
+    root = module_tree.root_dir
+    relative = module_tree.relative_layout()
+    dirs = []
+    rendered = set()
+    count = 0
+    for record in records:
+        count += 1
+        if record["type"] == "dir":
+            dirs.append(record["path"])
+            continue
+        if len(dirs):
+            _make_dirs(root, dirs)
+            dirs = []
+        path = _record_path(root, record["path"])
+        if os.path.lexists(path):
+            if not overwrite:
+                raise ValueError(f"{path} already exists")
+            os.unlink(path)
+        if record["type"] == "file":
+            with open(path, "w") as f:
+                f.write(record["content"])
+            rendered.add(_rendered_version(record["path"]))
+        elif record["type"] == "modulefile-link":
+            module_tree.link_master(path, relative)
+            rendered.add(_rendered_version(record["path"]))
+        elif record["type"] == "link":
+            os.symlink(record["target"], path)
+        else:
+            raise ValueError(f"Unknown snapshot record type {record['type']}")
+    _make_dirs(root, dirs)
+    rendered.discard(None)
+    render.update_versions(module_tree, rendered)
+    return count
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from . import util
+from .module import ModuleTree
+
+MANIFEST_NAME = ".sync-manifest.json"
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file's contents."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def rewrite_modulebase(text, root):
+    """Replace the MODULEBASE of a master module file with the given root"""
+    return re.sub(
+        r"^set MODULEBASE .*$",
+        lambda _: f"set MODULEBASE {root}",
+        text,
+        count=1,
+        flags=re.MULTILINE,
+    )
+
+
+class SyncResult:
+    """Counts of the operations carried out by a sync"""
+
+    def __init__(self):
+        self.copied = []
+        self.linked = []
+        self.created = []
+        self.removed = []
+        self.unchanged = 0
+
+    def changed(self):
+        return (
+            len(self.copied) + len(self.linked) + len(self.created) + len(self.removed)
+        )
+
+    def __repr__(self):
+        return (
+            f"{len(self.copied)} copied, {len(self.linked)} linked, "
+            f"{len(self.created)} directories created, {len(self.removed)} removed, "
+            f"{self.unchanged} unchanged"
+        )
+
+
+class TreeSync:
+    """
+    Mirrors a module tree to another location, e.g. node-local storage. A
+    manifest of (path, size, mtime, hash) is kept in the destination so that
+    only changed entries are transferred on subsequent syncs.
+    """
+
+    def __init__(self, module_tree, dest, categories=None, jobs=None):
+        """
+        :param module_tree: the ModuleTree object to mirror
+        :param dest: the destination root directory
+        :param categories: a list of categories to mirror (default: all)
+        :param jobs: the number of concurrent transfers
+        """
+        self.module_tree = module_tree
+        self.dest = os.path.abspath(dest)
+        self.categories = categories
+        self.jobs = jobs
+
+    def manifest_path(self):
+        return os.path.join(self.dest, "module", MANIFEST_NAME)
+
+    def load_manifest(self):
+        """Return the manifest of the last sync, or an empty one."""
+        try:
+            with open(self.manifest_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest):
+        tmp = self.manifest_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self.manifest_path())
+
+    def _selected(self):
+        """Return the module names and modulefile directories to mirror"""
+        modulefile_dir = self.module_tree.modulefile_dir()
+        categories = self.categories
+        if categories is None:
+            categories = os.listdir(modulefile_dir)
+            names = self.module_tree.module_names()
+        else:
+            names = set()
+            for category in categories:
+                category_dir = os.path.join(modulefile_dir, category)
+                if os.path.isdir(category_dir):
+                    names.update(os.listdir(category_dir))
+        roots = [os.path.join(self.module_tree.root_dir, n) for n in names]
+        roots += [os.path.join(modulefile_dir, c) for c in categories]
+        return [r for r in roots if os.path.lexists(r)]
+
+    def _scan_entry(self, path, entries, master):
+        rel = os.path.relpath(path, self.module_tree.root_dir)
+        st = os.lstat(path)
+        if os.path.islink(path):
+            target = os.readlink(path)
+            if util.link_target(path) == master:
+                entries[rel] = {"type": "modulefile-link"}
+            else:
+                entries[rel] = {"type": "link", "target": target}
+        elif os.path.isdir(path):
+            entries[rel] = {"type": "dir"}
+        else:
+            entries[rel] = {
+                "type": "file",
+                "size": st.st_size,
+                "mtime": st.st_mtime_ns,
+            }
+
+    def scan(self):
+        """
+        Stat every entry to be mirrored.
+
+        :return: a dict mapping relative paths to manifest entries (without
+            hashes)
+        """
+        master = self.module_tree.master_module_file()
+        entries = {}
+        self._scan_entry(self.module_tree.modulefile_dir(), entries, master)
+        for top in self._selected():
+            self._scan_entry(top, entries, master)
+            if os.path.islink(top) or not os.path.isdir(top):
+                continue
+            for dirpath, dirnames, filenames in os.walk(top):
+                for name in dirnames + filenames:
+                    self._scan_entry(os.path.join(dirpath, name), entries, master)
+        return entries
+
+    def _transfer(self, rel, entry, old):
+        """Copy a single file if its contents changed and return its entry"""
+        src = os.path.join(self.module_tree.root_dir, rel)
+        dst = os.path.join(self.dest, rel)
+        entry = dict(entry, hash=file_hash(src))
+        if old is not None and old.get("hash") == entry["hash"] and os.path.exists(dst):
+            return rel, entry, False
+        tmp = dst + ".sync-tmp"
+        shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+        return rel, entry, True
+
+    def _remove(self, rel):
+        path = os.path.join(self.dest, rel)
+        if os.path.islink(path) or os.path.isfile(path):
+            os.unlink(path)
+        elif os.path.isdir(path):
+            shutil.rmtree(path)
+
+    def _sync_master(self, master_dst):
+        with open(self.module_tree.master_module_file()) as f:
+            text = rewrite_modulebase(f.read(), self.dest)
+        if os.path.exists(master_dst):
+            with open(master_dst) as f:
+                if f.read() == text:
+                    return False
+        with open(master_dst, "w") as f:
+            f.write(text)
+        return True
+
+    def run(self, dry_run=False):
+        """
+        Mirror the module tree to the destination.
+
+        :param dry_run: only compute what would be done. Changed files are
+            reported as copied, since they are not hashed.
+        :return: a SyncResult
+        """
+        if not self.module_tree.valid():
+            raise RuntimeError("Cannot sync a module tree that has not been setup")
+        manifest = self.load_manifest()
+        source = self.scan()
+        result = SyncResult()
+        master_dst = os.path.join(
+            self.dest, "module", os.path.basename(self.module_tree.master_module_file())
+        )
+
+        stale = [
+            rel
+            for rel, old in manifest.items()
+            if rel not in source or source[rel]["type"] != old["type"]
+        ]
+        # remove children before their parents
+        result.removed = sorted(stale, reverse=True)
+
+        dirs, transfers, links = [], [], []
+        new_manifest = {}
+        for rel, entry in source.items():
+            old = manifest.get(rel)
+            if old is not None and old["type"] != entry["type"]:
+                old = None
+            if entry["type"] == "dir":
+                new_manifest[rel] = entry
+                if old is None:
+                    dirs.append(rel)
+                else:
+                    result.unchanged += 1
+            elif entry["type"] == "file":
+                if (
+                    old is not None
+                    and old["size"] == entry["size"]
+                    and old["mtime"] == entry["mtime"]
+                ):
+                    new_manifest[rel] = old
+                    result.unchanged += 1
+                else:
+                    transfers.append((rel, entry, old))
+            else:
+                new_manifest[rel] = entry
+                if old == entry:
+                    result.unchanged += 1
+                else:
+                    links.append(rel)
+
+        if dry_run:
+            result.created = sorted(dirs)
+            result.copied = sorted(t[0] for t in transfers)
+            result.linked = sorted(links)
+            return result
+
+        for rel in result.removed:
+            self._remove(rel)
+        os.makedirs(os.path.dirname(master_dst), exist_ok=True)
+        if self._sync_master(master_dst):
+            result.copied.append(os.path.relpath(master_dst, self.dest))
+        # the mirrored Lua modulefiles stay up to date if the mirror is changed
+        mirror = ModuleTree(self.dest)
+        if mirror.backend() != self.module_tree.backend():
+            mirror.set_backend(self.module_tree.backend())
+        for rel in sorted(dirs):
+            os.makedirs(os.path.join(self.dest, rel), exist_ok=True)
+        result.created = sorted(dirs)
+        for rel in sorted(links):
+            dst = os.path.join(self.dest, rel)
+            if os.path.lexists(dst):
+                os.unlink(dst)
+            entry = source[rel]
+            target = (
+                master_dst if entry["type"] == "modulefile-link" else entry["target"]
+            )
+            os.symlink(target, dst)
+        result.linked = sorted(links)
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for rel, entry, copied in executor.map(
+                lambda t: self._transfer(*t), transfers
+            ):
+                new_manifest[rel] = entry
+                if copied:
+                    result.copied.append(rel)
+                else:
+                    result.unchanged += 1
+        self.save_manifest(new_manifest)
+        return result
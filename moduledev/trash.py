@@ -0,0 +1,299 @@
+import errno
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+
+from . import completion, journal, linkfarm, render, util
+from .garbage import GarbageCollector
+from .module import ModuleTree
+
+META_NAME = "trash.json"
+WORKER_LOCK = ".trash.lock"
+
+
+class TrashEntry:
+    """
+    A module version moved into the trash. The entry is a directory holding
+    the version directory, the module base if the last version was removed,
+    and a metadata file recording where they came from.
+    """
+
+    def __init__(self, path, name, version, links=None, removed_base=False, at=None):
+        """
+        :param path: the directory of the entry in the trash
+        :param name: the module name
+        :param version: the module version
+        :param links: the modulefile links which were removed
+        :param removed_base: whether the module base was moved into the entry
+        :param at: the time of removal (default: now)
+        """
+        self.path = path
+        self.name = name
+        self.version = version
+        self.links = links or []
+        self.removed_base = removed_base
+        self.at = time.time() if at is None else at
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, META_NAME)) as f:
+            meta = json.load(f)
+        return cls(path, **meta)
+
+    def save(self):
+        meta = {
+            "name": self.name,
+            "version": self.version,
+            "links": self.links,
+            "removed_base": self.removed_base,
+            "at": self.at,
+        }
+        util.atomic_write(os.path.join(self.path, META_NAME), json.dumps(meta))
+
+    def version_path(self):
+        return os.path.join(self.path, "version")
+
+    def base_path(self):
+        return os.path.join(self.path, "base")
+
+    def restore(self, module_tree):
+        """Move the version back into the tree and link it again"""
+        module_base = os.path.join(module_tree.root_dir, self.name)
+        module_path = os.path.join(module_base, self.version)
+        if os.path.lexists(module_path) or (
+            self.removed_base and os.path.lexists(module_base)
+        ):
+            raise ValueError(
+                f"Cannot restore {self.name}/{self.version}, "
+                f"since files exist where it should be"
+            )
+        if self.removed_base:
+            os.rename(self.base_path(), module_base)
+        elif not os.path.isdir(module_base):
+            # the base was moved into the entry of a version removed later on
+            if not os.path.exists(os.path.join(self.version_path(), ".modulefile")):
+                raise ValueError(
+                    f"Cannot restore {self.name}/{self.version}, since its "
+                    f"shared .modulefile was removed with a later version. "
+                    f"Restore that version first."
+                )
+            os.makedirs(module_base)
+        if os.path.exists(self.version_path()):
+            os.rename(self.version_path(), module_path)
+        for link in self.links:
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            if not os.path.lexists(link):
+                module_tree.link_master(link)
+        shutil.rmtree(self.path)
+        loader = module_tree.load_module(
+            self.name, self.version, parse_error_handler=util.ignore_error
+        )
+        completion.CompletionCache(module_tree).update(loader)
+        render.update(loader)
+
+    def purge(self, jobs=None):
+        """Delete the entry and its contents for good"""
+        linkfarm.remove_tree(self.path, jobs)
+
+    def __repr__(self):
+        removed = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.at))
+        return f"{self.name}/{self.version}\t(removed {removed})"
+
+
+class Trash:
+    """
+    The trash of a module tree in ${ROOT}/module/.trash. Module versions are
+    removed by renaming them into the trash, which is instant and leaves no
+    partially removed versions behind, and are deleted later on, either by a
+    detached worker once the undo window has passed or by moduledev gc --trash.
+    """
+
+    # the time for which removed versions can be restored by default
+    DEFAULT_WINDOW = "10m"
+
+    def __init__(self, module_tree):
+        self.module_tree = module_tree
+
+    def path(self):
+        return self.module_tree.trash_dir()
+
+    def entries(self):
+        """Return all entries in the trash, oldest first"""
+        if not os.path.isdir(self.path()):
+            return []
+        entries = []
+        for name in os.listdir(self.path()):
+            try:
+                entries.append(TrashEntry.load(os.path.join(self.path(), name)))
+            except (OSError, ValueError, TypeError):
+                continue
+        return sorted(entries, key=lambda e: e.at)
+
+    def put(self, loader):
+        """
+        Remove a module version by unlinking its modulefile link and moving it
+        into the trash. The module base and modulefile base are removed along
+        with the last version, as ModuleLocation.clear does. If the trash is on
+        another device, the version is deleted right away.
+
+        :param loader: a ModuleLocation
+        :return: the TrashEntry, or None if the version was deleted
+        """
+        name, version = loader.name(), loader.version()
+        path = os.path.join(self.path(), f"{name}-{version}-{uuid.uuid4().hex[:8]}")
+        intent = loader.journal_intent(
+            journal.Intent.TRASH,
+            entry=path,
+            meta=os.path.join(path, META_NAME),
+            link=loader.modulefile_path(),
+            module_path=loader.module_path(),
+            base=loader.module_base(),
+            modulefile_base=loader.modulefile_base(),
+        )
+        touched = [
+            path,
+            os.path.join(path, META_NAME),
+            loader.modulefile_path(),
+            loader.module_path(),
+            loader.module_base(),
+        ]
+        with journal.Journal(self.module_tree).transaction([intent], touched):
+            os.makedirs(path)
+            entry = TrashEntry(path, name, version)
+            if os.path.lexists(loader.modulefile_path()):
+                entry.links.append(loader.modulefile_path())
+            entry.save()
+            for link in entry.links:
+                os.unlink(link)
+            render.remove(loader)
+            try:
+                os.rename(loader.module_path(), entry.version_path())
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # the entry is kept until the version is gone, so that
+                # recover() completes an interrupted deletion
+                shutil.rmtree(loader.module_path())
+                entry = None
+            if len(loader.available_versions()) == 0:
+                if entry is None:
+                    shutil.rmtree(loader.module_base())
+                else:
+                    os.rename(loader.module_base(), entry.base_path())
+                    entry.removed_base = True
+                    entry.save()
+                shutil.rmtree(loader.modulefile_base(), ignore_errors=True)
+            if entry is None:
+                shutil.rmtree(path)
+        completion.CompletionCache(self.module_tree).remove(name, version)
+        return entry
+
+    def find(self, name, version=None):
+        """Return the most recently removed entry of a module, or None"""
+        for entry in reversed(self.entries()):
+            if entry.name == name and (version is None or entry.version == version):
+                return entry
+        return None
+
+    def expired(self, window=0, now=None):
+        """Return the entries which were removed more than window seconds ago"""
+        now = time.time() if now is None else now
+        return [e for e in self.entries() if now - e.at >= window]
+
+    def empty(self, entries, jobs=None):
+        """
+        Delete entries for good, unlinking their files concurrently. Builds of
+        moduledev install which were only linked into the deleted versions
+        are deleted as well.
+
+        :param entries: a list of TrashEntry objects
+        :return: the list of deleted entries
+        """
+        collector = GarbageCollector(self.module_tree, jobs)
+        keys = set()
+        for entry in entries:
+            keys.update(collector.linked_builds(entry.version_path()))
+            entry.purge(jobs)
+        for build in collector.unused_builds(keys):
+            build.remove()
+        return entries
+
+    def lock_worker(self):
+        """
+        Take the lock held by the worker emptying the trash.
+
+        :return: the locked file descriptor, or None if a worker holds the lock
+        """
+        fd = os.open(
+            os.path.join(self.module_tree.module_dir(), WORKER_LOCK),
+            os.O_RDWR | os.O_CREAT,
+            0o644,
+        )
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def work(self, window):
+        """
+        Delete entries once the undo window has passed, sleeping until the
+        oldest entry expires, until the trash is empty. Only one worker runs
+        per tree, so this returns right away if another worker holds the lock.
+
+        :param window: the undo window in seconds
+        """
+        fd = self.lock_worker()
+        while fd is not None:
+            entries = self.entries()
+            if not len(entries):
+                os.close(fd)
+                # an entry put into the trash before the lock was released
+                # did not start a worker of its own
+                fd = self.lock_worker() if len(self.entries()) else None
+                continue
+            delay = entries[0].at + window - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.empty(self.expired(window))
+            except OSError:
+                # gc --trash is emptying the trash as well
+                os.close(fd)
+                return
+
+    def spawn_worker(self, window):
+        """
+        Start a detached process which deletes the expired entries of the trash
+        once the undo window has passed, unless a worker is running already.
+
+        :param window: the undo window in seconds
+        """
+        fd = self.lock_worker()
+        if fd is None:
+            # the running worker deletes the new entry as well
+            return
+        os.close(fd)
+        root = self.module_tree.root_dir
+        subprocess.Popen(
+            [sys.executable, "-m", "moduledev.trash", root, f"{window}"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+
+def main(args):
+    root, window = args[0], float(args[1])
+    Trash(ModuleTree(root)).work(window)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
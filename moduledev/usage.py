@@ -0,0 +1,203 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from . import util
+
+
+def format_size(size):
+    """Format a number of bytes in human readable units"""
+    for unit in ["B", "K", "M", "G", "T"]:
+        if size < 1024 or unit == "T":
+            break
+        size /= 1024
+    return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+
+
+class VersionUsage:
+    """The disk usage of a module version"""
+
+    def __init__(self, name, version, size=0, files=0, external=None, shared=None):
+        """
+        :param name: the module name
+        :param version: the module version
+        :param size: the allocated size in bytes, counting hardlinked files
+            once
+        :param files: the number of files
+        :param external: a dict of symlinks pointing out of the version
+            directory (relative to it) to their targets
+        :param shared: a dict of "device:inode" keys to the sizes of files with
+            more than one link, used to count them once over many versions
+        """
+        self.name = name
+        self.version = version
+        self.size = size
+        self.files = files
+        self.external = external or {}
+        self.shared = shared or {}
+
+    def to_dict(self):
+        return {
+            "size": self.size,
+            "files": self.files,
+            "external": self.external,
+            "shared": self.shared,
+        }
+
+    def __repr__(self):
+        return f"{format_size(self.size)}\t{self.name}/{self.version}"
+
+
+class DiskUsage:
+    """
+    Computes the disk usage of module versions. Every version directory is
+    walked with scandir in a pool of threads. The results are cached in the
+    tree's cache directory along with the modification times of all
+    directories of a version, and are only recomputed once one of them
+    changes.
+    """
+
+    CACHE_NAME = "du.json"
+
+    def __init__(self, module_tree, jobs=None, use_cache=True):
+        """
+        :param module_tree: a ModuleTree object
+        :param jobs: the number of concurrent workers
+        :param use_cache: use and update the cached results
+        """
+        self.module_tree = module_tree
+        self.jobs = jobs
+        self.use_cache = use_cache
+
+    def cache_path(self):
+        return os.path.join(self.module_tree.cache_dir(), self.CACHE_NAME)
+
+    def _read_cache(self):
+        if not self.use_cache:
+            return {}
+        try:
+            with open(self.cache_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self, cache):
+        try:
+            os.makedirs(self.module_tree.cache_dir(), exist_ok=True)
+            util.atomic_write(self.cache_path(), json.dumps(cache))
+        except OSError:
+            pass
+
+    def versions(self, all_versions=False, names=None):
+        """
+        Return the (name, version) tuples of the tree, sorted by name and
+        version.
+
+        :param all_versions: include every version instead of only the latest
+        :param names: only include these modules
+        """
+        root = self.module_tree.root_dir
+        versions = []
+        for name in sorted(names or self.module_tree.module_names()):
+            base = os.path.join(root, name)
+            if not os.path.isdir(base):
+                continue
+            found = sorted(
+                (
+                    v
+                    for v in os.listdir(base)
+                    if util.valid_version(v) and os.path.isdir(os.path.join(base, v))
+                ),
+                key=util.version_key,
+            )
+            versions.extend((name, v) for v in (found if all_versions else found[-1:]))
+        return versions
+
+    def _version_path(self, name, version):
+        return os.path.join(self.module_tree.root_dir, name, version)
+
+    def _valid(self, entry, path):
+        try:
+            return all(
+                os.stat(os.path.join(path, rel)).st_mtime_ns == mtime
+                for rel, mtime in entry["dirs"].items()
+            )
+        except OSError:
+            return False
+
+    def _scan(self, name, version):
+        """
+        Walk a version directory.
+
+        :return: a tuple of the VersionUsage and the directory mtimes
+        """
+        path = self._version_path(name, version)
+        usage = VersionUsage(name, version)
+        dirs = {".": os.stat(path).st_mtime_ns}
+        seen = set()
+        stack = [path]
+        while len(stack):
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    st = entry.stat(follow_symlinks=False)
+                    if entry.is_symlink():
+                        target = util.link_target(entry.path)
+                        if not (target + os.sep).startswith(path + os.sep):
+                            rel = os.path.relpath(entry.path, path)
+                            usage.external[rel] = os.readlink(entry.path)
+                        continue
+                    size = st.st_blocks * 512
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs[os.path.relpath(entry.path, path)] = st.st_mtime_ns
+                        stack.append(entry.path)
+                        usage.size += size
+                        continue
+                    usage.files += 1
+                    if st.st_nlink > 1:
+                        key = f"{st.st_dev}:{st.st_ino}"
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        usage.shared[key] = size
+                    usage.size += size
+        return usage, dirs
+
+    def usage(self, versions):
+        """
+        Return the disk usage of module versions, scanning the versions whose
+        cached results are out of date concurrently.
+
+        :param versions: a list of (name, version) tuples
+        :return: a list of VersionUsage objects in the same order
+        """
+        cache = self._read_cache()
+        results, stale = {}, []
+        for name, version in versions:
+            key = f"{name}/{version}"
+            entry = cache.get(key)
+            if entry is not None and self._valid(
+                entry, self._version_path(name, version)
+            ):
+                results[key] = VersionUsage(name, version, **entry["usage"])
+            else:
+                stale.append((name, version))
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for usage, dirs in executor.map(lambda v: self._scan(*v), stale):
+                key = f"{usage.name}/{usage.version}"
+                results[key] = usage
+                cache[key] = {"dirs": dirs, "usage": usage.to_dict()}
+        if len(stale) and self.use_cache:
+            root = self.module_tree.root_dir
+            self._write_cache(
+                {k: e for k, e in cache.items() if os.path.isdir(os.path.join(root, k))}
+            )
+        return [results[f"{name}/{version}"] for name, version in versions]
+
+    @staticmethod
+    def total(usages):
+        """Return the total size of versions, counting shared files once"""
+        total = sum(u.size - sum(u.shared.values()) for u in usages)
+        shared = {}
+        for u in usages:
+            shared.update(u.shared)
+        return total + sum(shared.values())
@@ -1,6 +1,8 @@
 import itertools
 import os
 import re
+import shutil
+import sys
 
 
 def writeable_dir(path):
@@ -10,7 +12,7 @@ def writeable_dir(path):
 
 def int_or_chr_key(s):
     """Return a sortable value as an integer if possible otherwise, convert the
-       character to an integer"""
+    character to an integer"""
     try:
         return int(s)
     except Exception:
@@ -19,9 +21,9 @@ def int_or_chr_key(s):
 
 def parse_version_token(s):
     """Return a list of one or two tokens depending on the version token type.
-       It is accepted to have a number, a character or a number followed by a
-       character, e.g. "5" -> ["5"], "a" -> ["a"] or "5a" -> ["5", "a"] are
-       acceptable."""
+    It is accepted to have a number, a character or a number followed by a
+    character, e.g. "5" -> ["5"], "a" -> ["a"] or "5a" -> ["5", "a"] are
+    acceptable."""
     if len(s) > 1 and s[-1].isalpha():
         return [s[:-1], s[-1]]
     else:
@@ -36,9 +38,9 @@ def tokenize_version(version_string):
 
 def version_key(version_string):
     """Return a sortable key for a version. Versions should have their major
-       and minor components separated with dots (".") or hyphens ("-") and
-       each component may contain a single trailing character, e.g.  1.2.5b > 1.2.5a.
-       """
+    and minor components separated with dots (".") or hyphens ("-") and
+    each component may contain a single trailing character, e.g.  1.2.5b > 1.2.5a.
+    """
 
     tokens = tokenize_version(version_string)
     return [int_or_chr_key(t) for t in tokens]
@@ -73,3 +75,34 @@ def raise_value_error(err):
     """The default error handler for parse errors. Raises a value error with
     the given error string"""
     raise ValueError(err)
+
+
+def intern(s):
+    """Intern a string such that equal strings share memory. Anything which is
+    not a plain string is returned unchanged."""
+    return sys.intern(s) if type(s) is str else s
+
+
+def atomic_write(path, text):
+    """Replace the contents of a file atomically, keeping its permissions."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    if os.path.exists(path):
+        shutil.copymode(path, tmp)
+    os.replace(tmp, path)
+
+
+def safe_path(dest, name):
+    """Join a relative path from an archive or snapshot to its destination,
+    refusing absolute paths and paths which escape the destination."""
+    path = os.path.normpath(os.path.join(dest, name))
+    if os.path.isabs(name) or not path.startswith(os.path.normpath(dest) + os.sep):
+        raise ValueError(f"Refusing to write {name} outside of {dest}")
+    return path
+
+
+def link_target(path):
+    """Return the absolute target of a symlink without resolving any further
+    links. Relative targets are interpreted relative to the link's directory."""
+    return os.path.normpath(os.path.join(os.path.dirname(path), os.readlink(path)))
@@ -0,0 +1,159 @@
+import re
+from bisect import bisect_left, bisect_right
+
+from . import util
+
+_clause = re.compile(r"^\s*(==|!=|>=|<=|~=|>|<)?\s*([^\s<>=!~,]+)\s*$")
+_constraint_chars = set("<>=!~*,")
+
+
+def is_constraint(spec):
+    """Return True if the version string is a constraint rather than a version"""
+    return spec is not None and bool(_constraint_chars & set(spec))
+
+
+def _strip_zeros(key):
+    key = list(key)
+    while len(key) > 1 and key[-1] == 0:
+        key.pop()
+    return key
+
+
+def normalized_key(version):
+    """
+    Return the version key with trailing zero components stripped, such that
+    e.g. 3, 3.0 and 3.0.0 compare equal.
+    """
+    return _strip_zeros(util.version_key(version))
+
+
+def _next_key(key):
+    """Return the smallest key which is greater than all keys with the prefix"""
+    return key[:-1] + [key[-1] + 1]
+
+
+class VersionConstraint:
+    """
+    A constraint on versions, consisting of comma separated clauses which all
+    have to match, e.g. ">=2.1,<3", "2.10.*", "~=1.4" or "!=1.2". A plain
+    version matches only itself. Each constraint is evaluated as a single
+    interval of versions plus a set of excluded versions.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.lower, self.lower_inclusive = None, True
+        self.upper, self.upper_inclusive = None, False
+        self.excluded = []
+        for clause in spec.split(","):
+            m = _clause.match(clause)
+            if m is None:
+                raise ValueError(f"Invalid version constraint {spec}")
+            op, version = m.group(1) or "==", m.group(2)
+            self._add_clause(op, version)
+
+    def _restrict_lower(self, key, inclusive):
+        if self.lower is None or key > self.lower:
+            self.lower, self.lower_inclusive = key, inclusive
+        elif key == self.lower:
+            self.lower_inclusive = self.lower_inclusive and inclusive
+
+    def _restrict_upper(self, key, inclusive):
+        if self.upper is None or key < self.upper:
+            self.upper, self.upper_inclusive = key, inclusive
+        elif key == self.upper:
+            self.upper_inclusive = self.upper_inclusive and inclusive
+
+    def _add_clause(self, op, version):
+        prefix = version.endswith(".*")
+        if prefix:
+            version = version[:-2]
+        if not util.valid_version(version) or (prefix and op not in ("==", "!=")):
+            raise ValueError(f"Invalid version constraint {self.spec}")
+        key = normalized_key(version)
+        if prefix:
+            raw = util.version_key(version)
+            lower, upper = key, _strip_zeros(_next_key(raw))
+            if op == "!=":
+                self.excluded.append((lower, upper))
+            else:
+                self._restrict_lower(lower, True)
+                self._restrict_upper(upper, False)
+        elif op == "==":
+            self._restrict_lower(key, True)
+            self._restrict_upper(key, True)
+        elif op == "!=":
+            self.excluded.append((key, None))
+        elif op == ">=":
+            self._restrict_lower(key, True)
+        elif op == ">":
+            self._restrict_lower(key, False)
+        elif op == "<=":
+            self._restrict_upper(key, True)
+        elif op == "<":
+            self._restrict_upper(key, False)
+        elif op == "~=":
+            raw = util.version_key(version)
+            self._restrict_lower(key, True)
+            if len(raw) > 1:
+                self._restrict_upper(_strip_zeros(_next_key(raw[:-1])), False)
+
+    def _is_excluded(self, key):
+        for lower, upper in self.excluded:
+            if upper is None and key == lower:
+                return True
+            if upper is not None and lower <= key < upper:
+                return True
+        return False
+
+    def matches(self, version):
+        """Return True if a single version satisfies the constraint"""
+        return len(self.select(VersionIndex([version]))) > 0
+
+    def select(self, index):
+        """
+        Return the versions in the index satisfying the constraint by
+        bisecting the sorted keys of the index.
+
+        :param index: a VersionIndex
+        :return: a list of matching versions, sorted from oldest to newest
+        """
+        keys = index.keys
+        lo, hi = 0, len(keys)
+        if self.lower is not None:
+            bisect = bisect_left if self.lower_inclusive else bisect_right
+            lo = bisect(keys, self.lower)
+        if self.upper is not None:
+            bisect = bisect_right if self.upper_inclusive else bisect_left
+            hi = bisect(keys, self.upper)
+        return [
+            index.versions[i]
+            for i in range(lo, hi)
+            if not len(self.excluded) or not self._is_excluded(keys[i])
+        ]
+
+    def __repr__(self):
+        return self.spec
+
+
+class VersionIndex:
+    """A list of versions sorted once by their keys for repeated queries"""
+
+    def __init__(self, versions):
+        pairs = sorted((normalized_key(v), v) for v in versions)
+        self.keys = [k for k, _ in pairs]
+        self.versions = [v for _, v in pairs]
+
+    def select(self, spec):
+        """Return all versions matching a constraint string, oldest first"""
+        return VersionConstraint(spec).select(self)
+
+    def best(self, spec=None):
+        """
+        Return the latest version matching the constraint, or the latest
+        version if no constraint is given.
+
+        :return: a version string, or None if no version matches
+        """
+        versions = self.versions if spec is None else self.select(spec)
+        return versions[-1] if len(versions) else None
@@ -73,3 +73,15 @@ _data_dir = os.path.join(os.path.dirname(__file__), "files")
 @pytest.fixture
 def data_dir():
     return _data_dir
+
+
+@pytest.fixture(autouse=True)
+def trash_workers(monkeypatch):
+    """Record the background workers emptying the trash instead of starting them"""
+    workers = []
+    monkeypatch.setattr(
+        moduledev.Trash,
+        "spawn_worker",
+        lambda self, window: workers.append((self.module_tree.root_dir, window)),
+    )
+    return workers
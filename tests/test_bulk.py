@@ -0,0 +1,74 @@
+import pytest
+
+import moduledev
+from moduledev import bulk, render
+
+
+@pytest.fixture
+def example_modules(example_module_tree, example_module):
+    for name, version, category in [
+        ("alpha", "1.0", None),
+        ("alpha", "2.0", None),
+        ("beta", "1.0", "tools"),
+        ("gamma", "1.0", "tools"),
+    ]:
+        example_module.name, example_module.version = name, version
+        example_module.category = category
+        example_module.shared = name != "gamma"
+        example_module_tree.init_module(example_module)
+    return example_module_tree
+
+
+def test_parse_assignment():
+    assert bulk.parse_assignment("LICENSE_SERVER=a=b") == ("LICENSE_SERVER", "a=b")
+    for assignment in ["NOVALUE", "=value", "BAD NAME=x", 'QUOTE="x"']:
+        with pytest.raises(ValueError):
+            bulk.parse_assignment(assignment)
+
+
+def test_select(example_modules):
+    def selected(**kwargs):
+        update = moduledev.BulkUpdate(example_modules, **kwargs)
+        return [(name, shared) for _, name, _, shared, _ in update.dotfiles()]
+
+    assert selected() == [("alpha", True), ("beta", True), ("gamma", False)]
+    assert selected(categories=["tools"], patterns=["b*"]) == [("beta", True)]
+    assert selected(names=["alpha", "gamma"]) == [("alpha", True), ("gamma", False)]
+
+
+def test_plan_and_apply(example_modules):
+    update = moduledev.BulkUpdate(example_modules, maintainers=["Test*"], jobs=2)
+    changes = update.plan({"MAINTAINER": "New <new@test.com>", "LICENSE": "lic"})
+    assert len(changes) == 3
+    assert '+set MAINTAINER "New <new@test.com>"' in changes[0].diff()
+    update.apply(changes)
+    for name in ["alpha", "beta", "gamma"]:
+        module = example_modules.load_module(name).module
+        assert module.maintainer == "New <new@test.com>"
+        assert module.extra_vars == {"LICENSE": "lic"}
+    assert example_modules.load_module("alpha", "1.0").module.extra_vars == {
+        "LICENSE": "lic"
+    }
+    assert update.plan({"MAINTAINER": "Other"}) == []
+
+
+def test_apply_renders_lua(example_modules):
+    moduledev.TreeRenderer(example_modules, "lua").run()
+    update = moduledev.BulkUpdate(example_modules)
+    update.apply(update.plan({"DESCRIPTION": "changed"}))
+    for name, version in [("alpha", "1.0"), ("alpha", "2.0"), ("gamma", "1.0")]:
+        loader = example_modules.load_module(name, version)
+        with open(render.lua_path(loader)) as f:
+            assert 'whatis("changed")' in f.read()
+
+
+def test_unparsable_dotfile_is_skipped(example_modules):
+    dotfile = example_modules.load_module("beta").moduledotfile_path()
+    with open(dotfile, "a") as f:
+        f.write("set BROKEN\n")
+    update = moduledev.BulkUpdate(example_modules, categories=["tools"])
+    changes = update.plan({"DESCRIPTION": "changed"})
+    assert [c.dotfile for c in changes] == [
+        example_modules.load_module("gamma").moduledotfile_path()
+    ]
+    assert len(update.errors) == 1
@@ -1,4 +1,6 @@
+import json
 import os
+import tarfile
 
 import pytest
 
@@ -302,6 +304,23 @@ def test_path_append(runner, tmpdir, root):
     )
 
 
+def test_path_append_hardlink(runner, tmpdir, root):
+    setup_basic_package(runner, root)
+    os.mkdir(tmpdir / "bin")
+    with open(tmpdir / "bin" / "script", "w") as f:
+        f.write("")
+    args = ["path", "append", "package", "PATH", str(tmpdir / "bin")]
+    result = runner.invoke(mdcli, args + ["--hardlink", "--copy"])
+    assert result.exit_code == 2
+    result = runner.invoke(mdcli, args + ["--hardlink", "-j", "2"])
+    assert result.exit_code == 0
+    script = root / "package" / "1.0" / "bin" / "script"
+    assert os.path.samefile(script, tmpdir / "bin" / "script")
+    result = runner.invoke(mdcli, ["path", "rm", "package", "bin"])
+    assert result.exit_code == 0
+    assert not os.path.exists(root / "package" / "1.0" / "bin")
+
+
 def test_path_prepend(runner, tmpdir, root):
     result = setup_path_package(runner, tmpdir, root, action="prepend")
     assert result.exit_code == 0
@@ -452,6 +471,22 @@ def test_edit(runner, root):
     assert result.exit_code == 0
 
 
+def test_edit_then_rm(runner, tmpdir, root):
+    setup_basic_package(runner, root)
+    runner.invoke(mdcli, ["init", "--detached", "app", "1.0"])
+    runner.invoke(mdcli, ["deps", "--check"])
+    editor = tmpdir / "editor"
+    with open(editor, "w") as f:
+        f.write('#!/bin/sh\necho "prereq package" >> "$1"\n')
+    os.chmod(editor, 0o755)
+    result = runner.invoke(mdcli, ["edit", "--editor", str(editor), "app"])
+    assert result.exit_code == 0
+    result = runner.invoke(mdcli, ["rm", "package"])
+    assert "Use --force" in str(result.exception)
+    assert "app/1.0" in result.output
+    assert os.path.exists(root / "package" / "1.0")
+
+
 def test_show(runner, root):
     setup_basic_package(runner, root)
     result = runner.invoke(mdcli, ["show", "package"])
@@ -476,3 +511,367 @@ def test_path(runner, root, tmpdir):
     result = runner.invoke(mdcli, ["location", "package"])
     assert result.exit_code == 0
     assert result.output.strip() == str(tmpdir / "test" / "package" / "1.0")
+
+
+def test_gc(runner, root):
+    setup_basic_package(runner, root)
+    os.rmdir(root / "package" / "1.0")
+    result = runner.invoke(mdcli, ["gc", "--dry-run"])
+    assert result.exit_code == 0
+    assert "orphan-link" in result.output
+    assert os.path.exists(root / "package")
+    result = runner.invoke(mdcli, ["gc", "--force"])
+    assert result.exit_code == 0
+    assert not os.path.exists(root / "package")
+    result = runner.invoke(mdcli, ["gc"])
+    assert result.exit_code == 0
+    assert "Nothing to collect" in result.output
+
+
+def test_export_import(runner, root, tmpdir):
+    setup_basic_package(runner, root)
+    result = runner.invoke(mdcli, ["export", str(tmpdir / "tree.snapshot")])
+    assert result.exit_code == 0
+    os.mkdir(tmpdir / "new")
+    result = runner.invoke(
+        mdcli, ["--root", tmpdir / "new", "import", str(tmpdir / "tree.snapshot")]
+    )
+    assert result.exit_code == 0
+    result = runner.invoke(mdcli, ["--root", tmpdir / "new", "list"])
+    assert result.output.strip() == "package 1.0"
+    result = runner.invoke(
+        mdcli, ["--root", tmpdir / "new", "import", str(tmpdir / "tree.snapshot")]
+    )
+    assert "already exists" in str(result.exception)
+
+
+def test_sync(runner, root, tmpdir):
+    setup_basic_package(runner, root)
+    result = runner.invoke(mdcli, ["sync", str(tmpdir / "dest")])
+    assert result.exit_code == 0
+    assert "1 linked" in result.output
+    result = runner.invoke(mdcli, ["--root", tmpdir / "dest", "list"])
+    assert result.output.strip() == "package 1.0"
+
+
+def test_pack_unpack(runner, tmpdir, root):
+    setup_basic_package(runner, root)
+    runner.invoke(mdcli, ["init", "app", "1.0"])
+    os.mkdir(tmpdir / "bin")
+    runner.invoke(
+        mdcli, ["path", "append", "--copy", "app", "PATH", str(tmpdir / "bin")]
+    )
+    result = runner.invoke(mdcli, ["pack", "--keep", "app"])
+    assert result.exit_code == 0
+    assert os.path.exists(root / "app" / "1.0" / "bin")
+    assert os.path.exists(root / "app" / "1.0" / ".modulefile")
+    result = runner.invoke(mdcli, ["unpack", "app", "1.0"])
+    assert result.exit_code == 0
+    result = runner.invoke(mdcli, ["pack", "app"])
+    assert result.exit_code == 0
+    assert not os.path.exists(root / "app" / "1.0" / "bin")
+    result = runner.invoke(mdcli, ["unpack", "app", "1.0"])
+    assert result.exit_code == 0
+    assert os.path.exists(root / "app" / "1.0" / "bin")
+    result = runner.invoke(mdcli, ["unpack", "app", "1.0"])
+    assert "not packed" in str(result.exception)
+
+
+def test_env(runner, tmpdir, root):
+    setup_path_package(runner, tmpdir, root)
+    result = runner.invoke(mdcli, ["env", "package/1.0"], env={"PATH": "/usr/bin"})
+    assert result.exit_code == 0
+    assert f"export PATH=/usr/bin:{root}/package/1.0/bin;" in result.output
+    result = runner.invoke(mdcli, ["env", "nonexistent"])
+    assert "Error loading module" in str(result.exception)
+
+
+def test_deps(runner, root):
+    setup_basic_package(runner, root)
+    runner.invoke(mdcli, ["init", "--detached", "app", "1.0"])
+    with open(root / "app" / "1.0" / ".modulefile", "a") as f:
+        f.write("\nprereq package\n")
+    result = runner.invoke(mdcli, ["deps", "app"])
+    assert result.exit_code == 0
+    assert result.output.split() == ["package/1.0", "app/1.0"]
+    result = runner.invoke(mdcli, ["deps", "--reverse", "package"])
+    assert result.output.split() == ["app/1.0"]
+    result = runner.invoke(mdcli, ["deps", "--check"])
+    assert result.exit_code == 0
+    result = runner.invoke(mdcli, ["rm", "package"])
+    assert "Use --force" in str(result.exception)
+    assert "app/1.0" in result.output
+    result = runner.invoke(mdcli, ["rm", "--force", "package"])
+    assert result.exit_code == 0
+    result = runner.invoke(mdcli, ["deps", "--check"])
+    assert "missing dependency prereq package" in result.output
+    assert result.exit_code == 1
+
+
+def test_multiple_roots(runner, root, tmpdir):
+    setup_basic_package(runner, root)
+    os.mkdir(tmpdir / "second")
+    runner.invoke(mdcli, ["--root", tmpdir / "second", "setup", "second"])
+    runner.invoke(mdcli, ["--root", tmpdir / "second", "init", "package", "2.0"])
+    runner.invoke(mdcli, ["--root", tmpdir / "second", "init", "other", "1.0"])
+    roots = ["--root", root, "--root", tmpdir / "second"]
+    result = runner.invoke(mdcli, roots + ["list", "--all"])
+    assert result.exit_code == 0
+    assert result.output.split("\n")[:3] == [
+        "other 1.0",
+        "package 1.0",
+        "package 2.0",
+    ]
+    result = runner.invoke(mdcli, roots + ["location", "package"])
+    assert result.output.strip() == str(tmpdir / "second" / "package" / "2.0")
+    result = runner.invoke(mdcli, roots + ["location", "--version", "1.0", "package"])
+    assert result.output.strip() == str(root / "package" / "1.0")
+    runner.invoke(mdcli, ["config", "set", "roots", f"{tmpdir / 'second'}:{root}"])
+    result = runner.invoke(mdcli, ["show", "other"])
+    assert result.exit_code == 0
+
+
+def test_version_constraint(runner, root, tmpdir):
+    setup_basic_package(runner, root)
+    runner.invoke(mdcli, ["init", "package", "1.5"])
+    runner.invoke(mdcli, ["init", "package", "2.0"])
+    result = runner.invoke(mdcli, ["location", "--version", "1.*", "package"])
+    assert result.output.strip() == str(root / "package" / "1.5")
+    result = runner.invoke(mdcli, ["location", "--version", ">=3", "package"])
+    assert "Module package->=3 does not exist" in str(result.exception)
+    result = runner.invoke(mdcli, ["location", "--version", ">>3", "package"])
+    assert "Invalid version constraint" in str(result.exception)
+
+
+def test_lint(runner, root):
+    setup_basic_package(runner, root)
+    result = runner.invoke(mdcli, ["lint"])
+    assert result.exit_code == 0
+    assert "0 errors and 0 warnings" in result.output
+    with open(root / "package" / ".modulefile", "a") as f:
+        f.write("append-path PATH /opt/bin\n")
+    result = runner.invoke(mdcli, ["lint"])
+    assert result.exit_code == 0
+    assert "no-basedir" in result.output
+    result = runner.invoke(mdcli, ["lint", "--strict"])
+    assert result.exit_code == 1
+    with open(root / "package" / ".modulefile", "a") as f:
+        f.write("set MAINTAINER\n")
+    result = runner.invoke(mdcli, ["lint", "--format", "json", "-j", "2"])
+    assert result.exit_code == 1
+    assert [d["code"] for d in json.JSONDecoder().raw_decode(result.output)[0]] == [
+        "no-basedir",
+        "short-set",
+    ]
+
+
+def test_bulk_set(runner, root):
+    setup_basic_package(runner, root)
+    result = runner.invoke(
+        mdcli, ["bulk", "set", "--dry-run", "--name", "package", "LICENSE=gpl"]
+    )
+    assert result.exit_code == 0
+    assert '+set LICENSE "gpl"' in result.output
+    result = runner.invoke(mdcli, ["bulk", "set", "--force", "LICENSE=gpl"])
+    assert result.exit_code == 0
+    assert "Updated 1 .modulefiles" in result.output
+    result = runner.invoke(mdcli, ["bulk", "set", "--force", "LICENSE=gpl"])
+    assert "Nothing to change" in result.output
+    result = runner.invoke(mdcli, ["bulk", "set", "LICENSE"])
+    assert result.exit_code == 2
+
+
+def test_relocate(runner, root, tmpdir):
+    setup_basic_package(runner, root)
+    runner.invoke(mdcli, ["config", "set", "root", str(root)])
+    result = runner.invoke(mdcli, ["relocate", str(tmpdir / "moved")])
+    assert result.exit_code == 0
+    assert "Updated the configured root" in result.output
+    result = runner.invoke(mdcli, ["location", "package"])
+    assert result.output.strip() == str(tmpdir / "moved" / "package" / "1.0")
+    result = runner.invoke(mdcli, ["relocate", str(tmpdir / "moved")])
+    assert "Could not relocate tree" in str(result.exception)
+
+
+def test_query(runner, root):
+    setup_basic_package(runner, root)
+    queries = [
+        {"id": 1, "op": "location", "module": "package"},
+        {"id": 2, "op": "exists", "module": "package", "version": "2.0"},
+    ]
+    result = runner.invoke(
+        mdcli, ["query"], input="".join(json.dumps(q) + "\n" for q in queries)
+    )
+    assert result.exit_code == 0
+    assert [json.loads(line) for line in result.output.splitlines()] == [
+        {"id": 1, "ok": True, "result": str(root / "package" / "1.0")},
+        {"id": 2, "ok": True, "result": False},
+    ]
+
+
+def test_clone(runner, root, tmpdir):
+    setup_path_package(runner, tmpdir, root)
+    os.mkdir(tmpdir / "newbin")
+    replace = ["--replace", tmpdir / "bin", tmpdir / "newbin"]
+    result = runner.invoke(mdcli, ["clone", "package", "1.0", "1.1"] + replace)
+    assert result.exit_code == 0
+    assert os.readlink(root / "package" / "1.1" / "bin") == str(tmpdir / "newbin")
+    result = runner.invoke(mdcli, ["clone", "package", "1.0", "1.1"])
+    assert "Could not clone" in str(result.exception)
+
+
+def test_verify(runner, root, tmpdir):
+    setup_basic_package(runner, root)
+    os.mkdir(tmpdir / "bin")
+    with open(tmpdir / "bin" / "script", "w") as f:
+        f.write("echo")
+    args = ["path", "append", "--copy", "package", "PATH", str(tmpdir / "bin")]
+    assert runner.invoke(mdcli, args).exit_code == 0
+    result = runner.invoke(mdcli, ["verify"])
+    assert result.exit_code == 0
+    assert "1 files hashed" in result.output
+    with open(root / "package" / "1.0" / "bin" / "script", "w") as f:
+        f.write("ECHO")
+    result = runner.invoke(mdcli, ["verify", "package"])
+    assert result.exit_code == 1
+    assert "hash" in result.output
+
+
+def test_du(runner, root, tmpdir):
+    setup_path_package(runner, tmpdir, root)
+    runner.invoke(mdcli, ["init", "other", "1.0"])
+    with open(root / "other" / "1.0" / "data", "w") as f:
+        f.write("x" * 10000)
+    result = runner.invoke(mdcli, ["du", "--sort", "size", "--bytes", "--external"])
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert lines[0].endswith("other/1.0")
+    assert lines[1].endswith("package/1.0\t(1 external)")
+    assert lines[2] == f"\tbin -> {tmpdir / 'bin'}"
+    assert lines[3].endswith("total")
+    result = runner.invoke(mdcli, ["du", "package"])
+    assert len(result.output.splitlines()) == 2
+
+
+def test_prune(runner, root):
+    setup_basic_package(runner, root)
+    runner.invoke(mdcli, ["init", "package", "1.1"])
+    runner.invoke(mdcli, ["init", "package", "2.0"])
+    result = runner.invoke(mdcli, ["prune"])
+    assert result.exit_code != 0
+    result = runner.invoke(mdcli, ["prune", "--keep", "1", "--keep-newer-than", "1y"])
+    assert result.exit_code != 0
+    result = runner.invoke(
+        mdcli, ["prune", "--keep", "1", "--pin", "package/1.0", "--dry-run"]
+    )
+    assert result.exit_code == 0
+    assert result.output.splitlines() == ["expired\tpackage/1.1"]
+    assert os.path.exists(root / "package" / "1.1")
+    result = runner.invoke(mdcli, ["prune", "--keep", "0", "--force"])
+    assert result.exit_code == 0
+    assert not os.path.exists(root / "package")
+    result = runner.invoke(mdcli, ["prune", "--keep", "0"])
+    assert "Nothing to prune" in result.output
+
+
+def test_rm_undo(runner, root, trash_workers):
+    setup_basic_package(runner, root)
+    runner.invoke(mdcli, ["init", "package", "1.1"])
+    result = runner.invoke(mdcli, ["rm", "--force", "package", "1.1"])
+    assert result.exit_code == 0
+    assert trash_workers == [(str(root), 600)]
+    assert not os.path.exists(root / "package" / "1.1")
+    result = runner.invoke(mdcli, ["rm", "--undo", "package"])
+    assert result.exit_code == 0
+    assert "Restored package/1.1" in result.output
+    assert os.path.exists(root / "package" / "1.1")
+    result = runner.invoke(mdcli, ["rm", "--undo", "package"])
+    assert "No removed version" in str(result.exception)
+
+    runner.invoke(mdcli, ["config", "set", "trash_window", "1h"])
+    runner.invoke(mdcli, ["rm", "--force", "package", "1.0"])
+    assert trash_workers[-1] == (str(root), 3600)
+    result = runner.invoke(mdcli, ["gc", "--trash", "--dry-run"])
+    assert "(package/1.0)" in result.output
+    result = runner.invoke(mdcli, ["gc", "--trash", "--force"])
+    assert result.exit_code == 0
+    assert os.listdir(root / "module" / ".trash") == []
+
+
+def test_recover(runner, tmpdir, root, monkeypatch):
+    from moduledev import module
+
+    setup_path_package(runner, tmpdir, root)
+    result = runner.invoke(mdcli, ["recover"])
+    assert "Nothing to recover." in result.output
+    with monkeypatch.context() as m:
+        m.setattr(module.ModuleLocation, "add_path", lambda *args: 1 / 0)
+        result = runner.invoke(
+            mdcli,
+            ["path", "append", "--overwrite", "package", "PATH", str(tmpdir / "bin")],
+        )
+    assert result.exit_code != 0
+    assert not os.path.exists(root / "package" / "1.0" / "bin")
+    result = runner.invoke(mdcli, ["recover", "--dry-run"])
+    assert "rolled forward\treplace-path\tpackage/1.0" in result.output
+    result = runner.invoke(mdcli, ["recover"])
+    assert result.exit_code == 0
+    assert os.path.islink(root / "package" / "1.0" / "bin")
+    result = runner.invoke(mdcli, ["recover"])
+    assert "Nothing to recover." in result.output
+
+
+def test_install(runner, tmpdir, root):
+    setup_basic_package(runner, root)
+    source = tmpdir / "hello-2.10"
+    os.makedirs(source / "bin")
+    with open(source / "bin" / "hello", "w") as f:
+        f.write("echo hello\n")
+    tarball = str(tmpdir / "hello-2.10.tar")
+    with tarfile.open(tarball, "w") as tar:
+        tar.add(str(source), "hello-2.10")
+    recipe = str(tmpdir / "recipe.yaml")
+    with open(recipe, "w") as f:
+        f.write('configure: "true"\nbuild: "true"\n')
+        f.write('install: mkdir "$PREFIX" && cp -r bin "$PREFIX"\n')
+
+    args = ["install", "--recipe", recipe, "hello", "2.10", tarball]
+    result = runner.invoke(mdcli, args)
+    assert result.exit_code == 0
+    assert "Installed hello/2.10 (built: bin)" in result.output
+    assert os.path.islink(root / "hello" / "2.10" / "bin")
+    result = runner.invoke(mdcli, args)
+    assert "Use --force" in str(result.exception)
+    result = runner.invoke(mdcli, ["install", "--force"] + args[1:])
+    assert "Installed hello/2.10 (cached build: bin)" in result.output
+    result = runner.invoke(mdcli, ["install", "hello", "2.11", recipe])
+    assert result.exit_code != 0
+    assert "Cannot install hello/2.11" in str(result.exception)
+
+
+def test_completion(runner):
+    result = runner.invoke(mdcli, ["completion", "fish"])
+    assert result.exit_code == 0
+    assert "complete -c moduledev" in result.output
+    result = runner.invoke(mdcli, ["completion", "tcsh"])
+    assert result.exit_code != 0
+
+
+def test_render(runner, root):
+    setup_basic_package(runner, root)
+    lua = root / "modulefile" / "test" / "package" / "1.0.lua"
+    result = runner.invoke(mdcli, ["render", "--backend", "lua"])
+    assert result.exit_code == 0
+    assert "Rendered 1 Lua modulefiles" in result.output
+    runner.invoke(mdcli, ["init", "package", "1.1"])
+    assert os.path.exists(lua)
+    assert os.path.exists(root / "modulefile" / "test" / "package" / "1.1.lua")
+    result = runner.invoke(mdcli, ["render", "--backend", "tcl"])
+    assert "Removed 2 Lua modulefiles" in result.output
+    assert not os.path.exists(lua)
+    os.mkdir(root / "lua")
+    result = runner.invoke(
+        mdcli, ["--root", str(root / "lua"), "setup", "--backend", "lua", "t"]
+    )
+    assert result.exit_code == 0
+    assert open(root / "lua" / "module" / ".backend").read() == "lua\n"
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+import moduledev
+from moduledev import clone
+
+
+@pytest.fixture
+def staged_builder(example_builder, tmpdir):
+    """A module with a symlinked path into a stage directory and a copied path"""
+    for version in ["1.0", "1.1"]:
+        os.makedirs(tmpdir / "stage" / version / "bin")
+    example_builder.add_path(tmpdir / "stage" / "1.0" / "bin", moduledev.Path("bin"))
+    os.makedirs(tmpdir / "share" / "doc")
+    with open(tmpdir / "share" / "doc" / "README", "w") as f:
+        f.write("readme")
+    example_builder.add_path(tmpdir / "share", moduledev.Path("share"), link=False)
+    example_builder.save_module_file()
+    return example_builder
+
+
+def test_substitute_prefix():
+    replacements = [("/stage/1.0", "/stage/1.1")]
+    assert clone.substitute_prefix("/stage/1.0/bin", replacements) == "/stage/1.1/bin"
+    assert clone.substitute_prefix("/stage/1.0", replacements) == "/stage/1.1"
+    assert clone.substitute_prefix("/stage/1.00/bin", replacements) == "/stage/1.00/bin"
+
+
+def test_clone_shared(staged_builder, tmpdir):
+    tree = staged_builder.module_tree
+    loader = tree.load_module("test", "1.0")
+    dotfile = loader.moduledotfile_path()
+    with open(dotfile) as f:
+        text = f.read()
+    replacements = [(str(tmpdir / "stage" / "1.0"), str(tmpdir / "stage" / "1.1"))]
+    builder, dangling = clone.clone_version(loader, "1.1", replacements)
+    assert dangling == []
+    assert tree.module_exists("test", "1.1")
+    with open(dotfile) as f:
+        assert f.read() == text
+    new_path = builder.module_path()
+    assert os.readlink(os.path.join(new_path, "bin")) == str(
+        tmpdir / "stage" / "1.1" / "bin"
+    )
+    readme = os.path.join("share", "doc", "README")
+    with open(os.path.join(new_path, readme)) as f:
+        assert f.read() == "readme"
+    assert not os.path.islink(os.path.join(new_path, "share"))
+    with pytest.raises(FileExistsError):
+        clone.clone_version(loader, "1.1")
+
+
+def test_clone_detached(example_module, example_module_tree, tmpdir):
+    example_module.shared = False
+    builder = example_module_tree.init_module(example_module)
+    with open(builder.moduledotfile_path(), "a") as f:
+        f.write("prereq other\n")
+    loader = example_module_tree.load_module("test", "1.0")
+    os.symlink(tmpdir / "missing", os.path.join(loader.module_path(), "lib"))
+    new_builder, dangling = clone.clone_version(loader, "2.0", copy=True)
+    assert dangling == [os.path.join(new_builder.module_path(), "lib")]
+    new_loader = example_module_tree.load_module("test", "2.0")
+    assert not new_loader.shared()
+    assert new_loader.module.extra_commands == ["prereq other"]
+    graph = moduledev.DependencyGraph(example_module_tree).load()
+    assert graph.missing()[-1][0] == "test/2.0"
@@ -0,0 +1,82 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import moduledev
+from moduledev import completion
+from moduledev.cli import mdcli
+
+
+def test_completion_cache(example_builder, example_module, bindir):
+    tree = example_builder.module_tree
+    cache = completion.CompletionCache(tree)
+    assert cache.read() == {("test", "1.0"): ("test", [])}
+    example_builder.add_path(bindir, moduledev.Path("bin"))
+    example_builder.save_module_file()
+    example_module.version = "2.0"
+    example_module.shared = False
+    second = tree.init_module(example_module)
+    assert cache.read() == {
+        ("test", "1.0"): ("test", ["PATH"]),
+        ("test", "2.0"): ("test", ["PATH"]),
+    }
+    tree.load_module("test", "1.0").clear()
+    assert list(cache.read()) == [("test", "2.0")]
+    moduledev.Trash(tree).put(second)
+    assert cache.read() == {}
+    moduledev.Trash(tree).find("test").restore(tree)
+    assert list(cache.read()) == [("test", "2.0")]
+    shutil.rmtree(second.module_path())
+    moduledev.GarbageCollector(tree).collect([])
+    assert cache.read() == {}
+    os.unlink(cache.cache_path())
+    example_module.version = "3.0"
+    tree.init_module(example_module)
+    assert list(cache.read()) == [("test", "3.0")]
+
+
+def test_rebuild_skips_stray_files(example_builder):
+    tree = example_builder.module_tree
+    with open(os.path.join(tree.root_dir, "README"), "w") as f:
+        f.write("not a module\n")
+    cache = completion.CompletionCache(tree)
+    cache.rebuild()
+    assert cache.read() == {("test", "1.0"): ("test", [])}
+
+
+def test_script():
+    with pytest.raises(ValueError):
+        completion.script("csh", mdcli, "config.yaml")
+    for shell in completion.SHELLS:
+        script = completion.script(shell, mdcli, "/home/config.yaml")
+        assert "/home/config.yaml" in script
+        assert "\\tsub\\tshow" not in script and "\tsub\tshow" in script
+    assert "bashcompinit" in completion.script("zsh", mdcli, "config.yaml")
+
+
+@pytest.mark.skipif(shutil.which("bash") is None, reason="requires bash")
+def test_bash_completion(example_builder, example_module, tmpdir):
+    tree = example_builder.module_tree
+    example_module.version = "2.0"
+    tree.init_module(example_module)
+    with open(tmpdir / "config.yaml", "w") as f:
+        f.write(f"root: {tree.root_dir}\n")
+    with open(tmpdir / "complete.bash", "w") as f:
+        f.write(completion.script("bash", mdcli, str(tmpdir / "config.yaml")))
+
+    def complete(*words):
+        command = (
+            f"source {tmpdir / 'complete.bash'}; COMP_WORDS=(moduledev {' '.join(words)});"
+            f" COMP_CWORD={len(words)}; _moduledev; echo ${{COMPREPLY[*]}}"
+        )
+        return subprocess.check_output(["bash", "-c", command], text=True).split()
+
+    assert complete("sh") == ["show"]
+    assert complete("show", "''") == ["test"]
+    assert complete("show", "test", "--version", "''") == ["1.0", "2.0"]
+    assert complete("rm", "test", "2") == ["2.0"]
+    assert complete("path", "a") == ["append"]
+    assert complete("init", "--category", "''") == ["test"]
+    assert complete("--root", "/nonexistent", "show", "''") == []
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+from moduledev import depgraph
+from moduledev.depgraph import Dependency
+
+
+def add_module(module, tree, name, version, commands=()):
+    module.name, module.version = name, version
+    module.extra_commands = list(commands)
+    module.shared = False
+    return tree.init_module(module)
+
+
+def test_parse_dependencies():
+    deps = depgraph.parse_dependencies(
+        ["prereq gcc/9.2 cmake", "module load --auto zlib", "puts stderr hello"]
+    )
+    assert deps == [
+        Dependency("gcc", "9.2"),
+        Dependency("cmake"),
+        Dependency("zlib", None, "load"),
+    ]
+
+
+def test_module_dependencies(example_module):
+    example_module.extra_commands = ["prereq gcc"]
+    assert example_module.dependencies == [Dependency("gcc")]
+
+
+def test_load_order(example_module, example_module_tree):
+    add_module(example_module, example_module_tree, "gcc", "9.2")
+    add_module(example_module, example_module_tree, "gcc", "10.1")
+    add_module(example_module, example_module_tree, "mpi", "1.0", ["prereq gcc"])
+    add_module(
+        example_module,
+        example_module_tree,
+        "app",
+        "1.0",
+        ["module load mpi gcc/9.2", "prereq missing"],
+    )
+    graph = depgraph.DependencyGraph(example_module_tree).load()
+    assert graph.load_order("app") == ["gcc/10.1", "mpi/1.0", "gcc/9.2", "app/1.0"]
+    assert graph.missing() == [("app/1.0", Dependency("missing"))]
+    assert graph.cycles() == []
+
+
+def test_cycle(example_module, example_module_tree):
+    add_module(example_module, example_module_tree, "a", "1.0", ["prereq b"])
+    add_module(example_module, example_module_tree, "b", "1.0", ["prereq a"])
+    graph = depgraph.DependencyGraph(example_module_tree).load()
+    with pytest.raises(depgraph.DependencyCycleError):
+        graph.load_order("a")
+    assert len(graph.cycles()) == 1
+
+
+def test_dependents(example_module, example_module_tree):
+    add_module(example_module, example_module_tree, "gcc", "9.2")
+    add_module(example_module, example_module_tree, "gcc", "10.1")
+    add_module(example_module, example_module_tree, "mpi", "1.0", ["prereq gcc"])
+    add_module(example_module, example_module_tree, "old", "1.0", ["prereq gcc/9.2"])
+    add_module(example_module, example_module_tree, "app", "1.0", ["prereq old"])
+    graph = depgraph.DependencyGraph(example_module_tree).load()
+    assert graph.dependents("gcc", "9.2") == ["app/1.0", "old/1.0"]
+    assert graph.dependents("gcc", "9.2", transitive=False) == ["old/1.0"]
+    assert graph.dependents("gcc", "10.1") == []
+    example_module_tree.load_module("gcc", "9.2").clear()
+    graph = depgraph.DependencyGraph(example_module_tree).load()
+    assert graph.dependents("gcc", "10.1") == ["mpi/1.0"]
+
+
+def test_cache(example_module, example_module_tree):
+    builder = add_module(example_module, example_module_tree, "a", "1.0")
+    graph = depgraph.DependencyGraph(example_module_tree).load()
+    assert os.path.exists(graph.cache_path())
+    assert graph.edges == {"a/1.0": []}
+    builder.module.extra_commands.append("prereq b")
+    builder.save_module_file()
+    entry = graph.read_entry("a")
+    assert entry[builder.moduledotfile_path()]["deps"] == [["b", None, "prereq"]]
+    assert graph.read_reverse("b") == ["a"]
+    graph = depgraph.DependencyGraph(example_module_tree).load()
+    assert graph.edges == {"a/1.0": [Dependency("b")]}
+    builder.module.extra_commands = []
+    builder.save_module_file()
+    assert graph.read_reverse("b") == []
+
+
+def test_load_dependents(example_module, example_module_tree):
+    tree = example_module_tree
+    add_module(example_module, tree, "gcc", "9.2")
+    add_module(example_module, tree, "gcc", "10.1")
+    add_module(example_module, tree, "mpi", "1.0", ["prereq gcc"])
+    add_module(example_module, tree, "old", "1.0", ["prereq gcc/9.2"])
+    add_module(example_module, tree, "app", "1.0", ["prereq old"])
+    add_module(example_module, tree, "other", "1.0", ["prereq mpi"])
+    depgraph.DependencyGraph(tree).load()
+    add_module(example_module, tree, "new", "1.0", ["prereq app"])
+    graph = depgraph.DependencyGraph(tree).load_dependents("gcc")
+    assert sorted(graph.versions) == ["app", "gcc", "mpi", "new", "old", "other"]
+    assert graph.dependents("gcc", "9.2") == ["app/1.0", "new/1.0", "old/1.0"]
+    graph = depgraph.DependencyGraph(tree).load_dependents("app")
+    assert sorted(graph.versions) == ["app", "new"]
+
+
+def test_load_dependents_edited_by_hand(example_module, example_module_tree):
+    tree = example_module_tree
+    add_module(example_module, tree, "a", "1.0")
+    builder = add_module(example_module, tree, "b", "1.0")
+    depgraph.DependencyGraph(tree).load()
+    with open(builder.moduledotfile_path(), "a") as f:
+        f.write("\nprereq a\n")
+    os.utime(builder.moduledotfile_path(), ns=(0, 0))
+    graph = depgraph.DependencyGraph(tree).load_dependents("a")
+    assert graph.dependents("a", "1.0") == ["b/1.0"]
+    assert graph.read_reverse("a") == ["b"]
@@ -0,0 +1,110 @@
+import json
+import os
+
+import pytest
+
+import moduledev
+from moduledev import environment
+
+
+@pytest.fixture
+def env_builder(example_builder, bindir):
+    example_builder.add_path(bindir, moduledev.Path("bin", "prepend-path", "PATH"))
+    example_builder.module.paths.append(
+        moduledev.Path("$basedir/man", "append-path", "MANPATH")
+    )
+    example_builder.module.extra_vars["LICENSE"] = "1234@license"
+    example_builder.module.extra_commands.append("setenv LM_LICENSE_FILE $LICENSE")
+    example_builder.save_module_file()
+    return example_builder
+
+
+def test_apply_operations():
+    operations = [
+        ["prepend-path", "PATH", "/a"],
+        ["append-path", "PATH", "/b"],
+        ["prepend-path", "PATH", "/c"],
+        ["setenv", "X", "1"],
+        ["unsetenv", "Y", None],
+    ]
+    changed = environment.apply_operations(operations, {"PATH": "/b:/usr/bin:/a"})
+    assert changed == {"PATH": "/c:/a:/usr/bin:/b", "X": "1", "Y": None}
+
+
+def test_format_environment():
+    changed = {"PATH": "/a b:/c", "Y": None}
+    assert environment.format_environment(changed, "bash") == (
+        "export PATH='/a b:/c';\nunset Y;"
+    )
+    assert environment.format_environment(changed, "fish") == (
+        "set -gx PATH (string split : -- '/a b:/c');\nset -e Y;"
+    )
+    assert json.loads(environment.format_environment(changed, "json")) == changed
+
+
+def test_resolve(env_builder):
+    resolver = environment.EnvironmentResolver(env_builder.module_tree)
+    changed = resolver.resolve(["test"], {"PATH": "/usr/bin"})
+    basedir = env_builder.module_path()
+    assert changed == {
+        "PATH": f"{basedir}/bin:/usr/bin",
+        "MANPATH": f"{basedir}/man",
+        "LM_LICENSE_FILE": "1234@license",
+    }
+    assert os.path.exists(resolver.cache_path())
+
+
+def test_resolve_cache(env_builder):
+    resolver = environment.EnvironmentResolver(env_builder.module_tree)
+    resolver.resolve(["test/1.0"], {})
+    with open(resolver.cache_path()) as f:
+        cache = json.load(f)
+    cache["test/1.0"]["operations"] = [["setenv", "CACHED", "1"]]
+    with open(resolver.cache_path(), "w") as f:
+        json.dump(cache, f)
+    resolver = environment.EnvironmentResolver(env_builder.module_tree)
+    assert resolver.resolve(["test/1.0"], {}) == {"CACHED": "1"}
+
+    # rewriting the module file invalidates the cached operations
+    os.utime(env_builder.moduledotfile_path(), ns=(0, 0))
+    resolver = environment.EnvironmentResolver(env_builder.module_tree)
+    assert "CACHED" not in resolver.resolve(["test/1.0"], {})
+
+
+def test_resolve_detached(env_builder):
+    resolver = environment.EnvironmentResolver(env_builder.module_tree)
+    resolver.resolve(["test/1.0"], {})
+    with open(os.path.join(env_builder.module_path(), ".modulefile"), "w") as f:
+        f.write("setenv DETACHED 1\n")
+    resolver = environment.EnvironmentResolver(env_builder.module_tree)
+    assert resolver.resolve(["test/1.0"], {}) == {"DETACHED": "1"}
+
+
+def test_raw_operations_order(example_builder):
+    with open(example_builder.moduledotfile_path(), "w") as f:
+        f.write(
+            "setenv X a\n"
+            "prepend-path PATH $basedir/bin\n"
+            "unsetenv X\n"
+            "prereq other\n"
+            "append-path PATH $basedir/sbin\n"
+        )
+    module = example_builder.module_tree.load_module("test", "1.0").module
+    assert environment.raw_operations(module) == [
+        ["setenv", "X", "a"],
+        ["prepend-path", "PATH", "$basedir/bin"],
+        ["unsetenv", "X", None],
+        ["append-path", "PATH", "$basedir/sbin"],
+    ]
+    module.paths.append(moduledev.Path("$basedir/lib", "append-path", "LIBS"))
+    assert environment.raw_operations(module)[-1] == [
+        "append-path",
+        "LIBS",
+        "$basedir/lib",
+    ]
+
+
+def test_resolve_missing(example_module_tree):
+    resolver = environment.EnvironmentResolver(example_module_tree)
+    with pytest.raises(ValueError):
+        resolver.resolve(["nonexistent"], {})
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+import moduledev
+
+
+@pytest.fixture
+def second_module_tree(tmpdir):
+    os.mkdir(tmpdir / "second")
+    module_tree = moduledev.ModuleTree(tmpdir / "second")
+    module_tree.setup("second")
+    return module_tree
+
+
+def add_module(module, tree, name, version):
+    module.name, module.version = name, version
+    tree.init_module(module)
+
+
+@pytest.fixture
+def federated_tree(example_module, example_module_tree, second_module_tree):
+    add_module(example_module, example_module_tree, "hello", "1.0")
+    add_module(example_module, example_module_tree, "site", "1.0")
+    add_module(example_module, second_module_tree, "hello", "1.0")
+    add_module(example_module, second_module_tree, "hello", "2.0")
+    add_module(example_module, second_module_tree, "personal", "0.1")
+    return moduledev.FederatedTree([example_module_tree, second_module_tree])
+
+
+def test_merged_versions(federated_tree, example_module_tree, second_module_tree):
+    assert federated_tree.module_names() == ["hello", "personal", "site"]
+    assert federated_tree.available_versions("hello") == [
+        ("1.0", example_module_tree),
+        ("2.0", second_module_tree),
+    ]
+
+
+def test_locate(federated_tree, example_module_tree, second_module_tree):
+    assert federated_tree.locate("hello") == (second_module_tree, "2.0")
+    assert federated_tree.locate("hello", "1.0") == (example_module_tree, "1.0")
+    assert federated_tree.locate("hello", "3.0") == (None, None)
+    assert federated_tree.locate("nonexistent") == (None, None)
+    assert federated_tree.locate("hello", "<2") == (example_module_tree, "1.0")
+    index = federated_tree.version_index("hello")
+    assert federated_tree.version_index("hello") is index
+    federated_tree.refresh()
+    assert federated_tree.version_index("hello") is not index
+
+
+def test_load_module(federated_tree, second_module_tree):
+    loader = federated_tree.load_module("personal")
+    assert loader.module_tree is second_module_tree
+    assert federated_tree.module_exists("site", "1.0")
+    assert not federated_tree.module_exists("site", "2.0")
+    with pytest.raises(ValueError):
+        federated_tree.load_module("nonexistent")
+
+
+def test_modules(federated_tree):
+    assert [f"{m.name}-{m.version}" for m in federated_tree.modules()] == [
+        "hello-2.0",
+        "personal-0.1",
+        "site-1.0",
+    ]
+    assert len(list(federated_tree.modules(all_versions=True))) == 4
+
+
+def test_index_cache(federated_tree, example_module, example_module_tree):
+    federated_tree.module_names()
+    add_module(example_module, example_module_tree, "new", "1.0")
+    assert "new" not in federated_tree.module_names()
+    federated_tree.refresh(example_module_tree)
+    assert "new" in federated_tree.module_names()
@@ -0,0 +1,75 @@
+import os
+import shutil
+
+import moduledev
+
+
+def kinds(garbage):
+    return sorted(g.kind for g in garbage)
+
+
+def test_clean_tree(example_builder):
+    collector = moduledev.GarbageCollector(example_builder.module_tree)
+    assert collector.scan() == []
+
+
+def test_orphan_link(example_builder):
+    os.rmdir(example_builder.module_path())
+    collector = moduledev.GarbageCollector(example_builder.module_tree)
+    garbage = collector.scan()
+    assert kinds(garbage) == ["empty-base", "orphan-link"]
+    collector.collect(garbage)
+    assert not os.path.lexists(example_builder.modulefile_path())
+    assert not os.path.exists(example_builder.module_base())
+    assert not os.path.exists(example_builder.modulefile_base())
+    assert collector.scan() == []
+
+
+def test_links_without_module(example_builder):
+    shutil.rmtree(example_builder.module_base())
+    collector = moduledev.GarbageCollector(example_builder.module_tree)
+    garbage = collector.scan()
+    assert kinds(garbage) == ["orphan-link"]
+    assert garbage[0].path == example_builder.modulefile_path()
+    collector.collect(garbage)
+    assert not os.path.exists(example_builder.modulefile_base())
+    assert collector.scan() == []
+
+
+def test_missing_dotfile(example_module, example_module_tree):
+    example_module.shared = False
+    builder = example_module_tree.init_module(example_module)
+    module_path = builder.module_path()
+    os.unlink(builder.moduledotfile_path())
+    example_module.version = "1.1"
+    example_module_tree.init_module(example_module)
+    collector = moduledev.GarbageCollector(example_module_tree)
+    garbage = collector.scan()
+    assert kinds(garbage) == ["missing-dotfile"]
+    assert garbage[0].path == module_path
+    collector.collect(garbage)
+    assert not os.path.lexists(os.path.join(builder.modulefile_base(), "1.0"))
+    assert collector.scan() == []
+    assert example_module_tree.module_exists(example_module.name, "1.1")
+
+
+def test_unlinked_version(example_builder):
+    os.unlink(example_builder.modulefile_path())
+    collector = moduledev.GarbageCollector(example_builder.module_tree)
+    garbage = collector.scan()
+    assert kinds(garbage) == ["unlinked-version"]
+    collector.collect(garbage)
+    assert os.path.exists(example_builder.module_path())
+    assert example_builder.valid()
+    assert collector.scan() == []
+
+
+def test_invalid_module(example_builder):
+    tree = example_builder.module_tree
+    with open(os.path.join(tree.root_dir, "README"), "w") as f:
+        f.write("not a module")
+    collector = moduledev.GarbageCollector(tree, jobs=2)
+    garbage = collector.scan()
+    assert kinds(garbage) == ["invalid-module"]
+    collector.collect(garbage)
+    assert [m.name for m in tree.modules()] == ["test"]
@@ -0,0 +1,160 @@
+import os
+import tarfile
+
+import pytest
+
+import moduledev
+from moduledev import install
+
+_makefile = """\
+all:
+\techo 'echo hello' > hello
+
+install:
+\tmkdir -p $(PREFIX)/bin $(PREFIX)/share/man/man1 $(PREFIX)/lib/pkgconfig
+\tcp hello $(PREFIX)/bin/hello
+\tchmod +x $(PREFIX)/bin/hello
+"""
+
+
+@pytest.fixture
+def tarball(tmpdir):
+    source = tmpdir / "hello-1.0"
+    os.mkdir(source)
+    with open(source / "configure", "w") as f:
+        f.write('#!/bin/sh\necho "$1" > configured\n')
+    os.chmod(source / "configure", 0o755)
+    with open(source / "Makefile", "w") as f:
+        f.write(_makefile)
+    path = str(tmpdir / "hello-1.0.tar.gz")
+    with tarfile.open(path, "w:gz") as tar:
+        tar.add(str(source), "hello-1.0")
+    return path
+
+
+def new_module(tree, version):
+    return moduledev.Module(tree, "hello", version, "Test Maintainer", "", "")
+
+
+def test_install_and_cache(example_module_tree, tarball):
+    tree = example_module_tree
+    installer = moduledev.Installer(tree, jobs=2)
+    builder, cached = installer.install(new_module(tree, "1.0"), tarball)
+    assert not cached
+    assert builder.valid()
+    loader = tree.load_module("hello", "1.0")
+    assert sorted((p.name, p.path) for p in loader.module.paths) == [
+        ("LD_LIBRARY_PATH", "$basedir/lib"),
+        ("MANPATH", "$basedir/man"),
+        ("PATH", "$basedir/bin"),
+        ("PKG_CONFIG_PATH", "$basedir/pkgconfig"),
+    ]
+    prefix = installer.prefix(installer.key(tarball))
+    assert os.readlink(os.path.join(loader.module_path(), "bin")) == os.path.join(
+        prefix, "bin"
+    )
+    with open(os.path.join(prefix, "bin", "hello")) as f:
+        assert f.read() == "echo hello\n"
+
+    builder, cached = installer.install(new_module(tree, "1.1"), tarball)
+    assert cached
+    loader = tree.load_module("hello", "1.1")
+    assert len(loader.module.paths) == 4
+    assert os.readlink(os.path.join(loader.module_path(), "man")) == os.path.join(
+        prefix, "share", "man"
+    )
+    with pytest.raises(FileExistsError):
+        installer.install(new_module(tree, "1.1"), tarball)
+    assert installer.install(new_module(tree, "1.1"), tarball, overwrite=True)[1]
+
+
+def test_unused_builds(example_module_tree, tarball, tmpdir):
+    tree = example_module_tree
+    installer = moduledev.Installer(tree)
+    installer.install(new_module(tree, "1.0"), tarball)
+    installer.install(new_module(tree, "1.1"), tarball)
+    prefix = installer.prefix(installer.key(tarball))
+    assert not prefix.startswith(tree.cache_dir())
+    collector = moduledev.GarbageCollector(tree)
+    assert collector.scan() == []
+
+    tree_trash = moduledev.Trash(tree)
+    entries = [tree_trash.put(tree.load_module("hello", "1.0"))]
+    tree_trash.empty(entries)
+    assert os.path.exists(prefix)
+    entries = [tree_trash.put(tree.load_module("hello", "1.1"))]
+    assert collector.scan() == []
+    tree_trash.empty(entries)
+    assert not os.path.exists(prefix)
+    assert not os.path.exists(installer.log_path(installer.key(tarball)))
+
+    builder, _ = installer.install(new_module(tree, "1.0"), tarball)
+    new_tree, _ = moduledev.TreeRelocation(tree, str(tmpdir / "moved")).run()
+    loader = new_tree.load_module("hello", "1.0")
+    bindir = os.path.join(loader.module_path(), "bin")
+    assert os.readlink(bindir).startswith(new_tree.builds_dir())
+    assert os.path.exists(os.path.join(bindir, "hello"))
+    loader.clear()
+    garbage = moduledev.GarbageCollector(new_tree).scan()
+    assert [g.kind for g in garbage] == ["unused-build"]
+    moduledev.GarbageCollector(new_tree).collect(garbage)
+    assert os.listdir(new_tree.builds_dir()) == []
+
+
+def test_key(example_builder, tarball):
+    tree = example_builder.module_tree
+    key = moduledev.Installer(tree).key(tarball)
+    assert moduledev.Installer(tree).key(tarball) == key
+    recipe = moduledev.BuildRecipe({"build": "make"})
+    assert moduledev.Installer(tree, recipe).key(tarball) != key
+
+    bin_path = moduledev.Path("bin")
+    example_builder.module.paths.append(bin_path)
+    example_builder.save_module_file()
+    installer = moduledev.Installer(tree, toolchain=["test"])
+    assert installer.toolchain_versions() == ["test/1.0"]
+    assert installer.key(tarball) != key
+    env = installer.environment("/prefix")
+    assert env["PATH"].startswith(bin_path.resolve(example_builder.module_path()))
+    assert env["PREFIX"] == "/prefix"
+
+
+def test_failed_build(example_module_tree, tarball):
+    recipe = moduledev.BuildRecipe({"build": "exit 3"})
+    installer = moduledev.Installer(example_module_tree, recipe)
+    with pytest.raises(RuntimeError):
+        installer.build(tarball)
+    key = installer.key(tarball)
+    assert not installer.cached(key)
+    assert not os.path.exists(installer.prefix(key))
+    with open(installer.log_path(key)) as f:
+        assert "+ exit 3" in f.read()
+    assert sorted(os.listdir(installer.builds_dir())) == [f"{key}.lock", f"{key}.log"]
+
+
+def test_failed_rebuild_keeps_old_build(example_module_tree, tarball, monkeypatch):
+    tree = example_module_tree
+    installer = moduledev.Installer(tree)
+    installer.install(new_module(tree, "1.0"), tarball)
+    key = installer.key(tarball)
+    monkeypatch.setattr(install.subprocess, "call", lambda *args, **kwargs: 3)
+    with pytest.raises(RuntimeError):
+        installer.build(tarball, rebuild=True)
+    assert installer.cached(key)
+    loader = tree.load_module("hello", "1.0")
+    assert os.path.exists(os.path.join(loader.module_path(), "bin", "hello"))
+    assert not [e for e in os.listdir(installer.builds_dir()) if e.startswith(".")]
+
+
+def test_recipe_load(tmpdir):
+    path = str(tmpdir / "recipe.yaml")
+    with open(path, "w") as f:
+        f.write("configure: cmake .\ntoolchain: gcc/12\n")
+    recipe = moduledev.BuildRecipe.load(path)
+    assert recipe.steps["configure"] == "cmake ."
+    assert recipe.steps["install"] == install.DEFAULT_STEPS["install"]
+    assert recipe.toolchain == ["gcc/12"]
+    with open(path, "w") as f:
+        f.write("patch: sed -i s/a/b/ x\n")
+    with pytest.raises(ValueError):
+        moduledev.BuildRecipe.load(path)
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+import moduledev
+from moduledev import integrity
+
+
+@pytest.fixture
+def copied_builder(example_builder, bindir):
+    os.mkdir(bindir / "sub")
+    with open(bindir / "sub" / "data", "w") as f:
+        f.write("data")
+    example_builder.add_path(bindir, moduledev.Path("bin"), link=False)
+    example_builder.save_module_file()
+    return example_builder
+
+
+def test_record_path(copied_builder, bindir):
+    manifest = integrity.manifest_path(copied_builder)
+    files = integrity.read_manifest(manifest)
+    assert sorted(files) == ["bin/script", "bin/sub/data"]
+    assert files["bin/sub/data"]["size"] == 4
+    os.symlink("script", bindir / "alias")
+    copied_builder.add_path(bindir, moduledev.Path("hardlinked"), hardlink=True)
+    copied_builder.add_path(bindir, moduledev.Path("linked"))
+    assert sorted(integrity.read_manifest(manifest)) == [
+        "bin/script",
+        "bin/sub/data",
+        "hardlinked/script",
+        "hardlinked/sub/data",
+    ]
+    copied_builder.remove_path(moduledev.Path("hardlinked"))
+    copied_builder.remove_path(moduledev.Path("bin"))
+    assert not os.path.exists(manifest)
+
+
+def test_verify(copied_builder):
+    tree = copied_builder.module_tree
+    verifier = integrity.ModuleVerifier(tree, jobs=2)
+    assert verifier.verify() == []
+    assert (verifier.hashed, verifier.skipped) == (2, 0)
+    assert verifier.verify() == []
+    assert (verifier.hashed, verifier.skipped) == (0, 2)
+
+    data = os.path.join(copied_builder.module_path(), "bin", "sub", "data")
+    script = os.path.join(copied_builder.module_path(), "bin", "script")
+    with open(data, "w") as f:
+        f.write("DATA")
+    os.chmod(script, 0o700)
+    mismatches = verifier.verify()
+    assert [(m.kind, m.path) for m in mismatches] == [
+        ("mode", script),
+        ("hash", data),
+    ]
+    assert verifier.hashed == 1
+    os.unlink(data)
+    assert [m.kind for m in verifier.verify()] == ["mode", "missing"]
@@ -0,0 +1,220 @@
+import errno
+import os
+
+import pytest
+
+import moduledev
+from moduledev import journal, module, render, trash
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt(*args, **kwargs):
+    raise Interrupted()
+
+
+def test_build_is_rolled_forward(example_module_tree, example_module, monkeypatch):
+    tree = example_module_tree
+    with monkeypatch.context() as m:
+        m.setattr(moduledev.ModuleBuilder, "save_module_file", interrupt)
+        with pytest.raises(Interrupted):
+            tree.init_module(example_module)
+    assert not tree.module_exists("test", "1.0")
+    assert len(moduledev.Journal(tree).pending()) == 1
+
+    recovered = moduledev.Journal(tree).recover()
+    assert [(i.kind, i.target, d) for i, d in recovered] == [
+        ("build", "test/1.0", journal.FORWARD)
+    ]
+    loader = tree.load_module("test", "1.0")
+    assert loader.module.description == example_module.description
+    assert moduledev.Journal(tree).pending() == []
+    assert moduledev.Journal(tree).recover() == []
+
+
+def test_link_is_created_after_build_is_recorded(
+    example_module_tree, example_module, monkeypatch
+):
+    tree = example_module_tree
+    with monkeypatch.context() as m:
+        m.setattr(moduledev.ModuleTree, "link_master", interrupt)
+        with pytest.raises(Interrupted):
+            tree.init_module(example_module)
+    assert len(moduledev.Journal(tree).pending()) == 1
+
+    moduledev.Journal(tree).recover()
+    assert tree.module_exists("test", "1.0")
+    assert moduledev.Journal(tree).pending() == []
+
+
+def test_unfinished_records_are_not_pending(example_module_tree, monkeypatch):
+    tree = example_module_tree
+    with monkeypatch.context() as m:
+        m.setattr(journal.os, "rename", interrupt)
+        with pytest.raises(Interrupted):
+            with moduledev.Journal(tree).transaction(
+                [journal.Intent(journal.Intent.WRITE, "test/1.0")]
+            ):
+                pass
+    assert moduledev.Journal(tree).pending() == []
+    assert os.listdir(tree.journal_dir()) == []
+
+
+def test_rejected_build_is_not_recorded(example_builder, example_module):
+    tree = example_builder.module_tree
+    example_module.version = "2.0"
+    builder = moduledev.ModuleBuilder(tree, example_module)
+    os.symlink("missing", builder.modulefile_path())
+    with pytest.raises(FileExistsError):
+        builder.build()
+    assert moduledev.Journal(tree).pending() == []
+    assert not os.path.exists(builder.module_path())
+
+
+def test_operations_sync_touched_paths(
+    example_module_tree, example_module, monkeypatch
+):
+    monkeypatch.setattr(journal, "_syncfs", interrupt)
+    builder = example_module_tree.init_module(example_module)
+    moduledev.Trash(example_module_tree).put(builder)
+    assert moduledev.Journal(example_module_tree).pending() == []
+
+
+def test_clear_is_rolled_forward(example_builder, monkeypatch):
+    tree = example_builder.module_tree
+    with monkeypatch.context() as m:
+        m.setattr(render, "remove", interrupt)
+        with pytest.raises(Interrupted):
+            example_builder.clear()
+    assert os.path.exists(example_builder.module_path())
+
+    moduledev.Journal(tree).recover()
+    assert not os.path.exists(example_builder.module_base())
+    assert not os.path.exists(example_builder.modulefile_base())
+
+
+def test_replace_path(example_builder, bindir, monkeypatch):
+    tree = example_builder.module_tree
+    path_obj = moduledev.Path(str(bindir))
+    example_builder.add_path(bindir, path_obj, link=False)
+    example_builder.save_module_file()
+    with open(bindir / "script", "w") as f:
+        f.write("changed\n")
+
+    with monkeypatch.context() as m:
+        m.setattr(module.ModuleLocation, "add_path", interrupt)
+        with pytest.raises(Interrupted):
+            example_builder.replace_path(bindir, path_obj, link=False)
+    dest = path_obj.resolve(example_builder.module_path())
+    assert not os.path.exists(dest)
+
+    recovered = moduledev.Journal(tree).recover(dry_run=True)
+    assert [d for _, d in recovered] == [journal.FORWARD]
+    assert not os.path.exists(dest)
+    moduledev.Journal(tree).recover()
+    with open(os.path.join(dest, "script")) as f:
+        assert f.read() == "changed\n"
+    assert [p.path for p in tree.load_module("test").module.paths] == [path_obj.path]
+
+    with monkeypatch.context() as m:
+        m.setattr(module.ModuleLocation, "add_path", interrupt)
+        with pytest.raises(Interrupted):
+            tree.load_module("test").replace_path(bindir, path_obj, link=False)
+    os.unlink(bindir / "script")
+    os.rmdir(bindir)
+    recovered = moduledev.Journal(tree).recover()
+    assert [d for _, d in recovered] == [journal.BACK]
+    assert tree.load_module("test").module.paths == []
+
+
+def test_bulk_update_is_one_batch(example_builder, example_module, monkeypatch):
+    tree = example_builder.module_tree
+    example_module.name = "other"
+    example_module.shared = False
+    tree.init_module(example_module)
+    update = moduledev.BulkUpdate(tree)
+    changes = update.plan({"DESCRIPTION": "changed"})
+    assert len(changes) == 2
+
+    with monkeypatch.context() as m:
+        m.setattr(moduledev.bulk.BulkChange, "apply", interrupt)
+        with pytest.raises(Interrupted):
+            update.apply(changes)
+    assert len(moduledev.Journal(tree).pending()) == 1
+    recovered = moduledev.Journal(tree).recover()
+    assert [i.kind for i, _ in recovered] == ["write", "write"]
+    for name in ["test", "other"]:
+        assert tree.load_module(name).module.description == "changed"
+
+
+def test_trash(example_builder, monkeypatch):
+    tree = example_builder.module_tree
+    tree_trash = moduledev.Trash(tree)
+    with monkeypatch.context() as m:
+        m.setattr(moduledev.TrashEntry, "save", interrupt)
+        with pytest.raises(Interrupted):
+            tree_trash.put(example_builder)
+    assert [d for _, d in moduledev.Journal(tree).recover()] == [journal.BACK]
+    assert os.listdir(tree.trash_dir()) == []
+    assert tree.module_exists("test", "1.0")
+
+    with monkeypatch.context() as m:
+        m.setattr(render, "remove", interrupt)
+        with pytest.raises(Interrupted):
+            tree_trash.put(example_builder)
+    assert [d for _, d in moduledev.Journal(tree).recover()] == [journal.FORWARD]
+    assert not os.path.exists(example_builder.module_base())
+    assert not os.path.exists(example_builder.modulefile_base())
+    tree_trash.find("test").restore(tree)
+    assert tree.module_exists("test", "1.0")
+
+    loader = tree.load_module("test", "1.0")
+    with monkeypatch.context() as m:
+        m.setattr(module.ModuleLocation, "available_versions", interrupt)
+        with pytest.raises(Interrupted):
+            tree_trash.put(loader)
+    entry = tree_trash.find("test")
+    assert os.path.exists(entry.version_path())
+    with open(os.path.join(entry.path, trash.META_NAME), "w") as f:
+        f.write('{"name": "te')
+    assert [d for _, d in moduledev.Journal(tree).recover()] == [journal.BACK]
+    assert os.listdir(tree.trash_dir()) == []
+    assert tree.module_exists("test", "1.0")
+
+
+def test_trash_across_devices(example_builder, monkeypatch):
+    tree = example_builder.module_tree
+    with monkeypatch.context() as m:
+        m.setattr(render, "remove", interrupt)
+        with pytest.raises(Interrupted):
+            moduledev.Trash(tree).put(example_builder)
+
+    rename = os.rename
+
+    def cross_device_rename(src, dst):
+        if str(dst).startswith(tree.trash_dir()):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        return rename(src, dst)
+
+    monkeypatch.setattr(os, "rename", cross_device_rename)
+    assert [d for _, d in moduledev.Journal(tree).recover()] == [journal.FORWARD]
+    assert not os.path.exists(example_builder.module_base())
+    assert not os.path.exists(example_builder.modulefile_base())
+    assert os.listdir(tree.trash_dir()) == []
+
+
+def test_running_and_unreadable(example_module_tree):
+    tree = example_module_tree
+    tree_journal = moduledev.Journal(tree)
+    intent = journal.Intent(journal.Intent.WRITE, "file", path="file", text="")
+    with tree_journal.transaction([intent]):
+        assert tree_journal.recover() == []
+        assert len(tree_journal.pending()) == 1
+    assert tree_journal.pending() == []
+
+    with open(os.path.join(tree.journal_dir(), "0-0-torn"), "w") as f:
+        f.write('[{"kind": "wri')
+    assert tree_journal.recover() == []
+    assert tree_journal.pending() == []
@@ -0,0 +1,56 @@
+import os
+
+import moduledev
+from moduledev.lint import lint_lines
+
+
+def codes(diagnostics):
+    return [(d.line, d.code) for d in diagnostics]
+
+
+def test_clean_tree(example_builder, bindir):
+    example_builder.add_path(bindir, moduledev.Path("bin"))
+    example_builder.save_module_file()
+    linter = moduledev.ModuleLinter(example_builder.module_tree, jobs=2)
+    assert linter.dotfiles() == [example_builder.moduledotfile_path()]
+    assert linter.run() == []
+
+
+def test_lint_lines():
+    lines = [
+        "#%Module1.0",
+        "set MAINTAINER",
+        "set DESCRIPTION 'unterminated",
+        "prepend-path PATH $basedir/bin",
+        "prepend-path PATH $basedir/bin",
+        "append-path PATH /usr/local/bin",
+        "append-path MANPATH",
+        "bogus-command arg",
+        "if { [ module-info mode load ] } {",
+        "  whatever",
+        "}",
+    ]
+    diagnostics = lint_lines("dotfile", lines)
+    assert codes(diagnostics) == [
+        (2, "short-set"),
+        (3, "parse-error"),
+        (5, "duplicate-path"),
+        (6, "no-basedir"),
+        (7, "short-path"),
+        (8, "unknown-command"),
+    ]
+    assert [d.severity for d in diagnostics[:2]] == ["error", "error"]
+    assert repr(diagnostics[0]).startswith("dotfile:2: error:")
+
+
+def test_lint_detached(example_module, example_module_tree):
+    example_module.shared = False
+    builder = example_module_tree.init_module(example_module)
+    with open(builder.moduledotfile_path(), "a") as f:
+        f.write("set HELPTEXT\n")
+    diagnostics = moduledev.ModuleLinter(example_module_tree).run()
+    assert [(d.path, d.code) for d in diagnostics] == [
+        (builder.moduledotfile_path(), "short-set")
+    ]
+    assert diagnostics[0].to_dict()["severity"] == "error"
+    assert os.path.basename(os.path.dirname(diagnostics[0].path)) == "1.0"
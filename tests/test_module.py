@@ -1,5 +1,6 @@
 import os
 import shutil
+import sys
 
 import pytest
 
@@ -172,6 +173,24 @@ def test_remove_path(example_builder, bindir):
     assert "PATH" not in dotfile_text
 
 
+def test_hardlink_path(example_builder, bindir):
+    os.makedirs(bindir / "sub" / "dir")
+    os.symlink("script", bindir / "link")
+    binpath = moduledev.Path("bin", "prepend-path", "PATH")
+    example_builder.add_path(bindir, binpath, link=False, hardlink=True, jobs=2)
+    dest = binpath.resolve(example_builder.module_path())
+    assert not os.path.islink(dest)
+    assert os.path.samefile(os.path.join(dest, "script"), bindir / "script")
+    assert os.readlink(os.path.join(dest, "link")) == "script"
+    assert os.path.isdir(os.path.join(dest, "sub", "dir"))
+
+    shutil.rmtree(bindir)
+    assert example_builder.path_exists(binpath)
+    example_builder.remove_path(binpath, jobs=2)
+    assert not os.path.lexists(dest)
+    assert example_builder.module.paths == []
+
+
 def test_extra_commands(example_module, example_module_tree):
     builder = example_module_tree.init_module(example_module)
     with open(builder.moduledotfile_path(), "a") as f:
@@ -236,3 +255,87 @@ def test_missing_versioned_module(example_builder, tmpdir):
             shutil.rmtree(os.path.join(loader.module_base(), p))
     with pytest.raises(ValueError):
         loader.version()
+
+
+def test_load_setenv_path(example_builder, bindir):
+    setenv_path = moduledev.Path("bin", "setenv", "BINDIR")
+    example_builder.add_path(bindir, setenv_path)
+    example_builder.module.extra_commands.append("setenv OTHER value")
+    example_builder.save_module_file()
+    loader = example_builder.module_tree.load_module("test", "1.0")
+    assert [str(p) for p in loader.module.paths] == ["setenv BINDIR $basedir/bin"]
+    assert loader.module.extra_commands == ["setenv OTHER value"]
+
+
+def test_load_module_constraint(example_module_tree, example_module):
+    for version in ["1.0", "1.9", "2.0"]:
+        example_module.version = version
+        example_module_tree.init_module(example_module)
+    loader = example_module_tree.load_module(example_module.name, "<2")
+    assert loader.module.version == "1.9"
+    assert loader.module_path().endswith("1.9")
+    assert not example_module_tree.module_exists(example_module.name, ">2")
+    index = example_module_tree.version_index(example_module.name)
+    assert example_module_tree.version_index(example_module.name) is index
+    example_module.version = "1.10"
+    example_module_tree.init_module(example_module)
+    loader = example_module_tree.load_module(example_module.name, "<2")
+    assert loader.module.version == "1.10"
+
+
+def test_lazy_modules(example_builder, monkeypatch):
+    example_builder.module.extra_vars["EXTRA"] = "1"
+    example_builder.save_module_file()
+    parsed = []
+    from_file = moduledev.Module.from_file
+
+    def counting_from_file(*args, **kwargs):
+        parsed.append(args[0])
+        return from_file(*args, **kwargs)
+
+    monkeypatch.setattr(moduledev.Module, "from_file", counting_from_file)
+    descriptors = list(example_builder.module_tree.modules(lazy=True))
+    assert [(d.name, d.version) for d in descriptors] == [("test", "1.0")]
+    descriptor = descriptors[0]
+    assert descriptor.dotfile == example_builder.moduledotfile_path()
+    assert descriptor.category == "test"
+    assert parsed == []
+    assert descriptor.extra_vars == {"EXTRA": "1"}
+    assert descriptor.description == example_builder.module.description
+    assert parsed == [descriptor.dotfile]
+
+
+def test_compact_path():
+    path_obj = moduledev.Path("bin", "".join(["prepend", "-path"]), "".join("PATH"))
+    assert not hasattr(path_obj, "__dict__")
+    assert path_obj.operation is sys.intern("prepend-path")
+    assert path_obj.name is sys.intern("PATH")
+    assert path_obj.path is moduledev.Path("bin/").path
+
+
+def test_interned_module_strings(example_builder):
+    example_builder.module_tree.load_module("test", "1.0")
+    first = example_builder.module_tree.load_module("test", "1.0").module
+    second = example_builder.module_tree.load_module("test", "1.0").module
+    assert first.maintainer is second.maintainer
+    assert first.description is second.description
+
+
+def test_shared_modulefile_parsed_once(example_module_tree, example_module):
+    from moduledev.module import _parse_module_file
+
+    for version in ["1.0", "1.1", "2.0"]:
+        example_module.version = version
+        example_module_tree.init_module(example_module)
+    _parse_module_file.cache_clear()
+    modules = list(example_module_tree.modules(all_versions=True))
+    assert sorted(m.version for m in modules) == ["1.0", "1.1", "2.0"]
+    assert _parse_module_file.cache_info().misses == 1
+    modules[0].paths.append(moduledev.Path("bin"))
+    assert modules[1].paths == []
+
+    loader = example_module_tree.load_module(example_module.name, "2.0")
+    loader.module.description = "a changed description"
+    loader.save_module_file()
+    reloaded = example_module_tree.load_module(example_module.name, "1.0")
+    assert reloaded.module.description == "a changed description"
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+import moduledev
+from moduledev import pack
+
+
+@pytest.fixture
+def copied_builder(example_module, example_module_tree, bindir):
+    example_module.shared = False
+    example_builder = example_module_tree.init_module(example_module)
+    os.mkdir(bindir / "sub")
+    with open(bindir / "sub" / "data", "w") as f:
+        f.write("data")
+    os.chmod(bindir / "script", 0o755)
+    example_builder.add_path(bindir, moduledev.Path("bin"), link=False)
+    os.symlink("script", os.path.join(example_builder.module_path(), "bin", "alias"))
+    example_builder.add_path(bindir, moduledev.Path("linked", "prepend-path", "X"))
+    example_builder.save_module_file()
+    return example_builder
+
+
+def test_pack(copied_builder):
+    count = pack.pack_version(copied_builder)
+    assert count == 5
+    assert sorted(os.listdir(copied_builder.module_path())) == [
+        ".modulefile",
+        ".modulemanifest.json",
+        ".modulepack.zip",
+        "linked",
+    ]
+    assert "bin/sub/data" in pack.pack_contents(pack.pack_path(copied_builder))
+    loader = copied_builder.module_tree.load_module("test", "1.0")
+    assert loader.module.extra_vars[pack.PACK_VAR] == "$basedir/.modulepack.zip"
+    with pytest.raises(ValueError):
+        pack.pack_version(loader)
+
+
+def test_unpack_restore(copied_builder):
+    pack.pack_version(copied_builder)
+    loader = copied_builder.module_tree.load_module("test", "1.0")
+    pack.unpack_version(loader, jobs=2)
+    bindir = os.path.join(loader.module_path(), "bin")
+    assert open(os.path.join(bindir, "sub", "data")).read() == "data"
+    assert os.access(os.path.join(bindir, "script"), os.X_OK)
+    assert os.readlink(os.path.join(bindir, "alias")) == "script"
+    assert not os.path.exists(pack.pack_path(loader))
+    loader = copied_builder.module_tree.load_module("test", "1.0")
+    assert pack.PACK_VAR not in loader.module.extra_vars
+    with pytest.raises(ValueError):
+        pack.unpack_version(loader)
+
+
+def test_unpack_dest(copied_builder, tmpdir):
+    pack.pack_version(copied_builder, keep=True, compress=False)
+    assert os.path.exists(os.path.join(copied_builder.module_path(), "bin"))
+    pack.unpack_version(copied_builder, dest=tmpdir / "scratch")
+    assert open(tmpdir / "scratch" / "bin" / "sub" / "data").read() == "data"
+    assert os.path.exists(pack.pack_path(copied_builder))
+
+
+def test_pack_shared(example_builder, example_module, bindir):
+    tree = example_builder.module_tree
+    example_builder.add_path(bindir, moduledev.Path("bin"), link=False)
+    example_builder.save_module_file()
+    example_module.version = "2.0"
+    tree.init_module(example_module)
+    shared = example_builder.shared_moduledotfile_path()
+    with open(shared) as f:
+        text = f.read()
+    loader = tree.load_module("test", "1.0")
+    pack.pack_version(loader)
+    with open(shared) as f:
+        assert f.read() == text
+    loader = tree.load_module("test", "1.0")
+    assert not loader.shared()
+    assert loader.module.extra_vars[pack.PACK_VAR] == "$basedir/.modulepack.zip"
+    assert pack.PACK_VAR not in tree.load_module("test", "2.0").module.extra_vars
+    assert not os.path.exists(os.path.join(loader.module_path(), "bin"))
+    pack.unpack_version(loader)
+    loader = tree.load_module("test", "1.0")
+    assert not loader.shared()
+    assert pack.PACK_VAR not in loader.module.extra_vars
+    assert os.path.exists(os.path.join(loader.module_path(), "bin", "script"))
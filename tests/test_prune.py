@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+import moduledev
+from moduledev import prune
+
+
+def add_version(module, tree, name, version, commands=(), age=0):
+    module.name, module.version = name, version
+    module.extra_commands = list(commands)
+    builder = tree.init_module(module)
+    mtime = os.stat(builder.module_path()).st_mtime - age
+    os.utime(builder.module_path(), (mtime, mtime))
+    return builder
+
+
+def versions(garbage):
+    return [f"{g.name}/{os.path.basename(g.path)}" for g in garbage]
+
+
+def test_parse_age():
+    assert prune.parse_age("90") == 90
+    assert prune.parse_age("12h") == 12 * 3600
+    assert prune.parse_age("2w") == 14 * 86400
+    with pytest.raises(ValueError):
+        prune.parse_age("1y")
+
+
+def test_parse_pin():
+    assert prune.parse_pin("gcc") == ("gcc", None)
+    name, constraint = prune.parse_pin("gcc/9.*")
+    assert name == "gcc" and constraint.matches("9.2")
+    with pytest.raises(ValueError):
+        prune.parse_pin("gcc/>>1")
+
+
+def test_retention_policy():
+    found = [("1.0", 0), ("1.10", 0), ("1.2", 95), ("2.0", 0)]
+    policy = moduledev.RetentionPolicy(keep=2)
+    assert sorted(policy.kept("a", found)) == ["1.10", "2.0"]
+    policy = moduledev.RetentionPolicy(newer_than=10, pins=[("a", None)], now=100)
+    assert len(policy.kept("a", found)) == 4
+    policy = moduledev.RetentionPolicy(
+        keep=1, newer_than=10, pins=[prune.parse_pin("a/1.0")], now=100
+    )
+    assert policy.kept("a", found) == {
+        "1.0": "pinned",
+        "1.2": "recently modified",
+        "2.0": "one of the newest 1",
+    }
+
+
+def test_prune(example_module, example_module_tree):
+    tree = example_module_tree
+    for version in ["1.0", "1.1", "1.2", "1.10"]:
+        add_version(example_module, tree, "nightly", version, age=86400)
+    old = add_version(example_module, tree, "old", "0.1", age=86400)
+    add_version(example_module, tree, "gcc", "9.2", age=86400)
+    add_version(example_module, tree, "gcc", "10.1", age=86400)
+    add_version(example_module, tree, "app", "1.0", ["prereq gcc/9.2"], age=86400)
+    add_version(example_module, tree, "app", "2.0", ["prereq old"])
+
+    policy = moduledev.RetentionPolicy(
+        keep=1, newer_than=3600, pins=[prune.parse_pin("nightly/1.1")]
+    )
+    pruner = moduledev.Pruner(tree, policy, jobs=2)
+    garbage = pruner.scan()
+    assert versions(garbage) == ["app/1.0", "gcc/9.2", "nightly/1.0", "nightly/1.2"]
+    assert pruner.required == {}
+    assert os.path.exists(old.module_path())
+
+    policy = moduledev.RetentionPolicy(keep=0, newer_than=3600)
+    pruner = moduledev.Pruner(tree, policy, jobs=2)
+    garbage = pruner.scan()
+    assert pruner.required == {"old/0.1": "app/2.0"}
+    assert "old/0.1" not in versions(garbage)
+    assert "nightly/1.10" in versions(garbage)
+    pruner.prune(garbage)
+    assert sorted(os.listdir(tree.root_dir)) == ["app", "module", "modulefile", "old"]
+    assert not os.path.exists(os.path.join(tree.modulefile_dir(), "test", "nightly"))
+    assert os.listdir(os.path.join(tree.modulefile_dir(), "test", "app")) == ["2.0"]
+    assert pruner.scan() == []
@@ -0,0 +1,58 @@
+import io
+import json
+import os
+
+import pytest
+
+import moduledev
+from moduledev.cli import CliCfg
+from moduledev.query import QueryHandler
+
+
+@pytest.fixture
+def handler(example_builder, bindir):
+    example_builder.add_path(bindir, moduledev.Path("bin"))
+    example_builder.save_module_file()
+    tree = moduledev.FederatedTree([example_builder.module_tree])
+    return QueryHandler(tree, CliCfg(None, None).check_module)
+
+
+def test_queries(handler, example_builder):
+    response = handler.handle({"id": 1, "op": "location", "module": "test"})
+    assert response == {"id": 1, "ok": True, "result": example_builder.module_path()}
+    paths = handler.handle({"op": "paths", "module": "test", "version": "1.0"})
+    assert paths["result"] == [
+        {
+            "operation": "prepend-path",
+            "name": "PATH",
+            "path": "$basedir/bin",
+            "resolved": os.path.join(example_builder.module_path(), "bin"),
+        }
+    ]
+    show = handler.handle({"op": "show", "module": "test"})
+    assert "set MAINTAINER" in show["result"]
+    assert handler.handle({"op": "exists", "module": "nothing"})["result"] is False
+    missing = handler.handle({"op": "location", "module": "nothing"})
+    assert not missing["ok"] and "does not exist" in missing["error"]
+    assert not handler.handle({"op": "remove", "module": "test"})["ok"]
+    assert not handler.handle(["not", "an", "object"])["ok"]
+
+
+def test_cache_invalidation(handler, example_builder, example_module):
+    query = {"op": "latest-version", "module": "test"}
+    assert handler.handle(query)["result"] == "1.0"
+    assert handler.loader("test") is handler.loader("test")
+    example_module.version = "2.0"
+    example_builder.module_tree.init_module(example_module)
+    assert handler.handle(query)["result"] == "2.0"
+
+
+def test_serve(handler):
+    instream = io.StringIO(
+        '{"id": "a", "op": "exists", "module": "test"}\n\nnot json\n'
+    )
+    outstream = io.StringIO()
+    handler.serve(instream, outstream)
+    responses = [json.loads(line) for line in outstream.getvalue().splitlines()]
+    assert responses[0] == {"id": "a", "ok": True, "result": True}
+    assert len(responses) == 2 and not responses[1]["ok"]
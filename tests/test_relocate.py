@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+import moduledev
+
+
+@pytest.fixture
+def linked_tree(example_builder, tmpdir):
+    """A tree with a link to an outside path and a link inside the tree"""
+    os.mkdir(tmpdir / "outside")
+    example_builder.add_path(tmpdir / "outside", moduledev.Path("outside"))
+    os.mkdir(os.path.join(example_builder.module_path(), "share"))
+    os.symlink(
+        os.path.join(example_builder.module_path(), "share"),
+        os.path.join(example_builder.module_path(), "data"),
+    )
+    example_builder.save_module_file()
+    return example_builder.module_tree
+
+
+def test_relocate(linked_tree, tmpdir):
+    old_root = linked_tree.root_dir
+    new_tree, count = moduledev.TreeRelocation(linked_tree, tmpdir / "moved").run()
+    assert count == 2
+    assert not os.path.exists(old_root)
+    assert new_tree.module_exists("test", "1.0")
+    loader = new_tree.load_module("test", "1.0")
+    assert os.readlink(loader.modulefile_path()) == new_tree.master_module_file()
+    data = os.path.join(loader.module_path(), "data")
+    assert os.readlink(data) == os.path.join(loader.module_path(), "share")
+    assert os.readlink(os.path.join(loader.module_path(), "outside")) == str(
+        tmpdir / "outside"
+    )
+    with open(new_tree.master_module_file()) as f:
+        assert f"set MODULEBASE {new_tree.root_dir}\n" in f.read()
+
+
+def test_relocate_relative(linked_tree, tmpdir):
+    old_root = linked_tree.root_dir
+    new_tree, _ = moduledev.TreeRelocation(
+        linked_tree, tmpdir / "copied", copy=True, relative=True, jobs=2
+    ).run()
+    assert os.path.exists(old_root)
+    assert linked_tree.module_exists("test", "1.0")
+    assert new_tree.relative_layout()
+    loader = new_tree.load_module("test", "1.0")
+    assert os.readlink(loader.modulefile_path()) == "../../../module/test_modulefile"
+    assert os.readlink(os.path.join(loader.module_path(), "data")) == "share"
+
+    # relative trees can be moved without any relocation
+    os.rename(new_tree.root_dir, tmpdir / "renamed")
+    renamed = moduledev.ModuleTree(tmpdir / "renamed")
+    assert renamed.module_exists("test", "1.0")
+    example_module = moduledev.Module(renamed, "other", "1.0")
+    builder = renamed.init_module(example_module)
+    assert not os.path.isabs(os.readlink(builder.modulefile_path()))
+    assert renamed.module_exists("other", "1.0")
+
+
+def test_relocate_into_nonempty(linked_tree, tmpdir):
+    os.mkdir(tmpdir / "full")
+    with open(tmpdir / "full" / "file", "w") as f:
+        f.write("")
+    with pytest.raises(ValueError):
+        moduledev.TreeRelocation(linked_tree, tmpdir / "full").run()
+    with pytest.raises(ValueError):
+        moduledev.TreeRelocation(
+            linked_tree, os.path.join(linked_tree.root_dir, "inside")
+        ).run()
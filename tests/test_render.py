@@ -0,0 +1,89 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import moduledev
+from moduledev import render
+
+
+def test_lua_value():
+    variables = {"PREFIX": "/opt"}
+    assert render.lua_value("$basedir/bin", variables) == 'basedir .. "/bin"'
+    assert render.lua_value("${MODULEBASE}", variables) == "modulebase"
+    assert render.lua_value('$PREFIX/"x"', variables) == '"/opt/\\"x\\""'
+    assert render.lua_value("$basedirs", variables) == '"$basedirs"'
+    assert render.lua_value("", variables) == '""'
+
+
+def test_render_lua(example_builder, example_module, bindir):
+    example_builder.add_path(bindir, moduledev.Path("bin"))
+    example_module.extra_vars["PREFIX"] = "/opt"
+    example_module.extra_commands = [
+        "setenv TEST_HOME $PREFIX/test",
+        "unsetenv OLD",
+        "prereq gcc/9.2 clang",
+        "module load zlib",
+        "conflict other",
+        "puts stderr hello",
+    ]
+    text = render.render_lua(example_builder)
+    assert 'local basedir = pathJoin(modulebase, "test", "1.0")' in text
+    assert 'whatis("The description of a test module")' in text
+    assert 'conflict("test")' in text
+    assert 'prepend_path("PATH", basedir .. "/bin")' in text
+    assert 'setenv("TEST_HOME", "/opt/test")' in text
+    assert 'unsetenv("OLD")' in text
+    assert 'prereq_any("gcc/9.2", "clang")' in text
+    assert 'load("zlib")' in text
+    assert 'conflict("other")' in text
+    assert "-- not converted: puts stderr hello" in text
+
+
+def test_backend(example_builder, example_module, bindir):
+    tree = example_builder.module_tree
+    assert tree.backend() == "tcl"
+    example_module.version = "2.0"
+    second = tree.init_module(example_module)
+    first = tree.load_module("test", "1.0")
+    assert not os.path.exists(render.lua_path(second))
+
+    renderer = moduledev.TreeRenderer(tree, "lua", jobs=2)
+    assert renderer.run() == 2
+    assert tree.backend() == "lua"
+    assert renderer.run() == 0
+
+    # a shared .modulefile is rendered for all versions when it is saved
+    second.add_path(bindir, moduledev.Path("bin"))
+    second.save_module_file()
+    for loader in (first, second):
+        with open(render.lua_path(loader)) as f:
+            assert "prepend_path" in f.read()
+    assert moduledev.GarbageCollector(tree).scan() == []
+
+    first.clear()
+    assert not os.path.exists(render.lua_path(first))
+    moduledev.Trash(tree).put(second)
+    assert not os.path.exists(render.lua_path(second))
+    moduledev.Trash(tree).find("test").restore(tree)
+    assert os.path.exists(render.lua_path(second))
+
+    assert moduledev.TreeRenderer(tree, "tcl").run() == 1
+    assert tree.backend() == "tcl"
+    assert not os.path.exists(render.lua_path(second))
+    with pytest.raises(ValueError):
+        moduledev.TreeRenderer(tree, "csh")
+
+
+@pytest.mark.skipif(shutil.which("lua") is None, reason="requires lua")
+def test_lua_syntax(example_builder, tmpdir):
+    moduledev.TreeRenderer(example_builder.module_tree, "lua").run()
+    stubs = "function myFileName() return '/root/modulefile/c/test/1.0.lua' end\n"
+    stubs += "function pathJoin(...) return table.concat({...}, '/') end\n"
+    for f in ["whatis", "help", "conflict", "prepend_path", "setenv"]:
+        stubs += f"function {f}(...) end\n"
+    with open(tmpdir / "test.lua", "w") as f:
+        f.write(stubs)
+        f.write(open(render.lua_path(example_builder)).read())
+    subprocess.check_call(["lua", str(tmpdir / "test.lua")])
@@ -0,0 +1,93 @@
+import gzip
+import io
+import json
+import os
+
+import pytest
+
+import moduledev
+from moduledev import render, snapshot
+
+
+@pytest.fixture
+def other_module_tree(tmpdir):
+    os.mkdir(tmpdir / "other")
+    return moduledev.ModuleTree(tmpdir / "other")
+
+
+def export(module_tree, include_links=False):
+    f = io.BytesIO()
+    snapshot.export_snapshot(module_tree, f, include_links)
+    f.seek(0)
+    return f
+
+
+def test_snapshot_roundtrip(example_builder, other_module_tree, bindir):
+    example_builder.add_path(bindir, moduledev.Path("bin"))
+    example_builder.save_module_file()
+    f = export(example_builder.module_tree)
+    assert snapshot.snapshot_name(f) == "test"
+    f.seek(0)
+    other_module_tree.setup("test", f)
+    loader = other_module_tree.load_module("test", "1.0")
+    assert loader.valid()
+    assert loader.module.maintainer == example_builder.module.maintainer
+    assert [str(p) for p in loader.module.paths] == ["prepend-path PATH $basedir/bin"]
+    # the path link itself was not exported
+    assert not loader.path_exists(loader.module.paths[0])
+
+
+def test_snapshot_links(example_builder, other_module_tree, bindir):
+    example_builder.add_path(bindir, moduledev.Path("bin"))
+    example_builder.save_module_file()
+    other_module_tree.setup("test", export(example_builder.module_tree, True))
+    loader = other_module_tree.load_module("test", "1.0")
+    assert loader.path_exists(loader.module.paths[0])
+
+
+def test_snapshot_import_conflict(example_builder):
+    f = export(example_builder.module_tree)
+    with pytest.raises(ValueError):
+        snapshot.import_snapshot(example_builder.module_tree, f)
+    f.seek(0)
+    snapshot.import_snapshot(example_builder.module_tree, f, overwrite=True)
+    assert example_builder.valid()
+
+
+def test_snapshot_import_renders_lua(example_builder):
+    tree = example_builder.module_tree
+    example_builder.module.description = "exported"
+    example_builder.save_module_file()
+    f = export(tree)
+    moduledev.TreeRenderer(tree, "lua").run()
+    example_builder.module.description = "changed"
+    example_builder.save_module_file()
+    snapshot.import_snapshot(tree, f, overwrite=True)
+    with open(render.lua_path(example_builder)) as lua:
+        assert 'whatis("exported")' in lua.read()
+
+
+def test_bad_snapshot(example_module_tree):
+    with pytest.raises(ValueError):
+        snapshot.import_snapshot(example_module_tree, io.BytesIO(b"garbage"))
+
+
+def test_snapshot_outside_of_tree(example_module_tree, tmpdir):
+    header = {"type": "header", "format": snapshot.SNAPSHOT_FORMAT, "name": "test"}
+    for records in [
+        [{"type": "file", "path": "../evil", "content": "x"}],
+        [{"type": "dir", "path": "/tmp/evil"}],
+        [
+            {"type": "link", "path": "escape", "target": str(tmpdir)},
+            {"type": "file", "path": "escape/evil", "content": "x"},
+        ],
+    ]:
+        f = io.BytesIO()
+        with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+            for record in [header] + records:
+                gz.write((json.dumps(record) + "\n").encode())
+        f.seek(0)
+        with pytest.raises(ValueError):
+            snapshot.import_snapshot(example_module_tree, f)
+    assert not os.path.exists(tmpdir / "evil")
+    assert not os.path.exists("/tmp/evil")
@@ -0,0 +1,72 @@
+import os
+
+import moduledev
+from moduledev.sync import rewrite_modulebase
+
+
+def test_rewrite_modulebase():
+    text = "#%Module1.0\nset MODULEBASE /old/root\nset basedir $MODULEBASE\n"
+    assert rewrite_modulebase(text, "/new/root") == (
+        "#%Module1.0\nset MODULEBASE /new/root\nset basedir $MODULEBASE\n"
+    )
+
+
+def test_sync(example_builder, bindir, tmpdir):
+    example_builder.add_path(bindir, moduledev.Path("bin"), link=False)
+    example_builder.save_module_file()
+    dest = tmpdir / "dest"
+    tree_sync = moduledev.TreeSync(example_builder.module_tree, dest)
+    result = tree_sync.run()
+    assert "test/1.0/bin/script" in result.copied
+
+    dest_tree = moduledev.ModuleTree(dest)
+    assert dest_tree.valid()
+    assert f"set MODULEBASE {dest}\n" in open(dest_tree.master_module_file()).read()
+    loader = dest_tree.load_module("test", "1.0")
+    assert loader.valid()
+    assert loader.path_exists(loader.module.paths[0])
+
+    result = tree_sync.run()
+    assert result.changed() == 0
+    assert dest_tree.backend() == "tcl"
+    moduledev.TreeRenderer(example_builder.module_tree, "lua").run()
+    assert "test/1.0.lua" in "\n".join(tree_sync.run().copied)
+    assert dest_tree.backend() == "lua"
+
+    os.unlink(bindir / "script")
+    os.unlink(example_builder.module_path() + "/bin/script")
+    result = tree_sync.run()
+    assert result.removed == ["test/1.0/bin/script"]
+    assert not os.path.exists(dest / "test" / "1.0" / "bin" / "script")
+
+
+def test_sync_touched_file(example_builder, tmpdir):
+    dest = tmpdir / "dest"
+    tree_sync = moduledev.TreeSync(example_builder.module_tree, dest)
+    tree_sync.run()
+    dotfile = example_builder.moduledotfile_path()
+    os.utime(dotfile, (0, 0))
+    result = tree_sync.run()
+    assert result.copied == []
+    assert result.unchanged > 0
+    with open(dotfile, "a") as f:
+        f.write("set EXTRA 1\n")
+    result = tree_sync.run()
+    assert result.copied == ["test/.modulefile"]
+
+
+def test_sync_categories(example_module, example_module_tree, tmpdir):
+    example_module_tree.init_module(example_module)
+    example_module.name = "other"
+    example_module.category = "othercategory"
+    example_module_tree.init_module(example_module)
+    dest = tmpdir / "dest"
+    moduledev.TreeSync(example_module_tree, dest, ["othercategory"]).run()
+    assert [m.name for m in moduledev.ModuleTree(dest).modules()] == ["other"]
+
+
+def test_sync_dry_run(example_builder, tmpdir):
+    dest = tmpdir / "dest"
+    result = moduledev.TreeSync(example_builder.module_tree, dest).run(dry_run=True)
+    assert "test/.modulefile" in result.copied
+    assert not os.path.exists(dest)
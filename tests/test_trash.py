@@ -0,0 +1,112 @@
+import errno
+import os
+
+import pytest
+
+import moduledev
+from moduledev import trash
+
+
+def test_put_and_restore(example_builder, example_module):
+    tree = example_builder.module_tree
+    with open(os.path.join(example_builder.module_path(), "data"), "w") as f:
+        f.write("data")
+    example_module.version = "2.0"
+    second = tree.init_module(example_module)
+    tree_trash = moduledev.Trash(tree)
+
+    entry = tree_trash.put(second)
+    assert not entry.removed_base
+    assert not os.path.lexists(second.modulefile_path())
+    assert not os.path.exists(second.module_path())
+    assert tree.load_module("test").version() == "1.0"
+
+    entry = tree_trash.put(tree.load_module("test"))
+    assert entry.removed_base
+    assert not os.path.exists(example_builder.module_base())
+    assert not os.path.exists(example_builder.modulefile_base())
+    assert os.path.exists(os.path.join(entry.version_path(), "data"))
+    assert [e.version for e in tree_trash.entries()] == ["2.0", "1.0"]
+
+    assert tree_trash.find("test").version == "1.0"
+    assert tree_trash.find("test", "2.0").version == "2.0"
+    assert tree_trash.find("other") is None
+    tree_trash.find("test").restore(tree)
+    assert tree.load_module("test").version() == "1.0"
+    assert tree.load_module("test", "1.0").valid()
+    tree.init_module(example_module)
+    with pytest.raises(ValueError):
+        tree_trash.find("test").restore(tree)
+    assert [e.version for e in tree_trash.entries()] == ["2.0"]
+
+
+def test_empty(example_builder):
+    tree = example_builder.module_tree
+    tree_trash = moduledev.Trash(tree)
+    entry = tree_trash.put(example_builder)
+    assert tree_trash.expired(60) == []
+    assert tree_trash.expired(60, now=entry.at + 60)[0].path == entry.path
+    trash.main([tree.root_dir, "0"])
+    assert tree_trash.entries() == []
+    assert os.listdir(tree.trash_dir()) == []
+
+
+def cross_device_rename(tree, rename):
+    """Return os.rename failing with EXDEV for moves into the trash"""
+
+    def _rename(src, dst):
+        if str(dst).startswith(tree.trash_dir()):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        return rename(src, dst)
+
+    return _rename
+
+
+def test_put_across_devices(example_builder, example_module, monkeypatch):
+    tree = example_builder.module_tree
+    example_module.version = "2.0"
+    tree.init_module(example_module)
+    monkeypatch.setattr(os, "rename", cross_device_rename(tree, os.rename))
+    tree_trash = moduledev.Trash(tree)
+    assert tree_trash.put(tree.load_module("test", "2.0")) is None
+    assert tree.load_module("test").version() == "1.0"
+    assert tree_trash.put(tree.load_module("test", "1.0")) is None
+    assert not os.path.exists(example_builder.module_base())
+    assert not os.path.exists(example_builder.modulefile_base())
+    assert tree_trash.entries() == []
+    assert moduledev.Journal(tree).pending() == []
+
+
+def test_restore_without_base(example_builder, example_module):
+    tree = example_builder.module_tree
+    tree_trash = moduledev.Trash(tree)
+    example_module.version = "1.1"
+    tree.init_module(example_module)
+    first = tree_trash.put(tree.load_module("test", "1.0"))
+    assert tree_trash.put(tree.load_module("test", "1.1")).removed_base
+    with pytest.raises(ValueError):
+        first.restore(tree)
+    assert os.path.exists(first.version_path())
+
+    example_module.name, example_module.shared = "detached", False
+    for version in ["1.0", "1.1"]:
+        example_module.version = version
+        tree.init_module(example_module)
+    first = tree_trash.put(tree.load_module("detached", "1.0"))
+    assert tree_trash.put(tree.load_module("detached", "1.1")).removed_base
+    first.restore(tree)
+    assert tree.load_module("detached").version() == "1.0"
+    assert tree.load_module("detached", "1.0").valid()
+
+
+def test_single_worker(example_builder):
+    tree = example_builder.module_tree
+    tree_trash = moduledev.Trash(tree)
+    tree_trash.put(example_builder)
+    fd = tree_trash.lock_worker()
+    trash.main([tree.root_dir, "0"])
+    assert len(tree_trash.entries()) == 1
+    assert tree_trash.lock_worker() is None
+    os.close(fd)
+    trash.main([tree.root_dir, "0"])
+    assert tree_trash.entries() == []
@@ -0,0 +1,49 @@
+import os
+
+import moduledev
+from moduledev import usage
+
+
+def write(path, size):
+    with open(path, "w") as f:
+        f.write("x" * size)
+
+
+def test_format_size():
+    assert usage.format_size(10) == "10B"
+    assert usage.format_size(2048) == "2.0K"
+    assert usage.format_size(3 * 1024**3) == "3.0G"
+
+
+def test_disk_usage(example_builder, example_module, tmpdir):
+    tree = example_builder.module_tree
+    path = example_builder.module_path()
+    os.mkdir(os.path.join(path, "lib"))
+    write(os.path.join(path, "lib", "big"), 100000)
+    os.link(os.path.join(path, "lib", "big"), os.path.join(path, "lib", "same"))
+    os.symlink(tmpdir, os.path.join(path, "bin"))
+    os.symlink("big", os.path.join(path, "lib", "alias"))
+    example_module.version = "2.0"
+    other = tree.init_module(example_module).module_path()
+    os.link(os.path.join(path, "lib", "big"), os.path.join(other, "big"))
+
+    disk_usage = moduledev.usage.DiskUsage(tree, jobs=2)
+    versions = disk_usage.versions(all_versions=True)
+    assert versions == [("test", "1.0"), ("test", "2.0")]
+    assert disk_usage.versions() == [("test", "2.0")]
+    first, second = disk_usage.usage(versions)
+    assert first.files == 2
+    assert first.external == {"bin": str(tmpdir)}
+    big = os.stat(os.path.join(path, "lib", "big")).st_blocks * 512
+    assert first.size >= big and first.size < 2 * big
+    assert disk_usage.total([first, second]) == first.size + second.size - big
+
+    # cached results are only recomputed when a directory changes
+    scanned = []
+    scan = disk_usage._scan
+    disk_usage._scan = lambda *v: scanned.append(v) or scan(*v)
+    assert disk_usage.usage(versions)[0].size == first.size
+    assert scanned == []
+    write(os.path.join(path, "lib", "new"), 10)
+    assert disk_usage.usage(versions)[0].files == 3
+    assert scanned == [("test", "1.0")]
@@ -0,0 +1,47 @@
+import pytest
+
+from moduledev import versionspec
+
+VERSIONS = ["1.2", "1.4", "1.4.2", "1.10", "2.0", "2.1", "2.10", "2.10.1", "3"]
+
+
+@pytest.fixture
+def index():
+    return versionspec.VersionIndex(VERSIONS)
+
+
+def test_is_constraint():
+    assert not versionspec.is_constraint("1.2")
+    assert not versionspec.is_constraint(None)
+    assert versionspec.is_constraint(">=1.2")
+    assert versionspec.is_constraint("1.*")
+
+
+def test_select(index):
+    assert index.select(">=2.1,<3") == ["2.1", "2.10", "2.10.1"]
+    assert index.select("2.10.*") == ["2.10", "2.10.1"]
+    assert index.select("~=1.4") == ["1.4", "1.4.2", "1.10"]
+    assert index.select("~=1.4.0") == ["1.4", "1.4.2"]
+    assert index.select("==3.0") == ["3"]
+    assert index.select("2.0") == ["2.0"]
+    assert index.select(">1.4,!=1.10,<=2") == ["1.4.2", "2.0"]
+    assert index.select("!=2.*,>=2") == ["3"]
+    assert index.select(">3") == []
+
+
+def test_best(index):
+    assert index.best() == "3"
+    assert index.best("<2") == "1.10"
+    assert index.best("4.*") is None
+
+
+def test_matches():
+    assert versionspec.VersionConstraint(">=1.0").matches("1.2.5b")
+    assert not versionspec.VersionConstraint("1.2.*").matches("1.3")
+
+
+def test_invalid_constraint():
+    with pytest.raises(ValueError):
+        versionspec.VersionConstraint(">>1.0")
+    with pytest.raises(ValueError):
+        versionspec.VersionConstraint(">=1.*")